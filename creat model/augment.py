@@ -0,0 +1,222 @@
+# Streaming augmentation for the uint8 arrays from dataset_cache.py. The
+# transforms from Xu_Ly_Anh.ipynb (rotate +-15 degrees, 5x5 Gaussian blur,
+# brightness x1.3, horizontal flip, Gaussian noise) run on whole batches in
+# NumPy while training, so only the original images stay on disk.
+#
+# Every batch draws from its own generator seeded by (seed, epoch, batch), so
+# a run is reproducible whatever the number of workers.
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+
+# Copies Xu_Ly_Anh.ipynb used to write next to the originals
+AUGMENTED_RE = re.compile(r"_(rotated|blurred|bright|flipped|noisy)\.[^.]+$", re.IGNORECASE)
+
+# Chance of each transform per image and its parameters, matching the notebook
+DEFAULT_OPS = {
+    "rotate": {"p": 0.5, "angles": (-15, 15)},
+    "flip": {"p": 0.5},
+    "brightness": {"p": 0.3, "factor": 1.3},
+    "blur": {"p": 0.3, "ksize": 5},
+    "noise": {"p": 0.2, "std": 15.0},
+}
+
+
+def is_augmented(filename):
+    return AUGMENTED_RE.search(filename) is not None
+
+
+# Boolean mask of the rows that are originals rather than stored augmented copies
+def original_mask(filenames):
+    return np.array([not is_augmented(name) for name in filenames], dtype=bool)
+
+
+# Same sigma cv2.getGaussianKernel picks for sigma=0
+def gaussian_kernel(ksize):
+    sigma = 0.3 * ((ksize - 1) * 0.5 - 1) + 0.8
+    x = np.arange(ksize, dtype=np.float32) - (ksize - 1) / 2
+    kernel = np.exp(-(x * x) / (2 * sigma * sigma))
+    return kernel / kernel.sum()
+
+
+# cv2.BORDER_REFLECT (edge pixel repeated) for integer coordinates
+def _reflect(i, n):
+    i = np.mod(i, 2 * n)
+    return np.where(i >= n, 2 * n - 1 - i, i)
+
+
+# Bilinear sampling map for a rotation about the centre, like
+# cv2.warpAffine: flat source indices of the four neighbours of each output
+# pixel and their weights. The angles are a handful of fixed values, so maps are cached.
+@lru_cache(maxsize=32)
+def _rotation_map(angle, h, w):
+    theta = np.deg2rad(angle)
+    cos, sin = np.cos(theta), np.sin(theta)
+    ys, xs = np.mgrid[0:h, 0:w].astype(np.float64)
+    dx, dy = xs - w / 2, ys - h / 2
+    # Inverse map: where each output pixel comes from in the source image
+    src_x = cos * dx - sin * dy + w / 2
+    src_y = sin * dx + cos * dy + h / 2
+    x0, y0 = np.floor(src_x), np.floor(src_y)
+    fx, fy = (src_x - x0).ravel(), (src_y - y0).ravel()
+    x0, y0 = x0.astype(np.intp).ravel(), y0.astype(np.intp).ravel()
+    x1, y1 = _reflect(x0 + 1, w), _reflect(y0 + 1, h)
+    x0, y0 = _reflect(x0, w), _reflect(y0, h)
+    index = np.stack([y0 * w + x0, y0 * w + x1, y1 * w + x0, y1 * w + x1])
+    weights = np.stack([(1 - fx) * (1 - fy), fx * (1 - fy), (1 - fx) * fy, fx * fy]).astype(np.float32)
+    return index, weights
+
+
+# Rotates each image of a float32 (B, H, W) batch by its own angle (degrees)
+def rotate(batch, angles):
+    b, h, w = batch.shape
+    angles = np.asarray(angles, dtype=np.float64)
+    flat = batch.reshape(b, h * w)
+    out = np.empty_like(flat)
+    for angle in np.unique(angles):
+        rows = np.flatnonzero(angles == angle)
+        index, weights = _rotation_map(float(angle), h, w)
+        src = flat[rows]
+        out[rows] = sum(src[:, index[i]] * weights[i] for i in range(4))
+    return out.reshape(b, h, w)
+
+
+# Separable Gaussian blur over a (B, H, W) batch, cv2.GaussianBlur's default border
+def blur(batch, ksize=5):
+    kernel = gaussian_kernel(ksize)
+    r = ksize // 2
+    h, w = batch.shape[1:]
+    padded = np.pad(batch, ((0, 0), (0, 0), (r, r)), mode='reflect')
+    rows = sum(k * padded[:, :, i:i + w] for i, k in enumerate(kernel))
+    padded = np.pad(rows, ((0, 0), (r, r), (0, 0)), mode='reflect')
+    return sum(k * padded[:, i:i + h, :] for i, k in enumerate(kernel))
+
+
+# Applies DEFAULT_OPS-style `ops` to a uint8 (B, H, W) batch and returns
+# float32 (B, H, W, 1) in [0, 1], ready for the model
+def augment_batch(images, rng, ops=None):
+    ops = DEFAULT_OPS if ops is None else ops
+    batch = np.asarray(images, dtype=np.float32)
+    n = len(batch)
+
+    def pick(name):
+        op = ops.get(name)
+        if not op or op["p"] <= 0:
+            return None
+        return np.flatnonzero(rng.random(n) < op["p"])
+
+    sel = pick("rotate")
+    if sel is not None and len(sel):
+        batch[sel] = rotate(batch[sel], rng.choice(ops["rotate"]["angles"], size=len(sel)))
+    sel = pick("flip")
+    if sel is not None and len(sel):
+        batch[sel] = batch[sel, :, ::-1]
+    sel = pick("brightness")
+    if sel is not None and len(sel):
+        batch[sel] = np.minimum(batch[sel] * np.float32(ops["brightness"]["factor"]), 255)
+    sel = pick("blur")
+    if sel is not None and len(sel):
+        batch[sel] = blur(batch[sel], ops["blur"]["ksize"])
+    sel = pick("noise")
+    if sel is not None and len(sel):
+        noise = rng.standard_normal(batch[sel].shape, dtype=np.float32) * np.float32(ops["noise"]["std"])
+        batch[sel] += noise
+
+    # Clipped instead of wrapping around as the old uint8 noise did
+    np.clip(batch, 0, 255, out=batch)
+    batch *= np.float32(1 / 255.0)
+    return batch[..., np.newaxis]
+
+
+# Shuffled, augmented (x, y) batches over uint8 `images` (e.g. the memmap
+# from load_dataset). Batches are built on `workers` threads, up to
+# `prefetch` ahead of the trainer; NumPy releases the GIL for the heavy
+# array work. Each pass over the object is one epoch.
+class AugmentedBatches:
+    def __init__(self, images, labels, batch_size=32, seed=0, ops=None, shuffle=True,
+                 workers=None, prefetch=4, drop_last=False):
+        self.images = images
+        self.labels = np.asarray(labels)
+        self.batch_size = batch_size
+        self.seed = seed
+        self.ops = ops
+        self.shuffle = shuffle
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.prefetch = max(prefetch, self.workers)
+        self.drop_last = drop_last
+        self.epoch = 0
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.labels) // self.batch_size
+        return -(-len(self.labels) // self.batch_size)
+
+    def _order(self, epoch):
+        if not self.shuffle:
+            return np.arange(len(self.labels))
+        return np.random.default_rng([self.seed, epoch]).permutation(len(self.labels))
+
+    def batch(self, epoch, number, order=None):
+        order = self._order(epoch) if order is None else order
+        rows = np.sort(order[number * self.batch_size:(number + 1) * self.batch_size])
+        rng = np.random.default_rng([self.seed, epoch, number])
+        # Sorted rows keep memmap reads sequential; shuffle the batch back afterwards
+        perm = rng.permutation(len(rows))
+        x = augment_batch(self.images[rows], rng, self.ops)[perm]
+        return x, self.labels[rows][perm]
+
+    def __iter__(self):
+        epoch, self.epoch = self.epoch, self.epoch + 1
+        order = self._order(epoch)
+        count = len(self)
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="augment") as pool:
+            pending = [pool.submit(self.batch, epoch, i, order) for i in range(min(self.prefetch, count))]
+            for i in range(count):
+                x, y = pending[i].result()
+                pending[i] = None
+                if i + self.prefetch < count:
+                    pending.append(pool.submit(self.batch, epoch, i + self.prefetch, order))
+                yield x, y
+
+    # Endless batches for model.fit(..., steps_per_epoch=len(batches))
+    def repeat(self):
+        while True:
+            yield from self
+
+    # tf.data wrapper; every epoch of the dataset is a fresh pass with new augmentations
+    def as_tf_dataset(self):
+        import tensorflow as tf
+        h, w = self.images.shape[1:3]
+        spec = (tf.TensorSpec((None, h, w, 1), tf.float32), tf.TensorSpec((None,), tf.as_dtype(self.labels.dtype)))
+        return tf.data.Dataset.from_generator(lambda: iter(self), output_signature=spec).prefetch(tf.data.AUTOTUNE)
+
+
+def main():
+    import argparse
+    import time
+    from dataset_cache import load_dataset
+
+    parser = argparse.ArgumentParser(description="Measure augmentation throughput on the dataset cache")
+    parser.add_argument('--cache', default="dataset_cache")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    images, labels, filenames = load_dataset(args.cache)
+    keep = original_mask(filenames)
+    batches = AugmentedBatches(images[keep], labels[keep], args.batch_size, args.seed, workers=args.workers)
+    print(f"{int(keep.sum())} original image(s), {int((~keep).sum())} stored augmented cop(ies) ignored")
+    for epoch in range(args.epochs):
+        started = time.perf_counter()
+        n = sum(len(y) for _, y in batches)
+        seconds = time.perf_counter() - started
+        print(f"epoch {epoch}: {n} images in {seconds:.3f}s ({n / seconds:.0f} images/s)")
+
+
+if __name__ == '__main__':
+    main()
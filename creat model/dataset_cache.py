@@ -0,0 +1,178 @@
+# Packed training dataset cache: the images listed in image_labels.csv are
+# decoded once, in parallel, into one uint8 array (images.npy, N x 96 x 96)
+# plus labels.npy and an index of filenames with their mtime/size/hash.
+# Later builds only re-decode files that changed; training memory-maps the arrays.
+#
+#   python dataset_cache.py --csv image_labels.csv --images ../img_train --out dataset_cache
+import argparse
+import csv
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+try:
+    import cv2
+    DECODER = "cv2"
+except ImportError:
+    cv2 = None
+    from PIL import Image
+    DECODER = "pil"
+
+IMAGE_SIZE = (96, 96)
+INDEX_VERSION = 1
+
+
+# Same preprocessing as Done_Model.ipynb (grayscale, resized to 96x96),
+# kept as uint8; scaling to [0, 1] happens at training time
+def decode_image(path, size=IMAGE_SIZE):
+    if cv2 is not None:
+        img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            return None
+        return cv2.resize(img, size)
+    try:
+        with Image.open(path) as img:
+            return np.asarray(img.convert('L').resize(size, Image.BILINEAR), dtype=np.uint8)
+    except OSError:
+        return None
+
+
+def file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+
+def _decode_chunk(paths):
+    return [decode_image(path) for path in paths]
+
+
+def read_labels(csv_path):
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        return [(row['filename'], int(row['label'])) for row in csv.DictReader(f)]
+
+
+def _load_index(out_dir):
+    path = os.path.join(out_dir, "index.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        index = json.load(f)
+    if index.get("version") != INDEX_VERSION or index.get("decoder") != DECODER \
+            or tuple(index.get("image_size", ())) != IMAGE_SIZE:
+        return None
+    return index
+
+
+# Builds or refreshes the cache and returns a summary
+def build_cache(csv_path, image_dir, out_dir, workers=None, use_hash=False, chunk_size=64, log=print):
+    started = time.perf_counter()
+    os.makedirs(out_dir, exist_ok=True)
+    rows = read_labels(csv_path)
+
+    old_index = _load_index(out_dir)
+    old_images = None
+    old_entries = {}
+    if old_index is not None:
+        old_images = np.load(os.path.join(out_dir, "images.npy"), mmap_mode='r')
+        old_entries = {e["filename"]: (i, e) for i, e in enumerate(old_index["entries"])}
+
+    # Work out which files can be copied from the previous cache
+    entries, reuse, todo, missing = [], {}, [], 0
+    for filename, label in rows:
+        path = os.path.join(image_dir, filename)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            missing += 1
+            continue
+        entry = {"filename": filename, "label": label, "mtime_ns": st.st_mtime_ns, "size": st.st_size}
+        if use_hash:
+            entry["hash"] = file_hash(path)
+        old = old_entries.get(filename)
+        if old is not None:
+            old_row, old_entry = old
+            if use_hash and old_entry.get("hash") == entry["hash"]:
+                reuse[len(entries)] = old_row
+            elif not use_hash and (old_entry["mtime_ns"], old_entry["size"]) == (st.st_mtime_ns, st.st_size):
+                reuse[len(entries)] = old_row
+        if len(entries) not in reuse:
+            todo.append(len(entries))
+        entries.append(entry)
+
+    # Decode changed files across processes, in chunks to keep IPC overhead low
+    decoded = {}
+    if todo:
+        chunks = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(_decode_chunk, [[os.path.join(image_dir, entries[i]["filename"]) for i in chunk]
+                                               for chunk in chunks])
+            for chunk, images in zip(chunks, results):
+                decoded.update(zip(chunk, images))
+
+    # Unreadable images are skipped, as in the notebook
+    keep = [i for i in range(len(entries)) if i in reuse or decoded.get(i) is not None]
+    failed = len(entries) - len(keep)
+
+    tmp_images = os.path.join(out_dir, "images.npy.tmp")
+    images = np.lib.format.open_memmap(tmp_images, mode='w+', dtype=np.uint8, shape=(len(keep),) + IMAGE_SIZE[::-1])
+    for row, i in enumerate(keep):
+        images[row] = old_images[reuse[i]] if i in reuse else decoded[i]
+    images.flush()
+    del images, old_images
+
+    labels = np.array([entries[i]["label"] for i in keep], dtype=np.uint8)
+    index = {"version": INDEX_VERSION, "decoder": DECODER, "image_size": list(IMAGE_SIZE),
+             "hashed": use_hash, "entries": [entries[i] for i in keep]}
+    tmp_labels = os.path.join(out_dir, "labels.npy.tmp")
+    with open(tmp_labels, 'wb') as f:
+        np.save(f, labels)
+    tmp_index = os.path.join(out_dir, "index.json.tmp")
+    with open(tmp_index, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    # index.json goes last so a crash mid-build leaves the old cache or a full rebuild
+    os.replace(tmp_images, os.path.join(out_dir, "images.npy"))
+    os.replace(tmp_labels, os.path.join(out_dir, "labels.npy"))
+    os.replace(tmp_index, os.path.join(out_dir, "index.json"))
+
+    summary = {"images": len(keep), "decoded": len(todo) - failed, "reused": len(reuse),
+               "failed": failed, "missing": missing, "decoder": DECODER,
+               "seconds": round(time.perf_counter() - started, 3)}
+    if log:
+        log(f"Dataset cache {out_dir}: {summary}")
+    return summary
+
+
+# (images uint8 N x 96 x 96, labels, filenames); images are memory-mapped by default
+def load_dataset(out_dir, mmap=True):
+    images = np.load(os.path.join(out_dir, "images.npy"), mmap_mode='r' if mmap else None)
+    labels = np.load(os.path.join(out_dir, "labels.npy"))
+    with open(os.path.join(out_dir, "index.json"), encoding='utf-8') as f:
+        filenames = [e["filename"] for e in json.load(f)["entries"]]
+    return images, labels, filenames
+
+
+# uint8 N x 96 x 96 -> float32 N x 96 x 96 x 1 in [0, 1], without a float64 copy
+def to_model_input(images):
+    out = np.empty(images.shape + (1,), dtype=np.float32)
+    np.multiply(images[..., np.newaxis], np.float32(1 / 255.0), out=out)
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the packed training dataset cache")
+    parser.add_argument('--csv', default="image_labels.csv")
+    parser.add_argument('--images', default=os.path.join("..", "img_train"))
+    parser.add_argument('--out', default="dataset_cache")
+    parser.add_argument('--workers', type=int, default=None, help="Decode processes (default: CPU count)")
+    parser.add_argument('--hash', action='store_true',
+                        help="Detect changes by content hash instead of mtime and size")
+    args = parser.parse_args()
+    build_cache(args.csv, args.images, args.out, workers=args.workers, use_hash=args.hash)
+
+
+if __name__ == '__main__':
+    main()
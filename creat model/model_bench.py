@@ -0,0 +1,309 @@
+# Int8 conversion calibrated on real frames, and a side-by-side benchmark of
+# the model variants (Keras .h5, float .tflite, int8 .tflite) on a fixed
+# held-out set: per-invoke latency (single and batched, per thread count),
+# file size, peak memory, accuracy, recall and AUC.
+#
+#   python model_bench.py convert --h5 fall_model.h5 --out fall_model_int8.tflite
+#   python model_bench.py bench fall_model.h5 fall_model.tflite ../sever/fall_model_int8.tflite
+#
+# TFLite models run through the server's own backends and input encoding
+# (sever/backends.py, sever/inference.py), so the numbers match what the
+# server sees. The .h5 variant and conversion need TensorFlow.
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from augment import original_mask
+from dataset_cache import load_dataset, to_model_input
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sever"))
+from backends import load_backend  # noqa: E402
+from inference import decode_scores, input_lut  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+# Same split as train_test_split(test_size=0.2, random_state=42) in
+# Done_Model.ipynb, without needing scikit-learn: (train rows, test rows)
+def holdout_split(n, test_size=0.2, seed=42):
+    n_test = int(np.ceil(test_size * n))
+    order = np.random.RandomState(seed).permutation(n)
+    return order[n_test:], order[:n_test]
+
+
+# (train images, train labels, test images, test labels) from the dataset
+# cache, originals only, uint8 N x 96 x 96
+def load_split(cache_dir, test_size=0.2, seed=42):
+    images, labels, filenames = load_dataset(cache_dir)
+    keep = original_mask(filenames)
+    images, labels = np.asarray(images[keep]), labels[keep]
+    train, test = holdout_split(len(labels), test_size, seed)
+    return images[train], labels[train], images[test], labels[test]
+
+
+# Calibration frames for the int8 converter: a fixed random sample of real
+# training frames, preprocessed exactly like training input
+def representative_dataset(images, samples=200, seed=0):
+    rows = np.random.default_rng(seed).choice(len(images), size=min(samples, len(images)), replace=False)
+    frames = to_model_input(images[np.sort(rows)])
+
+    def gen():
+        for frame in frames:
+            yield [frame[np.newaxis]]
+    return gen
+
+
+def convert_int8(h5_path, out_path, calibration_images, samples=200):
+    import tensorflow as tf
+    model = tf.keras.models.load_model(h5_path)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset(calibration_images, samples)
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.int8
+    converter.inference_output_type = tf.int8
+    data = converter.convert()
+    with open(out_path, 'wb') as f:
+        f.write(data)
+    return len(data)
+
+
+# Older models (e.g. the 48x48 fall_model.tflite) take a smaller frame
+def resize_frames(frames, size):
+    if frames.shape[1:3] == tuple(size):
+        return frames
+    from PIL import Image
+    return np.stack([np.asarray(Image.fromarray(f).resize((size[1], size[0]), Image.BILINEAR)) for f in frames])
+
+
+# Runs uint8 N x 96 x 96 batches through a TFLite interpreter the way
+# InferenceEngine does and returns fall scores
+class TfliteRunner:
+    def __init__(self, model_path, num_threads, backend='auto'):
+        self.backend, interpreter_cls = load_backend(backend, model_path)
+        self.interpreter = interpreter_cls(model_path=model_path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self.input_detail = self.interpreter.get_input_details()[0]
+        self.output_detail = self.interpreter.get_output_details()[0]
+        self.frame_shape = tuple(self.input_detail['shape'][1:])
+        self.lut = input_lut(self.input_detail)
+        self._batch = 1
+
+    def _resize(self, n):
+        if n != self._batch:
+            self.interpreter.resize_tensor_input(self.input_detail['index'], (n,) + self.frame_shape)
+            self.interpreter.allocate_tensors()
+            self._batch = n
+
+    def encode(self, frames):
+        return np.take(self.lut, resize_frames(frames, self.frame_shape[:2]).reshape((len(frames),) + self.frame_shape))
+
+    def invoke(self, encoded):
+        self._resize(len(encoded))
+        self.interpreter.set_tensor(self.input_detail['index'], encoded)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_detail['index'])
+
+    def scores(self, output):
+        return np.array(decode_scores(output, self.output_detail), dtype=np.float32)
+
+
+class KerasRunner:
+    def __init__(self, model_path, num_threads):
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+        self.backend = f"tensorflow {tf.__version__}"
+        self.model = tf.keras.models.load_model(model_path)
+
+    def encode(self, frames):
+        return to_model_input(frames)
+
+    def invoke(self, encoded):
+        return self.model(encoded, training=False).numpy()
+
+    def scores(self, output):
+        return np.array(decode_scores(output, {'quantization': (0.0, 0)}), dtype=np.float32)
+
+
+# Area under the ROC curve from the rank-sum statistic (ties count half)
+def roc_auc(labels, scores):
+    labels = np.asarray(labels).astype(bool)
+    n_pos, n_neg = labels.sum(), (~labels).sum()
+    if not n_pos or not n_neg:
+        return None
+    order = np.argsort(scores, kind='mergesort')
+    ranks = np.empty(len(scores), dtype=np.float64)
+    sorted_scores = np.asarray(scores)[order]
+    # Average ranks over ties
+    _, first, counts = np.unique(sorted_scores, return_index=True, return_counts=True)
+    for start, count in zip(first, counts):
+        ranks[order[start:start + count]] = start + (count + 1) / 2
+    return float((ranks[labels].sum() - n_pos * (n_pos + 1) / 2) / (n_pos * n_neg))
+
+
+def classification(labels, scores, threshold=0.5):
+    labels = np.asarray(labels).astype(bool)
+    predicted = np.asarray(scores) > threshold
+    tp = int((predicted & labels).sum())
+    fp = int((predicted & ~labels).sum())
+    fn = int((~predicted & labels).sum())
+    auc = roc_auc(labels, scores)
+    return {
+        "accuracy": round(float((predicted == labels).mean()), 4),
+        "recall": round(tp / (tp + fn), 4) if tp + fn else None,
+        "precision": round(tp / (tp + fp), 4) if tp + fp else None,
+        "auc": round(auc, 4) if auc is not None else None,
+    }
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+# Latency percentiles in milliseconds for `runs` invokes of one batch
+def _time_invokes(runner, encoded, runs, warmup):
+    for _ in range(warmup):
+        runner.invoke(encoded)
+    times = np.empty(runs)
+    for i in range(runs):
+        started = time.perf_counter()
+        runner.invoke(encoded)
+        times[i] = time.perf_counter() - started
+    times *= 1000
+    return {"p50_ms": round(float(np.median(times)), 3), "p95_ms": round(float(np.percentile(times, 95)), 3),
+            "per_frame_ms": round(float(np.median(times)) / len(encoded), 3)}
+
+
+# Benchmarks one variant at one thread count; runs in its own process so
+# the peak memory belongs to this model alone
+def measure(model_path, num_threads, frames, labels, batch_sizes, runs, warmup, threshold, backend='auto'):
+    started = time.perf_counter()
+    baseline = _peak_rss_mb()
+    if model_path.endswith('.h5') or model_path.endswith('.keras'):
+        runner = KerasRunner(model_path, num_threads)
+    else:
+        runner = TfliteRunner(model_path, num_threads, backend)
+    load_seconds = time.perf_counter() - started
+
+    # Accuracy: the whole held-out set, in batches of the largest size that works
+    outputs = []
+    batch = max(batch_sizes)
+    try:
+        for i in range(0, len(frames), batch):
+            outputs.append(runner.scores(runner.invoke(runner.encode(frames[i:i + batch]))))
+    except Exception:
+        # Batch size baked into the model; fall back to one frame per invoke
+        batch_sizes = [1]
+        outputs = [runner.scores(runner.invoke(runner.encode(frames[i:i + 1]))) for i in range(len(frames))]
+    scores = np.concatenate(outputs)
+
+    latency = {}
+    for size in batch_sizes:
+        encoded = runner.encode(np.resize(frames, (size,) + frames.shape[1:]))
+        latency[str(size)] = _time_invokes(runner, encoded, runs, warmup)
+
+    peak = _peak_rss_mb()
+    return {
+        "model": model_path,
+        "backend": runner.backend,
+        "threads": num_threads,
+        "size_kb": round(os.path.getsize(model_path) / 1024, 1),
+        "load_s": round(load_seconds, 3),
+        "peak_rss_mb": peak,
+        "model_rss_mb": round(peak - baseline, 1) if peak is not None else None,
+        "latency": latency,
+        **classification(labels, scores, threshold),
+    }
+
+
+def benchmark(models, frames, labels, threads=(1, 2, 4), batch_sizes=(1, 8), runs=200, warmup=20,
+              threshold=0.5, backend='auto'):
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for model_path in models:
+        for num_threads in threads:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                try:
+                    results.append(pool.submit(measure, model_path, num_threads, frames, labels, list(batch_sizes),
+                                               runs, warmup, threshold, backend).result())
+                except Exception as e:
+                    results.append({"model": model_path, "threads": num_threads, "error": str(e)})
+    return results
+
+
+def _cell(value):
+    return "-" if value is None else value
+
+
+def print_table(results, batch_sizes):
+    header = f"{'model':<32} {'thr':>3} {'KB':>8} {'peak MB':>7} {'acc':>6} {'recall':>6} {'auc':>6}"
+    for size in batch_sizes:
+        header += f" {f'b{size} p50':>9} {f'b{size} /img':>9}"
+    print(header)
+    for r in results:
+        name = os.path.basename(r["model"])
+        if "error" in r:
+            print(f"{name:<32} {r['threads']:>3} error: {r['error']}")
+            continue
+        line = (f"{name:<32} {r['threads']:>3} {r['size_kb']:>8} {_cell(r['peak_rss_mb']):>7} "
+                f"{r['accuracy']:>6} {_cell(r['recall']):>6} {_cell(r['auc']):>6}")
+        for size in batch_sizes:
+            lat = r["latency"].get(str(size))
+            line += f" {lat['p50_ms']:>9} {lat['per_frame_ms']:>9}" if lat else f" {'-':>9} {'-':>9}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert and benchmark the fall detection models")
+    parser.add_argument('--cache', default="dataset_cache", help="Dataset cache from dataset_cache.py")
+    parser.add_argument('--seed', type=int, default=42, help="Train/test split seed (as in Done_Model.ipynb)")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    convert = sub.add_parser('convert', help="Int8 conversion calibrated on real training frames")
+    convert.add_argument('--h5', default="fall_model.h5")
+    convert.add_argument('--out', default="fall_model_int8.tflite")
+    convert.add_argument('--samples', type=int, default=200)
+
+    bench = sub.add_parser('bench', help="Latency, size, memory and accuracy of each model")
+    bench.add_argument('models', nargs='+')
+    bench.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4])
+    bench.add_argument('--batch', type=int, nargs='+', default=[1, 8])
+    bench.add_argument('--runs', type=int, default=200)
+    bench.add_argument('--warmup', type=int, default=20)
+    bench.add_argument('--threshold', type=float, default=0.5)
+    bench.add_argument('--backend', default='auto')
+    bench.add_argument('--json', help="Also write the results to this file")
+    args = parser.parse_args()
+
+    train_images, train_labels, test_images, test_labels = load_split(args.cache, seed=args.seed)
+    if args.command == 'convert':
+        size = convert_int8(args.h5, args.out, train_images, args.samples)
+        print(f"Wrote {args.out} ({size / 1024:.1f} KB), calibrated on {min(args.samples, len(train_images))} "
+              f"training frame(s)")
+        return
+
+    print(f"Held-out set: {len(test_labels)} frame(s), {int(test_labels.sum())} fall(s)")
+    results = benchmark(args.models, test_images, test_labels, args.threads, args.batch, args.runs, args.warmup,
+                        args.threshold, args.backend)
+    print_table(results, args.batch)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+import numpy as np
+
+from augment import AugmentedBatches, augment_batch, blur, is_augmented, original_mask, rotate
+
+NO_OPS = {}
+
+
+def _images(n=10, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (n, 96, 96), dtype=np.uint8)
+
+
+def test_stored_copies_are_recognised():
+    names = ["a.jpg", "a_rotated.jpg", "b_noisy.PNG", "c_flipped.png", "rotated.jpg"]
+    assert original_mask(names).tolist() == [True, False, False, False, True]
+    assert is_augmented("x_bright.jpeg") and not is_augmented("x_bright_side.jpeg")
+
+
+def test_without_ops_batch_is_only_scaled():
+    images = _images(4)
+    out = augment_batch(images, np.random.default_rng(0), NO_OPS)
+    assert out.shape == (4, 96, 96, 1) and out.dtype == np.float32
+    assert np.allclose(out[..., 0], images / 255.0)
+
+
+def test_transforms_keep_range_and_shape():
+    out = augment_batch(_images(32), np.random.default_rng(1), {
+        "rotate": {"p": 1.0, "angles": (-15, 15)}, "brightness": {"p": 1.0, "factor": 1.3},
+        "blur": {"p": 1.0, "ksize": 5}, "noise": {"p": 1.0, "std": 15.0}})
+    assert out.shape == (32, 96, 96, 1) and out.min() >= 0.0 and out.max() <= 1.0
+
+
+def test_rotate_and_blur_basics():
+    batch = _images(3).astype(np.float32)
+    assert np.allclose(rotate(batch, [0, 0, 0]), batch, atol=1e-3)
+    # Reflected borders: a flat image stays flat whatever the angle
+    flat = np.full((2, 16, 16), 50, dtype=np.float32)
+    assert np.allclose(rotate(flat, [-15, 15]), 50)
+    assert not np.allclose(rotate(batch[:1], [15]), batch[:1], atol=1)
+    assert np.allclose(blur(flat, 5), 50)
+    assert blur(batch, 5).std() < batch.std()
+
+
+def test_batches_are_reproducible_and_cover_every_image():
+    images, labels = _images(10), np.arange(10)
+    first = list(AugmentedBatches(images, labels, batch_size=4, seed=3, workers=3))
+    again = list(AugmentedBatches(images, labels, batch_size=4, seed=3, workers=1))
+    assert [len(y) for _, y in first] == [4, 4, 2]
+    assert sorted(np.concatenate([y for _, y in first]).tolist()) == list(range(10))
+    for (x1, y1), (x2, y2) in zip(first, again):
+        assert np.array_equal(x1, x2) and np.array_equal(y1, y2)
+
+    batches = AugmentedBatches(images, labels, batch_size=4, seed=3, drop_last=True)
+    assert len(batches) == 2
+    epoch0, epoch1 = list(batches), list(batches)
+    assert batches.epoch == 2
+    assert not all(np.array_equal(a[0], b[0]) for a, b in zip(epoch0, epoch1))
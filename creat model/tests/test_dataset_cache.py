@@ -0,0 +1,62 @@
+import csv
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from dataset_cache import build_cache, load_dataset, to_model_input
+
+
+def _write_image(path, value, size=(120, 80)):
+    Image.fromarray(np.full(size[::-1], value, dtype=np.uint8)).save(path)
+
+
+def _write_labels(path, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["filename", "label"])
+        writer.writerows(rows)
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    images = tmp_path / "img"
+    images.mkdir()
+    for i in range(3):
+        _write_image(str(images / f"{i}.png"), 40 * i)
+    (images / "broken.png").write_bytes(b"not an image")
+    csv_path = tmp_path / "labels.csv"
+    _write_labels(csv_path, [("0.png", 0), ("1.png", 1), ("2.png", 0), ("broken.png", 1), ("gone.png", 1)])
+    return str(csv_path), str(images), str(tmp_path / "cache")
+
+
+def test_build_skips_missing_and_unreadable_images(dataset):
+    csv_path, image_dir, out_dir = dataset
+    summary = build_cache(csv_path, image_dir, out_dir, workers=1, log=None)
+    assert (summary["images"], summary["decoded"], summary["failed"], summary["missing"]) == (3, 3, 1, 1)
+
+    images, labels, filenames = load_dataset(out_dir)
+    assert isinstance(images, np.memmap) and images.shape == (3, 96, 96) and images.dtype == np.uint8
+    assert filenames == ["0.png", "1.png", "2.png"]
+    assert labels.tolist() == [0, 1, 0]
+    assert [int(img[0, 0]) for img in images] == [0, 40, 80]
+    x = to_model_input(images)
+    assert x.shape == (3, 96, 96, 1) and x.dtype == np.float32 and x.max() == pytest.approx(80 / 255)
+
+
+@pytest.mark.parametrize("use_hash", [False, True])
+def test_rebuild_only_decodes_changed_files(dataset, use_hash):
+    csv_path, image_dir, out_dir = dataset
+    build_cache(csv_path, image_dir, out_dir, workers=1, use_hash=use_hash, log=None)
+    path = os.path.join(image_dir, "1.png")
+    _write_image(path, 200)
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+    summary = build_cache(csv_path, image_dir, out_dir, workers=1, use_hash=use_hash, log=None)
+    # The broken file is retried every time; it never made it into the cache
+    assert (summary["reused"], summary["decoded"], summary["failed"]) == (2, 1, 1)
+    images, _, _ = load_dataset(out_dir, mmap=False)
+    assert [int(img[0, 0]) for img in images] == [0, 200, 80]
+    assert not any(name.endswith(".tmp") for name in os.listdir(out_dir))
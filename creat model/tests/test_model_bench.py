@@ -0,0 +1,48 @@
+import os
+
+import numpy as np
+import pytest
+
+from model_bench import TfliteRunner, classification, holdout_split, measure, representative_dataset, roc_auc
+
+MODEL = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                     "sever", "fall_model_int8.tflite")
+
+
+def test_holdout_split_is_a_fixed_partition():
+    train, test = holdout_split(10)
+    assert len(test) == 2 and sorted(np.concatenate([train, test]).tolist()) == list(range(10))
+    assert np.array_equal(test, holdout_split(10)[1])
+
+
+def test_representative_dataset_samples_real_frames():
+    images = np.arange(5 * 96 * 96, dtype=np.uint32).reshape(5, 96, 96).astype(np.uint8)
+    frames = [batch[0] for batch in representative_dataset(images, samples=3)()]
+    assert len(frames) == 3 and all(f.shape == (1, 96, 96, 1) and f.dtype == np.float32 for f in frames)
+    assert len(list(representative_dataset(images, samples=50)())) == 5
+
+
+def test_roc_auc_with_ties_and_one_class():
+    assert roc_auc([0, 0, 1, 1], [0.1, 0.2, 0.8, 0.9]) == 1.0
+    assert roc_auc([0, 1, 0, 1], [0.5, 0.5, 0.5, 0.5]) == 0.5
+    assert roc_auc([0, 1, 1], [0.2, 0.1, 0.3]) == 0.5
+    assert roc_auc([1, 1], [0.2, 0.3]) is None
+
+
+def test_classification_metrics():
+    report = classification([1, 1, 0, 0], [0.9, 0.4, 0.6, 0.1])
+    assert report == {"accuracy": 0.5, "recall": 0.5, "precision": 0.5, "auc": 0.75}
+    assert classification([0, 0], [0.1, 0.2])["recall"] is None
+
+
+def test_measure_scores_like_the_server():
+    pytest.importorskip("ai_edge_litert.interpreter")
+    frames = np.random.default_rng(0).integers(0, 256, (6, 96, 96), dtype=np.uint8)
+    labels = np.array([0, 1, 0, 1, 0, 1])
+    runner = TfliteRunner(MODEL, 1)
+    scores = runner.scores(runner.invoke(runner.encode(frames)))
+    assert scores.shape == (6,) and ((scores >= 0) & (scores <= 1)).all()
+
+    result = measure(MODEL, 1, frames, labels, [1, 4], runs=3, warmup=1, threshold=0.5)
+    assert set(result["latency"]) == {"1", "4"}
+    assert result["accuracy"] == classification(labels, scores)["accuracy"]
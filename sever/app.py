@@ -1,19 +1,39 @@
-from flask import Flask, render_template, request, jsonify, Response, send_from_directory
-from flask_socketio import SocketIO
+import os
+# Server mode: 'threading' (default) or 'eventlet'; eventlet has to patch before anything else is imported
+SERVER_MODE = os.environ.get('SERVER_MODE', 'threading')
+if SERVER_MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+    from eventlet import tpool
+
+from flask import Flask, render_template, request, jsonify, Response, send_from_directory, stream_with_context
+from flask_socketio import SocketIO, join_room, leave_room, rooms as joined_rooms
 from datetime import datetime
 import numpy as np
-import tensorflow.lite as tflite
-from PIL import Image
-import os
 import json
 from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-import time
 from bson import ObjectId
 import logging
+from inference import InferenceBusy, InferenceTimeout
+from model_registry import ModelRegistry, UnknownModel
+from worker_pool import ProcessInferenceEngine
+from cascade import Cascade, MotionGate
+from persistence import WriteBehindPipeline
+from frame_policy import FrameRetention, RetentionPolicy
+from fall_state import FallConfirmer, FALL_STATUS, NORMAL_STATUS
+import history
+from devices import DeviceRegistry
+from esp32_client import ESP32Client
+from stream_relay import RelayHub
+import metrics
+import ingest
+from werkzeug.serving import WSGIRequestHandler
+import atexit
+import threading
+from startup import StartupTasks
+from image_store import ImageStore
+from retention import RetentionJob, legacy_url_prefix
+from live import LiveFeed, DeviceStatusFeed, ALL_ROOM, device_room, location_room
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
@@ -26,87 +46,296 @@ class JSONEncoder(json.JSONEncoder):
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 app.json_encoder = JSONEncoder
-socketio = SocketIO(app)
+socketio = SocketIO(app, async_mode=SERVER_MODE)
 
 # Configuration
-UPLOAD_FOLDER = 'static/uploads'
+UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'static/uploads')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
 API_KEY = "08112003"
-MAX_STREAM_CLIENTS = 2
-active_streams = 0
+# Viewers share one upstream connection per camera, so this is bounded by server bandwidth
+MAX_STREAM_VIEWERS = int(os.environ.get('MAX_STREAM_VIEWERS', 50))
+DEFAULT_DEVICE_MAC = os.environ.get('DEFAULT_DEVICE_MAC', "F8:B3:B7:7B:32:A8")
+DEFAULT_DEVICE_IP = os.environ.get('DEFAULT_DEVICE_IP', '192.168.0.101')
+DEVICE_TTL = int(os.environ.get('DEVICE_TTL', 60))
+ESP32_PORT = int(os.environ.get('ESP32_PORT', 81))
+# Total time budget for an ESP32 control call, retries included
+ESP32_DEADLINE = float(os.environ.get('ESP32_DEADLINE', 10))
+ESP32_PING_DEADLINE = float(os.environ.get('ESP32_PING_DEADLINE', 3))
+ESP32_ATTEMPT_TIMEOUT = float(os.environ.get('ESP32_ATTEMPT_TIMEOUT', 3))
+ESP32_BREAKER_THRESHOLD = int(os.environ.get('ESP32_BREAKER_THRESHOLD', 3))
+ESP32_BREAKER_RESET = float(os.environ.get('ESP32_BREAKER_RESET', 30))
+MODEL_PATH = os.environ.get('MODEL_PATH', "fall_model_int8.tflite")
+# Extra model versions (*.tflite, *.onnx) that can be activated or shadowed at runtime
+MODEL_DIR = os.environ.get('MODEL_DIR', "models")
+MODEL_VERSION = os.environ.get('MODEL_VERSION', os.path.splitext(os.path.basename(MODEL_PATH))[0])
+# 'auto', 'ai_edge_litert', 'tflite_runtime', 'tensorflow' or 'onnxruntime'
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'auto')
+# Shadow model scored on every Nth frame for A/B comparison, off when empty
+SHADOW_MODEL = os.environ.get('SHADOW_MODEL', '')
+SHADOW_SAMPLE_EVERY = int(os.environ.get('SHADOW_SAMPLE_EVERY', 1))
+# Cascade gates run before the fall model, e.g. "motion,person" (empty = off)
+CASCADE_GATES = [g for g in os.environ.get('CASCADE_GATES', '').split(',') if g]
+CASCADE_MAX_SKIP = int(os.environ.get('CASCADE_MAX_SKIP', 15))
+MOTION_PIXEL_DELTA = int(os.environ.get('MOTION_PIXEL_DELTA', 12))
+MOTION_MIN_CHANGED = float(os.environ.get('MOTION_MIN_CHANGED', 0.01))
+PERSON_MODEL_PATH = os.environ.get('PERSON_MODEL_PATH', "../creat model/person_detect.tflite")
+PERSON_THRESHOLD = float(os.environ.get('PERSON_THRESHOLD', 0.5))
+INFERENCE_POOL_SIZE = int(os.environ.get('INFERENCE_POOL_SIZE', 2))
+# Score in N separate worker processes (frames handed over in shared memory)
+# instead of interpreter threads in this process; 0 = in-process
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', 0))
+INFERENCE_WORKER_PIN = os.environ.get('INFERENCE_WORKER_PIN', '1') == '1'
+INFERENCE_THREADS = int(os.environ.get('INFERENCE_THREADS', 1))
+INFERENCE_MAX_BATCH = int(os.environ.get('INFERENCE_MAX_BATCH', 8))
+INFERENCE_MAX_WAIT_MS = float(os.environ.get('INFERENCE_MAX_WAIT_MS', 5))
+INFERENCE_TIMEOUT = float(os.environ.get('INFERENCE_TIMEOUT', 2.0))
+WRITER_WORKERS = int(os.environ.get('WRITER_WORKERS', 2))
+WRITER_QUEUE_SIZE = int(os.environ.get('WRITER_QUEUE_SIZE', 1024))
+WRITER_BATCH_SIZE = int(os.environ.get('WRITER_BATCH_SIZE', 32))
+WRITER_FLUSH_INTERVAL = float(os.environ.get('WRITER_FLUSH_INTERVAL', 0.2))
+FALL_THRESHOLD = 0.7
+# Temporal confirmation: a fall needs FALL_VOTES of the last FALL_WINDOW scores above
+# FALL_THRESHOLD and clears below FALL_EXIT_THRESHOLD; alerts repeat at most every FALL_COOLDOWN s
+FALL_WINDOW = int(os.environ.get('FALL_WINDOW', 5))
+FALL_VOTES = int(os.environ.get('FALL_VOTES', 3))
+FALL_EXIT_THRESHOLD = float(os.environ.get('FALL_EXIT_THRESHOLD', 0.5))
+FALL_COOLDOWN = float(os.environ.get('FALL_COOLDOWN', 30))
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '0') == '1'
+# Detection images are stored once per distinct frame, as loose sharded files
+# or, with IMAGE_STORE_PACKED=1, in append-only segment files
+IMAGE_STORE_ROOT = os.environ.get('IMAGE_STORE_ROOT', os.path.join(UPLOAD_FOLDER, 'images'))
+IMAGE_STORE_PACKED = os.environ.get('IMAGE_STORE_PACKED', '0') == '1'
+IMAGE_SEGMENT_MB = int(os.environ.get('IMAGE_SEGMENT_MB', 256))
+# History retention: per-status TTLs in days (JSON, null = keep forever), normals older
+# than HISTORY_DOWNSAMPLE_AFTER_HOURS rolled up into hourly aggregates (0 = off).
+# Downsampling deletes the raw normals it rolls up, so while it is on the normal
+# TTL only expires pre-event context frames; it covers all normals when it is off.
+HISTORY_TTL_DAYS = json.loads(os.environ.get('HISTORY_TTL_DAYS', json.dumps({NORMAL_STATUS: 30, FALL_STATUS: None})))
+HISTORY_DOWNSAMPLE_AFTER_HOURS = float(os.environ.get('HISTORY_DOWNSAMPLE_AFTER_HOURS', 24))
+HISTORY_RETENTION_INTERVAL = float(os.environ.get('HISTORY_RETENTION_INTERVAL', 3600))
+# Non-alert detections are pushed to browsers as one summary per device per interval
+LIVE_SUMMARY_INTERVAL = float(os.environ.get('LIVE_SUMMARY_INTERVAL', 2.0))
+LIVE_SUMMARY_MAX_ITEMS = int(os.environ.get('LIVE_SUMMARY_MAX_ITEMS', 20))
+DEVICE_STATUS_INTERVAL = float(os.environ.get('DEVICE_STATUS_INTERVAL', 5))
+MONGO_URI = os.environ.get('MONGO_URI', 'mongodb://localhost:27017')
+MONGO_RETRY_INTERVAL = float(os.environ.get('MONGO_RETRY_INTERVAL', 5))
+# Set to a time-series collection created by migrate_history.py --timeseries,
+# together with HISTORY_TIMESERIES=1 so it gets time-series indexes
+HISTORY_COLLECTION = os.environ.get('HISTORY_COLLECTION', 'history')
+HISTORY_TIMESERIES = os.environ.get('HISTORY_TIMESERIES', '0') == '1'
+# Frame retention: normals are kept on status transitions or every Nth frame (0 = never);
+# per-device overrides come as JSON, e.g. {"192.168.0.101": {"normal_sample_every": 100}}
+RETENTION_KEEP_TRANSITIONS = os.environ.get('RETENTION_KEEP_TRANSITIONS', '1') == '1'
+RETENTION_NORMAL_SAMPLE_EVERY = int(os.environ.get('RETENTION_NORMAL_SAMPLE_EVERY', 0))
+RETENTION_RING_SIZE = int(os.environ.get('RETENTION_RING_SIZE', 8))
+RETENTION_DEVICE_POLICIES = json.loads(os.environ.get('RETENTION_DEVICE_POLICIES', '{}'))
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
-# MongoDB connection
-try:
-    client = MongoClient('mongodb://localhost:27017', serverSelectionTimeoutMS=5000)
-    client.server_info()
-    db = client['fall_detection']
-    history_collection = db['history']
-    devices_collection = db['devices']
+# MongoDB connection. The client connects lazily; the first round trip is
+# made by the startup task below, so the server binds without waiting for it
+client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
+db = client['fall_detection']
+history_collection = db[HISTORY_COLLECTION]
+devices_collection = db['devices']
+mongo_ready = threading.Event()
+registry = DeviceRegistry(devices_collection, ttl=DEVICE_TTL, default_ip=DEFAULT_DEVICE_IP)
+relays = RelayHub(
+    url_for=lambda mac: f"http://{registry.ip_for(mac)}:{ESP32_PORT}/stream",
+    is_online=registry.is_online,
+    max_viewers=MAX_STREAM_VIEWERS
+)
+metrics.registry.register(metrics.Gauge("stream_viewers", "Active /stream viewers", relays.viewer_count))
+metrics.registry.register(metrics.Gauge("device_frame_rate", "Smoothed frames per second per device",
+                                        metrics.DEVICE_RATE.rates, ("device",)))
+
+def connect_mongo():
+    client.admin.command('ping')
+    history.ensure_indexes(history_collection, timeseries=HISTORY_TIMESERIES)
+    registry.load()
+    mongo_ready.set()
     logging.info("MongoDB connected successfully.")
-except ConnectionFailure as e:
-    logging.error(f"Failed to connect to MongoDB: {e}")
-    raise
-
-# Load TFLite model
-try:
-    logging.info("Loading fall_detection TFLite model...")
-    interpreter = tflite.Interpreter(model_path="fall_model_int8.tflite")
-    interpreter.allocate_tensors()
-    input_details = interpreter.get_input_details()
-    output_details = interpreter.get_output_details()
+
+metrics.configure(METRICS_ENABLED)
+
+def emit_to_rooms(event, data, to):
+    with metrics.EMIT.time():
+        socketio.emit(event, data, to=to)
+
+live_feed = LiveFeed(emit_to_rooms, interval=LIVE_SUMMARY_INTERVAL,
+                     max_items=LIVE_SUMMARY_MAX_ITEMS, fall_status=FALL_STATUS)
+device_feed = DeviceStatusFeed(registry, emit_to_rooms)
+
+def summary_loop():
+    while True:
+        socketio.sleep(LIVE_SUMMARY_INTERVAL)
+        try:
+            live_feed.flush()
+        except Exception as e:
+            logging.error(f"Live summary flush failed: {e}")
+
+def device_status_loop():
+    while True:
+        socketio.sleep(DEVICE_STATUS_INTERVAL)
+        try:
+            device_feed.check()
+        except Exception as e:
+            logging.error(f"Device status check failed: {e}")
+
+socketio.start_background_task(summary_loop)
+socketio.start_background_task(device_status_loop)
+
+image_store = ImageStore(IMAGE_STORE_ROOT, packed=IMAGE_STORE_PACKED,
+                         segment_bytes=IMAGE_SEGMENT_MB * 1024 * 1024)
+
+# Runs once MongoDB is up, then every HISTORY_RETENTION_INTERVAL seconds
+retention_job = RetentionJob(
+    history_collection,
+    db[f"{HISTORY_COLLECTION}_hourly"],
+    image_store,
+    ttl_days=HISTORY_TTL_DAYS,
+    normal_status=NORMAL_STATUS,
+    downsample_after_hours=HISTORY_DOWNSAMPLE_AFTER_HOURS,
+    interval=HISTORY_RETENTION_INTERVAL,
+    legacy_dir=UPLOAD_FOLDER,
+    legacy_url=legacy_url_prefix(UPLOAD_FOLDER, app.static_folder, app.static_url_path),
+    ready=mongo_ready
+)
+retention_job.start()
+
+# Background writer for detection images and history entries
+writer = WriteBehindPipeline(
+    history_collection,
+    image_store,
+    workers=WRITER_WORKERS,
+    max_queue=WRITER_QUEUE_SIZE,
+    batch_size=WRITER_BATCH_SIZE,
+    flush_interval=WRITER_FLUSH_INTERVAL,
+    ready=mongo_ready
+)
+atexit.register(writer.close)
+atexit.register(image_store.close)
+metrics.registry.register(metrics.Gauge("writer_queue_depth", "Jobs waiting in the write-behind queue",
+                                        lambda: writer.stats()['queue_depth']))
+metrics.registry.register(metrics.Gauge("writer_dropped_total", "Jobs dropped because the writer queue was full",
+                                        lambda: writer.stats()['dropped'], metric_type="counter"))
+
+default_retention = RetentionPolicy(
+    keep_transitions=RETENTION_KEEP_TRANSITIONS,
+    normal_sample_every=RETENTION_NORMAL_SAMPLE_EVERY,
+    ring_size=RETENTION_RING_SIZE
+)
+fall_confirmer = FallConfirmer(
+    window=FALL_WINDOW,
+    votes=FALL_VOTES,
+    enter_threshold=FALL_THRESHOLD,
+    exit_threshold=FALL_EXIT_THRESHOLD,
+    cooldown=FALL_COOLDOWN
+)
+frame_retention = FrameRetention(
+    default_retention,
+    {device: RetentionPolicy.from_dict(cfg, default_retention)
+     for device, cfg in RETENTION_DEVICE_POLICIES.items()}
+)
+
+# Fall detection model, loaded in the background; until it is active (or if
+# it fails to load) /fall_detect answers 503 and /readyz reports not ready
+if INFERENCE_WORKERS > 0:
+    engine_options = dict(engine_cls=ProcessInferenceEngine, pool_size=INFERENCE_WORKERS,
+                          pin_cpus=INFERENCE_WORKER_PIN)
+else:
+    engine_options = dict(pool_size=INFERENCE_POOL_SIZE)
+models = ModelRegistry(
+    MODEL_DIR,
+    MODEL_PATH,
+    backend=INFERENCE_BACKEND,
+    shadow_every=SHADOW_SAMPLE_EVERY,
+    threshold=FALL_THRESHOLD,
+    max_batch_size=INFERENCE_MAX_BATCH,
+    max_wait_ms=INFERENCE_MAX_WAIT_MS,
+    num_threads=INFERENCE_THREADS,
+    **engine_options
+)
+atexit.register(models.close)
+metrics.registry.register(metrics.Gauge("inference_queue_depth", "Frames waiting for inference",
+                                        models.queue_depth))
+
+# Person detector for the cascade; frames pass the gate until it has loaded
+person_models = None
+if 'person' in CASCADE_GATES:
+    person_models = ModelRegistry(
+        None,
+        PERSON_MODEL_PATH,
+        backend=INFERENCE_BACKEND,
+        pool_size=1,
+        max_batch_size=INFERENCE_MAX_BATCH,
+        max_wait_ms=INFERENCE_MAX_WAIT_MS,
+        num_threads=INFERENCE_THREADS
+    )
+    atexit.register(person_models.close)
+cascade = Cascade(
+    motion_gate=MotionGate(MOTION_PIXEL_DELTA, MOTION_MIN_CHANGED) if 'motion' in CASCADE_GATES else None,
+    person_models=person_models,
+    person_threshold=PERSON_THRESHOLD,
+    max_skip=CASCADE_MAX_SKIP
+)
+
+def load_models():
+    logging.info(f"Loading fall detection model {MODEL_VERSION}...")
+    models.activate(MODEL_VERSION)
     logging.info("Model loaded successfully.")
-except Exception as e:
-    logging.error(f"Failed to load TFLite model: {e}")
-    raise
-
-# Send request with retry
-def send_request_to_esp32(url, data, retries=15, backoff_factor=3, timeout=60):
-    session = requests.Session()
-    retries_config = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=[502, 503, 504])
-    session.mount('http://', HTTPAdapter(max_retries=retries_config))
-    try:
-        start_time = time.time()
-        response = session.post(url, data=data, timeout=timeout)
-        response.raise_for_status()
-        logging.info(f"Sent request to {url}, response time: {time.time() - start_time:.2f}s")
-        return response
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Failed to send request to {url}: {str(e)}")
-        return None
-
-# Check ESP32 status
-def is_esp32_online(ip):
-    device = devices_collection.find_one({"ip": ip})
-    if not device:
-        return False
-    last_seen = device.get('last_seen')
-    if not last_seen:
-        return False
-    time_diff = (datetime.now() - last_seen).total_seconds()
-    return time_diff < 60
+    if SHADOW_MODEL:
+        try:
+            models.set_shadow(SHADOW_MODEL)
+        except Exception as e:
+            logging.error(f"Failed to load shadow model {SHADOW_MODEL}: {e}")
+    if person_models is not None:
+        try:
+            person_models.activate(os.path.splitext(os.path.basename(PERSON_MODEL_PATH))[0])
+        except Exception as e:
+            logging.error(f"Failed to load person model, person gate disabled: {e}")
+            cascade.person_models = None
+
+# Interpreter setup is CPU-bound, so under eventlet it runs on a real thread
+startup = StartupTasks()
+startup.add('mongo', connect_mongo, retry_interval=MONGO_RETRY_INTERVAL)
+startup.add('model', (lambda: tpool.execute(load_models)) if SERVER_MODE == 'eventlet' else load_models)
+startup.start()
+
+# Shared, pooled client for ESP32 control calls
+esp32 = ESP32Client(
+    deadline=ESP32_DEADLINE,
+    attempt_timeout=ESP32_ATTEMPT_TIMEOUT,
+    failure_threshold=ESP32_BREAKER_THRESHOLD,
+    reset_timeout=ESP32_BREAKER_RESET
+)
+atexit.register(esp32.close)
+
+# Send request within a total deadline
+def send_request_to_esp32(url, data, deadline=None):
+    return esp32.post(url, data, deadline=deadline)
+
+# Device targeted by a page or API call; defaults to the original camera
+def requested_mac():
+    return request.values.get('mac', DEFAULT_DEVICE_MAC)
 
 @app.before_request
 def log_request():
-    logging.debug(f"Request: {request.method} {request.path}, payload: {request.get_data(as_text=True)}")
+    logging.debug(f"Request: {request.method} {request.path}, content length: {request.content_length}")
 
 @app.route('/')
 @app.route('/camera')
 def camera():
     error_message = None
     try:
-        device = devices_collection.find_one({"mac": "F8:B3:B7:7B:32:A8"})
-        esp32_ip = device.get('ip', '192.168.0.101') if device else '192.168.0.101'
-        if not is_esp32_online(esp32_ip):
+        mac = requested_mac()
+        esp32_ip = registry.ip_for(mac)
+        if not registry.is_online(mac):
             error_message = "Camera is offline. Please check the device."
         else:
             response = send_request_to_esp32(
-                f"http://{esp32_ip}:81/set_mode",
-                data={'mode': 'stream'},
-                retries=15,
-                backoff_factor=3,
-                timeout=60
+                f"http://{esp32_ip}:{ESP32_PORT}/set_mode",
+                data={'mode': 'stream'}
             )
             if response:
                 logging.info("Set ESP32 to stream mode")
@@ -121,26 +350,23 @@ def camera():
 def messenger():
     error_message = None
     try:
-        device = devices_collection.find_one({"mac": "F8:B3:B7:7B:32:A8"})
-        esp32_ip = device.get('ip', '192.168.0.101') if device else '192.168.0.101'
-        if not is_esp32_online(esp32_ip):
+        mac = requested_mac()
+        esp32_ip = registry.ip_for(mac)
+        if not registry.is_online(mac):
             error_message = "Camera is offline. Please check the device."
         else:
             # Kiểm tra trạng thái trước khi gửi yêu cầu
             ping_response = send_request_to_esp32(
-                f"http://{esp32_ip}:81/set_mode",
+                f"http://{esp32_ip}:{ESP32_PORT}/set_mode",
                 data={'mode': 'ping'},
-                timeout=5
+                deadline=ESP32_PING_DEADLINE
             )
             if not ping_response:
                 error_message = "ESP32 is not responding. Please wait and try again."
             else:
                 response = send_request_to_esp32(
-                    f"http://{esp32_ip}:81/set_mode",
-                    data={'mode': 'detection'},
-                    retries=15,
-                    backoff_factor=3,
-                    timeout=60
+                    f"http://{esp32_ip}:{ESP32_PORT}/set_mode",
+                    data={'mode': 'detection'}
                 )
                 if response:
                     logging.info("Set ESP32 to detection mode")
@@ -149,7 +375,7 @@ def messenger():
     except Exception as e:
         logging.error(f"Error setting detection mode: {str(e)}")
         error_message = "Failed to set detection mode."
-    return render_template('messenger.html', error=error_message)
+    return render_template('messenger.html', error=error_message, mac=requested_mac())
 
 @app.route('/history')
 def history_page():
@@ -158,28 +384,84 @@ def history_page():
 @app.route('/api/history', methods=['GET'])
 def get_history():
     try:
-        results = list(history_collection.find({}, {"_id": 0}))
-        return jsonify(results)
+        query = history.build_query(history_collection, request.args)
+        if request.args.get('format') == 'ndjson':
+            limit = history.parse_limit(request.args.get('limit'), default=None, maximum=None)
+            return Response(
+                stream_with_context(history.export_ndjson(history_collection, query, limit)),
+                mimetype='application/x-ndjson'
+            )
+        limit = history.parse_limit(request.args.get('limit'))
+        return jsonify(history.fetch_page(history_collection, query, limit))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logging.error(f"Error fetching history: {str(e)}")
         return jsonify({"error": f"Failed to fetch history: {str(e)}"}), 500
 
+@app.route('/api/pipeline_stats', methods=['GET'])
+def pipeline_stats():
+    stats = writer.stats()
+    stats['retention'] = frame_retention.stats()
+    stats['confirmation'] = fall_confirmer.stats()
+    stats['cascade'] = cascade.stats()
+    stats['live'] = live_feed.stats()
+    stats['images'] = image_store.stats()
+    return jsonify(stats)
+
+@app.route('/api/retention', methods=['GET'])
+def retention_stats():
+    return jsonify(retention_job.stats())
+
+@app.route('/api/retention/run', methods=['POST'])
+def run_retention():
+    if request.headers.get('X-API-Key') != API_KEY:
+        return jsonify({'error': "Invalid API key"}), 401
+    retention_job.trigger()
+    return jsonify({'status': 'scheduled'}), 202
+
+@app.route('/api/models', methods=['GET'])
+def model_stats():
+    return jsonify(models.stats())
+
+# Hot swap: {"version": ..., "backend": ..., "num_threads": ...}; "shadow": true
+# sets the shadow model instead (version null turns it off)
+@app.route('/api/models/activate', methods=['POST'])
+def activate_model():
+    if request.headers.get('X-API-Key') != API_KEY:
+        return jsonify({'error': "Invalid API key"}), 401
+    data = request.get_json(silent=True) or {}
+    version = data.get('version')
+    try:
+        num_threads = int(data['num_threads']) if data.get('num_threads') is not None else None
+        if data.get('shadow'):
+            models.set_shadow(version, data.get('backend'), num_threads)
+        elif not version:
+            return jsonify({'error': "Missing version"}), 400
+        else:
+            models.activate(version, data.get('backend'), num_threads)
+        return jsonify(models.stats())
+    except UnknownModel as e:
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error activating model {version}: {str(e)}")
+        return jsonify({'error': f"Failed to load model: {str(e)}"}), 500
+
 @app.route('/api/set_mode', methods=['POST'])
 def set_mode():
     try:
         mode = request.form.get('mode')
         if mode not in ['stream', 'detection']:
             return jsonify({'error': 'Invalid mode'}), 400
-        device = devices_collection.find_one({"mac": "F8:B3:B7:7B:32:A8"})
-        esp32_ip = device.get('ip', '192.168.0.101') if device else '192.168.0.101'
-        if not is_esp32_online(esp32_ip):
+        mac = requested_mac()
+        esp32_ip = registry.ip_for(mac)
+        if not registry.is_online(mac):
             return jsonify({'status': 'error', 'message': 'Camera is offline.'}), 500
         response = send_request_to_esp32(
-            f"http://{esp32_ip}:81/set_mode",
-            data={'mode': mode},
-            retries=15,
-            backoff_factor=3,
-            timeout=60
+            f"http://{esp32_ip}:{ESP32_PORT}/set_mode",
+            data={'mode': mode}
         )
         if response:
             logging.info(f"Set ESP32 to {mode} mode")
@@ -192,126 +474,317 @@ def set_mode():
 @app.route('/api/ping_esp32', methods=['GET'])
 def ping_esp32():
     try:
-        device = devices_collection.find_one({"mac": "F8:B3:B7:7B:32:A8"})
-        esp32_ip = device.get('ip', '192.168.0.101') if device else '192.168.0.101'
-        if not is_esp32_online(esp32_ip):
+        mac = requested_mac()
+        esp32_ip = registry.ip_for(mac)
+        if not registry.is_online(mac):
             return jsonify({"status": "offline"}), 500
         response = send_request_to_esp32(
-            f"http://{esp32_ip}:81/set_mode",
+            f"http://{esp32_ip}:{ESP32_PORT}/set_mode",
             data={'mode': 'ping'},
-            timeout=5
+            deadline=ESP32_PING_DEADLINE
         )
         return jsonify({"status": "online" if response else "offline"})
     except Exception as e:
         logging.error(f"Ping ESP32 failed: {str(e)}")
         return jsonify({"status": "offline"}), 500
 
+@app.route('/api/devices', methods=['GET'])
+def list_devices():
+    return jsonify(registry.all())
+
 @app.route('/api/report_ip', methods=['POST'])
 def report_ip():
     try:
         data = request.get_json()
         ip = data.get('ip')
         mac = data.get('mac')
+        if not ip or not mac:
+            return jsonify({"status": "error", "message": "Missing ip or mac"}), 400
         logging.info(f"Updated ESP32 IP to {ip} (MAC: {mac})")
-        devices_collection.update_one(
-            {"mac": mac},
-            {"$set": {"ip": ip, "last_seen": datetime.now()}},
-            upsert=True
-        )
+        registry.report(mac, ip)
+        device_feed.check()
         return jsonify({"status": "success", "ip": ip})
     except Exception as e:
         logging.error(f"Failed to update IP: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 400
 
+# Under eventlet the blocking wait for a result runs on a real thread via tpool
+def run_inference_many(frames, model_set=None):
+    model_set = model_set or models
+    if SERVER_MODE == 'eventlet':
+        return tpool.execute(model_set.predict_many, frames, INFERENCE_TIMEOUT)
+    return model_set.predict_many(frames, timeout=INFERENCE_TIMEOUT)
+
+# Runs one device's frames through the cascade gates and the fall model. Each
+# result is a fall score, the exception that failed the frame, or a
+# (gate, score) tuple for a frame a gate skipped.
+def score_frames(device_id, frames):
+    if not cascade.enabled:
+        return run_inference_many(frames)
+    force = fall_confirmer.is_falling(device_id)
+    results = cascade.check_motion(device_id, frames, force)
+    waiting = [i for i, r in enumerate(results) if r is None]
+    person = cascade.check_person(device_id, [frames[i] for i in waiting],
+                                  lambda batch: run_inference_many(batch, person_models), force)
+    for i, r in zip(waiting, person):
+        results[i] = r
+    for i, r in enumerate(results):
+        if r is not None:
+            cascade.record(device_id, r[0])
+
+    waiting = [i for i, r in enumerate(results) if r is None]
+    for i, score in zip(waiting, run_inference_many([frames[i] for i in waiting])):
+        results[i] = score
+        if not isinstance(score, Exception):
+            cascade.record(device_id, "passed", score)
+    return results
+
+# Devices that don't send X-Device-Id are identified by the MAC they reported
+# for their address, falling back to the address itself
+def device_key():
+    device_id = request.headers.get('X-Device-Id')
+    if device_id:
+        return device_id
+    return registry.mac_for_ip(request.remote_addr) or request.remote_addr
+
+# Pushes the detection live as soon as it is decided and queues the frame and
+# its history entry for the background writer. The push does not wait for
+# (or depend on) MongoDB; the id is assigned here so both carry the same one.
+# Pre-event context frames are stored for history but not pushed live.
+def save_detection(frame, score, status, captured_at, device_id, location, pre_event=False, alert=False):
+    key = image_store.key_for(frame)
+    entry = history.make_entry(captured_at, device_id, location, status, score, image_store.url_for(key))
+    entry["_id"] = ObjectId()
+    if pre_event:
+        entry["pre_event"] = True
+    if alert:
+        entry["alert"] = True
+    if not pre_event:
+        try:
+            live_feed.publish(history.to_json(dict(entry)))
+        except Exception as e:
+            logging.error(f"Live push failed: {e}")
+    if not writer.submit(frame, key, entry):
+        logging.warning("Writer queue full, dropping detection entry")
+
+# 503 with a retry hint while the model is still loading
+def not_ready(body):
+    response = jsonify(body)
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
 @app.route('/fall_detect', methods=['POST'])
 def fall_detect():
+    with metrics.REQUEST.time():
+        return process_frame()
+
+def process_frame():
     try:
         logging.debug(f"Received /fall_detect, data size: {len(request.data)} bytes")
         if request.headers.get('X-API-Key') != API_KEY:
             return jsonify({'fall': False, 'error': "Invalid API key"}), 401
 
+        if not models.ready:
+            return not_ready({'fall': False, 'error': "Model loading"})
+
         if not request.data:
             return jsonify({'fall': False, 'error': "No image data received"}), 400
 
-        raw = np.frombuffer(request.data, dtype=np.uint8)
-        if raw.size < 96 * 96:
-            return jsonify({'fall': False, 'error': f"Data size too small: {raw.size} bytes"}), 400
-        raw = raw[:96 * 96]
-
-        image = raw ^ 0x80
-        image = image.astype(np.int8).reshape((96, 96, 1))
-
-        interpreter.set_tensor(input_details[0]['index'], [image])
-        interpreter.invoke()
-        output_data = interpreter.get_tensor(output_details[0]['index'])[0]
-        fall_score = output_data.item() if output_data.size == 1 else output_data[1]
-
-        if fall_score > 1.0 or fall_score < 0.0:
-            fall_score = max(0.0, min(1.0, fall_score))
-
-        status = "Ngã" if fall_score > 0.7 else "Bình thường"
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        img_data = (image.astype(np.uint8) ^ 0x80).reshape((96, 96))
-        img = Image.fromarray(img_data, mode='L')
-        filename = f"fall_image_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        img.save(filepath)
-        image_url = f"/{filepath}"
-
-        entry = {
-            "timestamp": timestamp,
-            "location": request.headers.get('X-Location', 'Phòng khách'),
-            "status": status,
-            "probability": f"{fall_score * 100:.0f}%",
-            "image_path": image_url
-        }
-        history_collection.insert_one(entry)
-
-        socketio.emit('new_detection', entry)
-        logging.info(f"Detection: fall={fall_score > 0.7}, score={fall_score}")
-        return jsonify({"fall": fall_score > 0.7, "score": float(fall_score)})
+        try:
+            frame = preprocess(request.data)
+        except ValueError as e:
+            return jsonify({'fall': False, 'error': str(e)}), 400
+
+        device_id = device_key()
+        fall_score = score_frames(device_id, [frame])[0]
+        if isinstance(fall_score, InferenceTimeout):
+            logging.warning("Inference timed out")
+            return jsonify({'fall': False, 'error': "Inference timed out"}), 503
+        if isinstance(fall_score, InferenceBusy):
+            logging.warning("Inference queue full, rejecting frame")
+            return jsonify({'fall': False, 'error': "Server busy"}), 503
+        if isinstance(fall_score, Exception):
+            raise fall_score
+        if isinstance(fall_score, tuple):
+            return jsonify(skipped_result(device_id, *fall_score))
+
+        location = request.headers.get('X-Location', 'Phòng khách')
+        return jsonify(handle_result(device_id, location, frame, fall_score, datetime.now()))
 
     except Exception as e:
         logging.error(f"Error processing image: {str(e)}")
         return jsonify({'fall': False, 'error': str(e)}), 500
 
+# Raw 96x96 grayscale payload as a read-only uint8 view; quantization
+# happens inside the inference engine, straight into the input tensor
+def preprocess(payload):
+    with metrics.DECODE.time():
+        if len(payload) < 96 * 96:
+            raise ValueError(f"Data size too small: {len(payload)} bytes")
+        return np.frombuffer(payload, dtype=np.uint8, count=96 * 96).reshape((96, 96))
+
+# Confirmation, retention and persistence for one scored frame
+def handle_result(device_id, location, frame, fall_score, captured_at):
+    if fall_score > 1.0 or fall_score < 0.0:
+        fall_score = max(0.0, min(1.0, fall_score))
+
+    metrics.FRAMES.inc(device_id)
+    metrics.DEVICE_RATE.mark(device_id)
+
+    status, alert = fall_confirmer.update(device_id, fall_score, captured_at)
+    keep, pre_event = frame_retention.decide(device_id, frame, fall_score, status, captured_at)
+    for pre_at, pre_frame, pre_score in pre_event:
+        save_detection(pre_frame, pre_score, NORMAL_STATUS, pre_at, device_id, location, pre_event=True)
+    if keep:
+        save_detection(frame, fall_score, status, captured_at, device_id, location, alert=alert)
+    fall = status == FALL_STATUS
+    logging.info(f"Detection: device={device_id}, fall={fall}, alert={alert}, score={fall_score}, saved={keep}")
+    return {"fall": fall, "alert": alert, "score": float(fall_score)}
+
+# A frame skipped by a cascade gate is neither confirmed nor persisted
+def skipped_result(device_id, gate, score):
+    metrics.FRAMES.inc(device_id)
+    metrics.DEVICE_RATE.mark(device_id)
+    return {"fall": False, "alert": False, "score": float(score), "skipped": gate}
+
+# Scores every frame of a batch (see ingest.py) and returns one result per frame
+def process_batch(data):
+    device_id, location, frames = ingest.parse_batch(data)
+    device_id = device_id or device_key()
+    location = location or request.headers.get('X-Location', 'Phòng khách')
+
+    results = [None] * len(frames)
+    decoded = []
+    for i, (seq, captured_ms, payload) in enumerate(frames):
+        try:
+            decoded.append((i, seq, captured_ms, preprocess(payload)))
+        except ValueError as e:
+            results[i] = {"seq": seq, "fall": False, "error": str(e)}
+
+    scores = score_frames(device_id, [frame for *_, frame in decoded])
+    now = datetime.now()
+    for (i, seq, captured_ms, frame), score in zip(decoded, scores):
+        if isinstance(score, InferenceBusy):
+            results[i] = {"seq": seq, "fall": False, "error": "Server busy"}
+        elif isinstance(score, InferenceTimeout):
+            results[i] = {"seq": seq, "fall": False, "error": "Inference timed out"}
+        elif isinstance(score, Exception):
+            results[i] = {"seq": seq, "fall": False, "error": str(score)}
+        elif isinstance(score, tuple):
+            results[i] = dict(skipped_result(device_id, *score), seq=seq)
+        else:
+            captured_at = datetime.fromtimestamp(captured_ms / 1000.0) if captured_ms else now
+            results[i] = dict(handle_result(device_id, location, frame, score, captured_at), seq=seq)
+    return {"device": device_id, "results": results}
+
+@app.route('/fall_detect_batch', methods=['POST'])
+def fall_detect_batch():
+    try:
+        if request.headers.get('X-API-Key') != API_KEY:
+            return jsonify({'error': "Invalid API key"}), 401
+        if not models.ready:
+            return not_ready({'error': "Model loading"})
+        return jsonify(process_batch(request.get_data()))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error processing batch: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+# Browser channel: clients start in the "all" room and may narrow it down
+# with 'subscribe' {"devices": [...], "locations": [...]}; the current
+# device status is sent on connect and on every subscribe.
+@socketio.on('connect')
+def live_connect(auth=None):
+    join_room(ALL_ROOM)
+    socketio.emit('device_snapshot', device_feed.snapshot(), to=request.sid)
+
+@socketio.on('subscribe')
+def live_subscribe(data):
+    data = data if isinstance(data, dict) else {}
+    devices = [str(d) for d in data.get('devices') or []]
+    locations = [str(loc) for loc in data.get('locations') or []]
+    for room in joined_rooms():
+        if room != request.sid:
+            leave_room(room)
+    for room in [device_room(d) for d in devices] + [location_room(loc) for loc in locations] or [ALL_ROOM]:
+        join_room(room)
+    snapshot = device_feed.snapshot()
+    if devices:
+        snapshot = [d for d in snapshot if d['mac'] in devices]
+    socketio.emit('device_snapshot', snapshot, to=request.sid)
+
+# Persistent channel: cameras connect to /ingest with auth {"api_key": ...}
+# and send 'frame_batch' events; the ack carries the per-frame results.
+@socketio.on('connect', namespace='/ingest')
+def ingest_connect(auth=None):
+    if not auth or auth.get('api_key') != API_KEY:
+        return False
+
+@socketio.on('frame_batch', namespace='/ingest')
+def ingest_frame_batch(data):
+    try:
+        if not models.ready:
+            return {'error': "Model loading"}
+        return process_batch(data)
+    except ValueError as e:
+        return {'error': str(e)}
+    except Exception as e:
+        logging.error(f"Error processing batch: {str(e)}")
+        return {'error': str(e)}
+
 @app.route('/stream')
 def stream():
-    global active_streams
     try:
-        if active_streams >= MAX_STREAM_CLIENTS:
+        mac = requested_mac()
+        if not registry.is_online(mac):
+            return "<p>Error: Camera is offline</p>", 503
+        viewer = relays.subscribe(mac)
+        if viewer is None:
             return "<p>Error: Maximum clients reached</p>", 429
-
-        active_streams += 1
-        def proxy_stream():
-            global active_streams
-            try:
-                device = devices_collection.find_one({"mac": "F8:B3:B7:7B:32:A8"})
-                esp32_ip = device.get('ip', '192.168.0.101') if device else '192.168.0.101'
-                url = f"http://{esp32_ip}:81/stream"
-                while True:
-                    if not is_esp32_online(esp32_ip):
-                        break
-                    try:
-                        req = requests.get(url, stream=True, timeout=10)
-                        for chunk in req.iter_content(chunk_size=1024):
-                            if chunk:
-                                yield chunk
-                    except requests.exceptions.RequestException as e:
-                        time.sleep(3)
-                        continue
-            except Exception as e:
-                logging.error(f"Stream proxy failed: {str(e)}")
-                raise
-            finally:
-                active_streams -= 1
-        return Response(proxy_stream(), mimetype='multipart/x-mixed-replace; boundary=frame')
+        return Response(viewer, mimetype='multipart/x-mixed-replace; boundary=frame')
     except Exception as e:
         logging.error(f"Error proxying stream: {str(e)}")
-        active_streams -= 1
         return "<p>Error: Failed to connect to camera</p>", 500
 
+@app.route('/api/streams', methods=['GET'])
+def stream_stats():
+    return jsonify(relays.stats())
+
+# Liveness: the process is up and serving requests
+@app.route('/healthz')
+def healthz():
+    return jsonify({'status': 'ok'})
+
+# Readiness: the model is active and MongoDB is reachable
+@app.route('/readyz')
+def readyz():
+    checks = startup.status()
+    checks['model']['ready'] = models.ready
+    ready = models.ready and mongo_ready.is_set()
+    return jsonify({'ready': ready, 'checks': checks}), 200 if ready else 503
+
+@app.route('/metrics')
+def metrics_endpoint():
+    if not METRICS_ENABLED:
+        return "Metrics disabled\n", 404
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+# Stored images never change under their key, so browsers may cache them for good
+@app.route('/images/<key>.jpg')
+def serve_image(key):
+    if key in request.if_none_match:
+        response = Response(status=304)
+    else:
+        data = image_store.get(key)
+        if data is None:
+            return "Not found", 404
+        response = Response(data, mimetype='image/jpeg')
+    response.set_etag(key)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
 @app.route('/static/audio/<filename>')
 def serve_audio(filename):
     try:
@@ -320,4 +793,6 @@ def serve_audio(filename):
         return jsonify({'status': 'error', 'message': 'Audio file not found'}), 404
 
 if __name__ == '__main__':
+    # HTTP/1.1 keep-alive so cameras can reuse one connection across posts
+    WSGIRequestHandler.protocol_version = "HTTP/1.1"
     socketio.run(app, host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
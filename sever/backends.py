@@ -0,0 +1,112 @@
+import logging
+
+import numpy as np
+
+# Inference backends. Each one returns an interpreter class with the subset
+# of the TFLite Interpreter API used by InferenceEngine:
+#   cls(model_path=..., num_threads=...), allocate_tensors(), get_input_details(),
+#   get_output_details(), resize_tensor_input(), tensor(), invoke(), get_tensor()
+
+def _ai_edge_litert():
+    from ai_edge_litert.interpreter import Interpreter
+    return Interpreter
+
+
+def _tflite_runtime():
+    from tflite_runtime.interpreter import Interpreter
+    return Interpreter
+
+
+def _tensorflow():
+    import tensorflow.lite as tflite
+    return tflite.Interpreter
+
+
+def _onnxruntime():
+    import onnxruntime  # noqa: F401
+    return OnnxInterpreter
+
+
+BACKENDS = {
+    'ai_edge_litert': _ai_edge_litert,
+    'tflite_runtime': _tflite_runtime,
+    'tensorflow': _tensorflow,
+    'onnxruntime': _onnxruntime,
+}
+
+# Lightest runtimes first; full TensorFlow only as a last resort
+AUTO_ORDER = ('ai_edge_litert', 'tflite_runtime', 'tensorflow')
+
+# ONNX models are picked by file extension when the backend is 'auto'
+EXTENSION_BACKENDS = {'.onnx': 'onnxruntime'}
+
+
+# Returns (backend name, interpreter class); 'auto' picks the first runtime installed
+def load_backend(name='auto', model_path=None):
+    if name == 'auto' and model_path:
+        for ext, backend in EXTENSION_BACKENDS.items():
+            if model_path.endswith(ext):
+                name = backend
+    if name != 'auto':
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown inference backend: {name}")
+        return name, BACKENDS[name]()
+    for candidate in AUTO_ORDER:
+        try:
+            interpreter_cls = BACKENDS[candidate]()
+            logging.info(f"Using inference backend {candidate}")
+            return candidate, interpreter_cls
+        except ImportError:
+            continue
+    raise ImportError("No TFLite runtime found (install ai-edge-litert or tflite-runtime)")
+
+
+_ONNX_DTYPES = {
+    'tensor(float)': np.float32,
+    'tensor(uint8)': np.uint8,
+    'tensor(int8)': np.int8,
+}
+
+
+# ONNX Runtime behind the TFLite Interpreter API. Inputs are float with no
+# quantization, so the engine feeds pixels scaled to [0, 1].
+class OnnxInterpreter:
+    def __init__(self, model_path, num_threads=1):
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = num_threads
+        options.inter_op_num_threads = 1
+        self._session = onnxruntime.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        model_input = self._session.get_inputs()[0]
+        self._input_name = model_input.name
+        self._dtype = _ONNX_DTYPES.get(model_input.type, np.float32)
+        self._shape = [1] + [d if isinstance(d, int) else 1 for d in model_input.shape[1:]]
+        self._output_names = [o.name for o in self._session.get_outputs()]
+        self._input = None
+        self._outputs = None
+
+    def allocate_tensors(self):
+        self._input = np.zeros(self._shape, dtype=self._dtype)
+
+    def get_input_details(self):
+        return [{'index': 0, 'name': self._input_name, 'shape': np.array(self._shape),
+                 'dtype': self._dtype, 'quantization': (0.0, 0)}]
+
+    def get_output_details(self):
+        return [{'index': i, 'name': name, 'quantization': (0.0, 0)}
+                for i, name in enumerate(self._output_names)]
+
+    def resize_tensor_input(self, index, shape):
+        self._shape = list(shape)
+
+    def tensor(self, index):
+        return lambda: self._input
+
+    def set_tensor(self, index, value):
+        np.copyto(self._input, value)
+
+    def invoke(self):
+        self._outputs = self._session.run(self._output_names, {self._input_name: self._input})
+
+    def get_tensor(self, index):
+        return self._outputs[index]
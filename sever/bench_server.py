@@ -0,0 +1,354 @@
+import argparse
+import glob
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import requests
+from PIL import Image
+
+# Load test for the fall detection server. Simulated ESP32 cameras POST
+# 96x96 grayscale frames from img_train/ to /fall_detect; the app runs
+# in-process against a stand-in Mongo and a stub MJPEG camera so the
+# per-stage timings can be collected alongside end-to-end latency.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+import ingest  # noqa: E402
+IMG_DIR = os.path.join(HERE, '..', 'img_train')
+API_KEY = "08112003"
+STUB_MAC = "F8:B3:B7:7B:32:A8"
+
+
+def load_frames(pattern, limit):
+    paths = sorted(glob.glob(os.path.join(IMG_DIR, pattern)))[:limit]
+    if not paths:
+        sys.exit(f"No images matching {pattern} in {IMG_DIR}")
+    return [Image.open(p).convert('L').resize((96, 96)).tobytes() for p in paths]
+
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    values = np.array(samples) * 1000.0
+    return {
+        "count": len(samples),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "max_ms": round(float(values.max()), 3)
+    }
+
+
+# Thread-safe sample store for stage timings
+class Timings:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def wrap(self, owner, attr, stage):
+        original = getattr(owner, attr)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+        setattr(owner, attr, timed)
+
+    def report(self):
+        with self._lock:
+            return {stage: percentiles(values) for stage, values in sorted(self.samples.items())}
+
+
+# --- Mongo stand-in -------------------------------------------------------
+
+class FakeCursor(list):
+    def sort(self, *args, **kwargs):
+        return self
+
+    def limit(self, n):
+        return FakeCursor(self[:n]) if n else self
+
+    def batch_size(self, n):
+        return self
+
+    def close(self):
+        pass
+
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = []
+        self._lock = threading.Lock()
+
+    def create_index(self, *args, **kwargs):
+        return kwargs.get('name', 'index')
+
+    def insert_one(self, doc):
+        with self._lock:
+            self.docs.append(doc)
+
+    def insert_many(self, docs, ordered=True):
+        with self._lock:
+            self.docs.extend(docs)
+
+    def update_one(self, query, update, upsert=False):
+        pass
+
+    def find_one(self, *args, **kwargs):
+        return None
+
+    def find(self, *args, **kwargs):
+        return FakeCursor()
+
+
+class FakeDatabase(defaultdict):
+    def __init__(self):
+        super().__init__(FakeCollection)
+
+    def command(self, *args, **kwargs):
+        return {"ok": 1.0}
+
+
+class FakeMongoClient(defaultdict):
+    def __init__(self, *args, **kwargs):
+        super().__init__(FakeDatabase)
+
+    def server_info(self):
+        return {"version": "fake"}
+
+    @property
+    def admin(self):
+        return self['admin']
+
+
+def mongo_client_class():
+    try:
+        import mongomock
+        return mongomock.MongoClient
+    except ImportError:
+        return FakeMongoClient
+
+
+# --- Stub ESP32 ------------------------------------------------------------
+
+def start_stub_camera(frames, fps):
+    jpegs = []
+    for raw in frames:
+        buf = io.BytesIO()
+        Image.frombytes('L', (96, 96), raw).save(buf, format='JPEG')
+        jpegs.append(buf.getvalue())
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(b'{"status":"success"}')
+
+        def do_GET(self):
+            if self.path != '/stream':
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=frame')
+            self.end_headers()
+            try:
+                i = 0
+                while True:
+                    self.wfile.write(b"--frame\r\nContent-Type: image/jpeg\r\n\r\n" + jpegs[i % len(jpegs)] + b"\r\n")
+                    i += 1
+                    time.sleep(1.0 / fps)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# --- In-process app ----------------------------------------------------------
+
+def start_app(args, camera_port, timings):
+    os.environ.setdefault('UPLOAD_FOLDER', tempfile.mkdtemp(prefix='bench_uploads_'))
+    os.environ['ESP32_PORT'] = str(camera_port)
+    if args.save_all:
+        os.environ['RETENTION_NORMAL_SAMPLE_EVERY'] = '1'
+    if args.workers:
+        os.environ['INFERENCE_WORKERS'] = str(args.workers)
+    import pymongo
+    pymongo.MongoClient = mongo_client_class()
+    os.chdir(HERE)
+    started = time.perf_counter()
+    import app as server
+    from werkzeug.serving import make_server
+    imported = time.perf_counter()
+    deadline = time.monotonic() + 60
+    while not (server.models.ready and server.mongo_ready.is_set()):
+        if time.monotonic() > deadline:
+            sys.exit(f"Server not ready: {server.startup.status()}")
+        time.sleep(0.01)
+    print(f"startup: import {imported - started:.3f}s, ready {time.perf_counter() - started:.3f}s")
+
+    # Worker processes report their invoke times to inference_invoke_seconds instead
+    if not args.workers:
+        timings.wrap(server.models.engine, '_run_batch', 'invoke_batch')
+    timings.wrap(server, 'preprocess', 'decode')
+    timings.wrap(server, 'score_frames', 'inference_wait')
+    timings.wrap(Image.Image, 'save', 'jpeg_save')
+    timings.wrap(server.history_collection, 'insert_many', 'db_insert')
+    view = server.app.view_functions['fall_detect']
+
+    def timed_view():
+        start = time.perf_counter()
+        try:
+            return view()
+        finally:
+            timings.add('handler', time.perf_counter() - start)
+    server.app.view_functions['fall_detect'] = timed_view
+
+    http = make_server('127.0.0.1', 0, server.app, threaded=True)
+    threading.Thread(target=http.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{http.server_port}"
+    server.registry.report(STUB_MAC, '127.0.0.1')
+    return server, base_url
+
+
+# --- Load generation ----------------------------------------------------------
+
+def run_camera(idx, base_url, frames, args, latencies, errors):
+    session = requests.Session() if args.keep_alive else requests
+    headers = {
+        'X-API-Key': API_KEY,
+        'X-Location': f"Bench {idx}",
+        'X-Device-Id': f"bench-cam-{idx}",
+        'Content-Type': 'application/octet-stream'
+    }
+    step = max(1, args.batch)
+    for n in range(0, args.frames, step):
+        batch = [frames[(idx + n + k) % len(frames)] for k in range(min(step, args.frames - n))]
+        start = time.perf_counter()
+        try:
+            if args.batch > 1:
+                payload = ingest.encode_batch(headers['X-Device-Id'], [
+                    (n + k, int(time.time() * 1000), frame) for k, frame in enumerate(batch)
+                ], headers['X-Location'])
+                response = session.post(f"{base_url}/fall_detect_batch", data=payload, headers=headers, timeout=20)
+            else:
+                response = session.post(f"{base_url}/fall_detect", data=batch[0], headers=headers, timeout=20)
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors[response.status_code] += 1
+        except requests.exceptions.RequestException:
+            errors['connection'] += 1
+        if args.interval:
+            time.sleep(args.interval)
+
+
+def run_viewer(base_url, duration, counts):
+    received = 0
+    try:
+        with requests.get(f"{base_url}/stream", stream=True, timeout=10) as response:
+            end = time.monotonic() + duration
+            for chunk in response.iter_content(chunk_size=4096):
+                received += chunk.count(b"--frame")
+                if time.monotonic() >= end:
+                    break
+    except requests.exceptions.RequestException:
+        pass
+    counts.append(received)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test /fall_detect with simulated ESP32 cameras.")
+    parser.add_argument('--cameras', type=int, default=8, help="concurrent simulated cameras")
+    parser.add_argument('--frames', type=int, default=100, help="frames posted per camera")
+    parser.add_argument('--interval', type=float, default=0.0, help="seconds between frames per camera")
+    parser.add_argument('--images', default='*.jpg', help="glob inside img_train/")
+    parser.add_argument('--max-images', type=int, default=200)
+    parser.add_argument('--batch', type=int, default=1, help="frames per request via /fall_detect_batch")
+    parser.add_argument('--keep-alive', action='store_true', help="reuse connections (the ESP32 does not)")
+    parser.add_argument('--save-all', action='store_true', help="persist every frame, not only falls/transitions")
+    parser.add_argument('--viewers', type=int, default=0, help="concurrent /stream viewers during the run")
+    parser.add_argument('--camera-fps', type=float, default=20.0, help="stub camera MJPEG frame rate")
+    parser.add_argument('--workers', type=int, default=0, help="score in N inference worker processes")
+    parser.add_argument('--url', help="benchmark an already running server instead (no stage timings)")
+    parser.add_argument('--json', metavar='PATH', help="also write the report as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    frames = load_frames(args.images, args.max_images)
+    timings = Timings()
+    server = None
+    if args.url:
+        base_url = args.url.rstrip('/')
+    else:
+        camera = start_stub_camera(frames, args.camera_fps)
+        server, base_url = start_app(args, camera.server_port, timings)
+
+    latencies, errors, viewer_frames = [], defaultdict(int), []
+    viewers = [threading.Thread(target=run_viewer, args=(base_url, 10, viewer_frames))
+               for _ in range(args.viewers)]
+    cameras = [threading.Thread(target=run_camera, args=(i, base_url, frames, args, latencies, errors))
+               for i in range(args.cameras)]
+    start = time.perf_counter()
+    for t in viewers + cameras:
+        t.start()
+    for t in cameras:
+        t.join()
+    elapsed = time.perf_counter() - start
+    for t in viewers:
+        t.join()
+    if server is not None:
+        server.writer.close()
+
+    report = {
+        "config": vars(args),
+        "requests": len(latencies),
+        "errors": dict(errors),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "throughput_fps": round(len(latencies) * max(1, args.batch) / elapsed, 2) if elapsed else 0.0,
+        "latency": percentiles(latencies),
+        "stages": timings.report(),
+    }
+    if server is not None:
+        report["writer"] = server.writer.stats()
+        report["max_batch_size"] = server.models.engine.max_batch_size
+    if viewer_frames:
+        report["viewer_frames"] = viewer_frames
+
+    lat = report["latency"]
+    print(f"{report['requests']} requests in {report['elapsed_s']}s -> {report['throughput_fps']} frames/s, "
+          f"errors: {report['errors'] or 'none'}")
+    if lat:
+        print(f"latency  p50 {lat['p50_ms']}ms  p95 {lat['p95_ms']}ms  p99 {lat['p99_ms']}ms  max {lat['max_ms']}ms")
+    for stage, stats in report["stages"].items():
+        print(f"{stage:<15} n={stats['count']:<6} p50 {stats['p50_ms']}ms  p95 {stats['p95_ms']}ms  p99 {stats['p99_ms']}ms")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+
+
+if __name__ == '__main__':
+    main()
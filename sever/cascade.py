@@ -0,0 +1,117 @@
+import threading
+
+import numpy as np
+
+import metrics
+
+MOTION = "motion"
+PERSON = "person"
+
+CASCADE_FRAMES = metrics.registry.register(metrics.Counter(
+    "cascade_frames_total", "Frames per cascade outcome (passed, or the gate that skipped them)", ("outcome",)))
+
+
+class _DeviceState:
+    def __init__(self):
+        self.previous = None
+        self.skipped = 0
+        self.last_score = 0.0
+
+
+# Frame-difference gate: a frame passes when at least `min_changed` of the
+# pixels (sampled every `stride` pixels) differ from the device's previous
+# frame by more than `pixel_delta` grey levels.
+class MotionGate:
+    def __init__(self, pixel_delta=12, min_changed=0.01, stride=2):
+        self.pixel_delta = pixel_delta
+        self.min_changed = min_changed
+        self.stride = stride
+
+    def sample(self, frame):
+        return frame[::self.stride, ::self.stride].astype(np.int16)
+
+    def changed(self, previous, current):
+        if previous is None:
+            return True
+        moving = np.count_nonzero(np.abs(current - previous) > self.pixel_delta)
+        return moving >= self.min_changed * current.size
+
+
+# Optional stages ahead of the fall model. A frame is skipped when nothing
+# moved since the device's previous frame (the previous score still holds)
+# or when the person detector sees nobody (score 0). Gates are bypassed while
+# the device is in a confirmed fall and after `max_skip` consecutive skips,
+# so a still or undetected person is re-checked by the fall model regularly.
+class Cascade:
+    def __init__(self, motion_gate=None, person_models=None, person_threshold=0.5, max_skip=15):
+        self.motion_gate = motion_gate
+        self.person_models = person_models
+        self.person_threshold = person_threshold
+        self.max_skip = max_skip
+        self._devices = {}
+        self._lock = threading.Lock()
+        self._counters = {"frames": 0, "passed": 0, MOTION: 0, PERSON: 0}
+
+    @property
+    def enabled(self):
+        return self.motion_gate is not None or self.person_models is not None
+
+    def _state(self, device_id):
+        state = self._devices.get(device_id)
+        if state is None:
+            state = self._devices[device_id] = _DeviceState()
+        return state
+
+    # Motion stage for a batch of one device's frames. Returns a list with
+    # None for frames that go on to the next stage, else (reason, score).
+    def check_motion(self, device_id, frames, force=False):
+        decisions = []
+        with self._lock:
+            state = self._state(device_id)
+            for frame in frames:
+                current = self.motion_gate.sample(frame) if self.motion_gate else None
+                moved = self.motion_gate is None or self.motion_gate.changed(state.previous, current)
+                state.previous = current
+                if force or moved or state.skipped >= self.max_skip:
+                    decisions.append(None)
+                else:
+                    state.skipped += 1
+                    decisions.append((MOTION, state.last_score))
+        return decisions
+
+    # Person stage: `predict_many` scores frames with the person model
+    def check_person(self, device_id, frames, predict_many, force=False):
+        if self.person_models is None or force or not frames:
+            return [None] * len(frames)
+        scores = predict_many(frames)
+        decisions = []
+        with self._lock:
+            state = self._state(device_id)
+            for score in scores:
+                # A failed person check never hides a frame from the fall model
+                present = isinstance(score, Exception) or score > self.person_threshold
+                if present or state.skipped >= self.max_skip:
+                    decisions.append(None)
+                else:
+                    state.skipped += 1
+                    decisions.append((PERSON, 0.0))
+        return decisions
+
+    # Records the outcome of each frame; `score` is the fall score of frames that passed
+    def record(self, device_id, outcome, score=None):
+        with self._lock:
+            self._counters["frames"] += 1
+            self._counters[outcome] += 1
+            if outcome == "passed":
+                state = self._state(device_id)
+                state.skipped = 0
+                state.last_score = score
+        CASCADE_FRAMES.inc(outcome)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        frames = stats["frames"]
+        stats["skip_rate"] = {gate: round(stats[gate] / frames, 4) if frames else 0.0 for gate in (MOTION, PERSON)}
+        stats["gates"] = [name for name, on in ((MOTION, self.motion_gate), (PERSON, self.person_models)) if on]
+        return stats
@@ -0,0 +1,80 @@
+import logging
+import threading
+from datetime import datetime
+
+# In-process registry of ESP32 devices keyed by MAC. report() writes through
+# to Mongo; lookups and liveness checks are served from memory.
+class DeviceRegistry:
+    def __init__(self, collection, ttl=60, default_ip='192.168.0.101'):
+        self.collection = collection
+        self.ttl = ttl
+        self.default_ip = default_ip
+        self._devices = {}
+        self._by_ip = {}
+        self._lock = threading.Lock()
+
+    # Warm the cache from the devices collection (one query at startup)
+    def load(self):
+        with self._lock:
+            for doc in self.collection.find({}, {"_id": 0, "mac": 1, "ip": 1, "last_seen": 1}):
+                if not doc.get('mac'):
+                    continue
+                # Runs in the background at startup; keep reports that arrived meanwhile
+                current = self._devices.get(doc['mac'])
+                if current and current['last_seen'] and (not doc.get('last_seen')
+                                                         or current['last_seen'] >= doc['last_seen']):
+                    continue
+                self._store(doc['mac'], doc.get('ip'), doc.get('last_seen'))
+        logging.info(f"Device registry loaded {len(self._devices)} device(s).")
+
+    def _store(self, mac, ip, last_seen):
+        old = self._devices.get(mac)
+        if old and old['ip'] and self._by_ip.get(old['ip']) == mac:
+            del self._by_ip[old['ip']]
+        self._devices[mac] = {"mac": mac, "ip": ip, "last_seen": last_seen}
+        if ip:
+            self._by_ip[ip] = mac
+
+    # The cache is updated first so a device that is reporting never looks
+    # offline; a failed write is logged and retried by the next report.
+    # Returns whether the report was persisted.
+    def report(self, mac, ip):
+        now = datetime.now()
+        with self._lock:
+            self._store(mac, ip, now)
+        try:
+            self.collection.update_one(
+                {"mac": mac},
+                {"$set": {"ip": ip, "last_seen": now}},
+                upsert=True
+            )
+            return True
+        except Exception as e:
+            logging.error(f"Failed to persist device {mac}: {e}")
+            return False
+
+    def get(self, mac):
+        with self._lock:
+            device = self._devices.get(mac)
+            return dict(device) if device else None
+
+    def ip_for(self, mac):
+        device = self.get(mac)
+        return device['ip'] if device and device['ip'] else self.default_ip
+
+    def mac_for_ip(self, ip):
+        with self._lock:
+            return self._by_ip.get(ip)
+
+    def is_online(self, mac):
+        device = self.get(mac)
+        if not device or not device['last_seen']:
+            return False
+        return (datetime.now() - device['last_seen']).total_seconds() < self.ttl
+
+    def all(self):
+        with self._lock:
+            devices = [dict(d) for d in self._devices.values()]
+        for device in devices:
+            device['online'] = self.is_online(device['mac'])
+        return devices
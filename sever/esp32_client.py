@@ -0,0 +1,136 @@
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Per-device circuit breaker: after `failure_threshold` consecutive failures
+# calls are rejected for `reset_timeout` seconds, then one trial call is let through.
+class CircuitBreaker:
+    def __init__(self, failure_threshold=3, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self._state()
+            if state == "half-open":
+                # Let a single trial through; re-open until it reports back
+                self.opened_at = time.monotonic()
+                return True
+            return state == "closed"
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+# Breakers keyed by device host
+class _BreakerPool:
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, host):
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = self._breakers[host] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return breaker
+
+    def states(self):
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {host: breaker.state for host, breaker in breakers.items()}
+
+
+# Pooled HTTP client for ESP32 control calls. Each device host gets its own
+# keep-alive session; a call retries within a total deadline instead of
+# stacking per-attempt timeouts, and fails fast while the breaker is open.
+class ESP32Client:
+    def __init__(self, deadline=10.0, attempt_timeout=3.0, backoff=0.5, pool_size=4,
+                 failure_threshold=3, reset_timeout=30):
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.breakers = _BreakerPool(failure_threshold, reset_timeout)
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _session(self, host):
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                session.mount('http://', adapter)
+                self._sessions[host] = session
+            return session
+
+    # Returns the response, or None if the device failed or the breaker is open.
+    # Connection errors, timeouts and 5xx are retried and count against the
+    # breaker; a 4xx is the device answering, so it is returned straight away
+    # (a falsy response).
+    def post(self, url, data, deadline=None):
+        host = urlsplit(url).netloc
+        breaker = self.breakers.get(host)
+        if not breaker.allow():
+            logging.warning(f"Circuit open for {host}, skipping request to {url}")
+            return None
+        session = self._session(host)
+        start_time = time.monotonic()
+        end = start_time + (deadline or self.deadline)
+        attempt = 0
+        while True:
+            remaining = end - time.monotonic()
+            try:
+                response = session.post(url, data=data, timeout=max(0.1, min(self.attempt_timeout, remaining)))
+                if response.status_code >= 500:
+                    response.raise_for_status()
+                breaker.record_success()
+                if not response.ok:
+                    logging.warning(f"Request to {url} rejected: {response.status_code} {response.reason}")
+                    return response
+                logging.info(f"Sent request to {url}, response time: {time.monotonic() - start_time:.2f}s")
+                return response
+            except requests.exceptions.RequestException as e:
+                attempt += 1
+                delay = self.backoff * (2 ** (attempt - 1))
+                if end - time.monotonic() <= delay:
+                    breaker.record_failure()
+                    logging.error(f"Failed to send request to {url} after {attempt} attempt(s): {str(e)}")
+                    return None
+                time.sleep(delay)
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
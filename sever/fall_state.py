@@ -0,0 +1,65 @@
+import threading
+from collections import deque
+
+FALL_STATUS = "Ngã"
+NORMAL_STATUS = "Bình thường"
+
+
+class _DeviceWindow:
+    def __init__(self, window):
+        self.scores = deque(maxlen=window)
+        self.falling = False
+        self.last_alert = None
+
+
+# Per-device k-of-n voting over the last `window` scores with hysteresis:
+# a fall is confirmed when `votes` scores exceed `enter_threshold`, and
+# cleared once fewer than `votes` exceed `exit_threshold`. A new alert is
+# raised only on a confirmed normal -> fall transition and at most once per
+# `cooldown` seconds per device.
+class FallConfirmer:
+    def __init__(self, window=5, votes=3, enter_threshold=0.7, exit_threshold=0.5, cooldown=30):
+        self.window = window
+        self.votes = min(votes, window)
+        self.enter_threshold = enter_threshold
+        self.exit_threshold = exit_threshold
+        self.cooldown = cooldown
+        self._devices = {}
+        self._lock = threading.Lock()
+        self._counters = {"frames": 0, "alerts": 0, "suppressed": 0}
+
+    # Returns (status, alert) for the device after adding `score`
+    def update(self, device_id, score, now):
+        with self._lock:
+            state = self._devices.get(device_id)
+            if state is None:
+                state = self._devices[device_id] = _DeviceWindow(self.window)
+            state.scores.append(score)
+            self._counters["frames"] += 1
+
+            alert = False
+            if not state.falling:
+                if sum(1 for s in state.scores if s > self.enter_threshold) >= self.votes:
+                    state.falling = True
+                    in_cooldown = (state.last_alert is not None
+                                   and (now - state.last_alert).total_seconds() < self.cooldown)
+                    if in_cooldown:
+                        self._counters["suppressed"] += 1
+                    else:
+                        alert = True
+                        state.last_alert = now
+                        self._counters["alerts"] += 1
+            elif sum(1 for s in state.scores if s > self.exit_threshold) < self.votes:
+                state.falling = False
+            return (FALL_STATUS if state.falling else NORMAL_STATUS), alert
+
+    def is_falling(self, device_id):
+        with self._lock:
+            state = self._devices.get(device_id)
+            return state is not None and state.falling
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["falling"] = sorted(d for d, s in self._devices.items() if s.falling)
+        return stats
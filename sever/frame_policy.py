@@ -0,0 +1,79 @@
+import threading
+from collections import deque
+
+from fall_state import FALL_STATUS
+
+# Per-device retention settings: falls are always kept, normal frames only
+# on a status transition or every `normal_sample_every` frames (0 = never).
+class RetentionPolicy:
+    def __init__(self, keep_transitions=True, normal_sample_every=0, ring_size=8):
+        self.keep_transitions = keep_transitions
+        self.normal_sample_every = normal_sample_every
+        self.ring_size = ring_size
+
+    @classmethod
+    def from_dict(cls, data, base=None):
+        base = base or cls()
+        return cls(
+            keep_transitions=data.get('keep_transitions', base.keep_transitions),
+            normal_sample_every=data.get('normal_sample_every', base.normal_sample_every),
+            ring_size=data.get('ring_size', base.ring_size)
+        )
+
+
+class _DeviceState:
+    def __init__(self, ring_size):
+        self.last_status = None
+        self.since_kept = 0
+        self.ring = deque(maxlen=ring_size)
+
+
+# Decides which frames get persisted and keeps the last N unsaved frames of
+# each device in memory so a fall can be stored with its pre-event context.
+class FrameRetention:
+    def __init__(self, default_policy=None, device_policies=None):
+        self.default_policy = default_policy or RetentionPolicy()
+        self.device_policies = device_policies or {}
+        self._devices = {}
+        self._lock = threading.Lock()
+        self._counters = {"kept": 0, "skipped": 0, "pre_event": 0}
+
+    def policy_for(self, device_id):
+        return self.device_policies.get(device_id, self.default_policy)
+
+    # Returns (keep, pre_event) where pre_event is a list of buffered
+    # (captured_at, frame, score) tuples to persist ahead of this frame.
+    def decide(self, device_id, frame, score, status, captured_at):
+        policy = self.policy_for(device_id)
+        with self._lock:
+            state = self._devices.get(device_id)
+            if state is None:
+                state = self._devices[device_id] = _DeviceState(policy.ring_size)
+            transition = state.last_status is not None and status != state.last_status
+            state.last_status = status
+            state.since_kept += 1
+
+            pre_event = []
+            if status == FALL_STATUS:
+                keep = True
+                pre_event = list(state.ring)
+                state.ring.clear()
+            elif transition and policy.keep_transitions:
+                keep = True
+            else:
+                keep = policy.normal_sample_every > 0 and state.since_kept >= policy.normal_sample_every
+
+            if keep:
+                state.since_kept = 0
+                self._counters["kept"] += 1
+                self._counters["pre_event"] += len(pre_event)
+            else:
+                state.ring.append((captured_at, frame, score))
+                self._counters["skipped"] += 1
+            return keep, pre_event
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["devices"] = len(self._devices)
+        return stats
@@ -0,0 +1,138 @@
+import json
+import logging
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DESCENDING
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+EXPORT_BATCH_SIZE = 1000
+
+# Newest first; _id breaks ties between entries with the same timestamp
+SORT_ORDER = [("timestamp", DESCENDING), ("_id", DESCENDING)]
+
+# Compound indexes backing the filters and the sort order of /api/history
+def ensure_indexes(collection, timeseries=False):
+    if timeseries:
+        ensure_timeseries_indexes(collection)
+        return
+    collection.create_index(SORT_ORDER, name="timestamp_id")
+    collection.create_index([("status", ASCENDING)] + SORT_ORDER, name="status_timestamp_id")
+    collection.create_index([("location", ASCENDING)] + SORT_ORDER, name="location_timestamp_id")
+    collection.create_index([("device_id", ASCENDING)] + SORT_ORDER, name="device_timestamp_id")
+    # Orphaned image sweeps look entries up by image
+    collection.create_index([("image_path", ASCENDING)], name="image_path")
+    logging.info("History indexes ready.")
+
+
+# Time-series collections (see migrate_history.py --timeseries) are bucketed
+# by device_id (metaField) and timestamp (timeField); secondary indexes go
+# on those plus the filtered measurement fields, without the _id tie-break.
+# Default names, so MongoDB 6.3+'s own device_id/timestamp index is reused.
+def ensure_timeseries_indexes(collection):
+    collection.create_index([("device_id", ASCENDING), ("timestamp", ASCENDING)])
+    collection.create_index([("timestamp", DESCENDING)])
+    collection.create_index([("status", ASCENDING), ("timestamp", DESCENDING)])
+    collection.create_index([("location", ASCENDING), ("timestamp", DESCENDING)])
+    collection.create_index([("image_path", ASCENDING)])
+    logging.info("Time-series history indexes ready.")
+
+
+# `limit` query arg: a positive integer, capped at `maximum` (None = no cap)
+def parse_limit(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    if value is None or value == '':
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError(f"Invalid limit: {value}")
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return limit if maximum is None else min(limit, maximum)
+
+
+def parse_time(value):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid time: {value}")
+
+
+# History document as stored: native datetime, float score in [0, 1]
+def make_entry(captured_at, device_id, location, status, score, image_path):
+    return {
+        "timestamp": captured_at,
+        "device_id": device_id,
+        "location": location,
+        "status": status,
+        "score": float(score),
+        "image_path": image_path
+    }
+
+
+# Filters from query args: status, location, device, from/to (ISO times) and
+# `after`, the id of the last entry of the previous page.
+def build_query(collection, args):
+    query = {}
+    if args.get('status'):
+        query['status'] = args['status']
+    if args.get('location'):
+        query['location'] = args['location']
+    if args.get('device'):
+        query['device_id'] = args['device']
+    time_range = {}
+    if args.get('from'):
+        time_range['$gte'] = parse_time(args['from'])
+    if args.get('to'):
+        time_range['$lte'] = parse_time(args['to'])
+    if time_range:
+        query['timestamp'] = time_range
+
+    after = args.get('after')
+    if after:
+        try:
+            after_id = ObjectId(after)
+        except InvalidId:
+            raise ValueError(f"Invalid cursor: {after}")
+        last = collection.find_one({"_id": after_id}, {"timestamp": 1})
+        if not last:
+            raise ValueError(f"Unknown cursor: {after}")
+        query = {"$and": [query, {"$or": [
+            {"timestamp": {"$lt": last['timestamp']}},
+            {"timestamp": last['timestamp'], "_id": {"$lt": after_id}}
+        ]}]}
+    return query
+
+
+# API/Socket.IO shape: formatted timestamp and probability for the templates
+def to_json(doc):
+    if '_id' in doc:
+        doc['id'] = str(doc.pop('_id'))
+    timestamp = doc.get('timestamp')
+    if isinstance(timestamp, datetime):
+        doc['timestamp'] = timestamp.strftime(TIMESTAMP_FORMAT)
+    if 'score' in doc and 'probability' not in doc:
+        doc['probability'] = f"{doc['score'] * 100:.0f}%"
+    return doc
+
+
+# One page plus the cursor for the next one (None on the last page)
+def fetch_page(collection, query, limit):
+    docs = [to_json(doc) for doc in collection.find(query).sort(SORT_ORDER).limit(limit + 1)]
+    next_cursor = docs[limit - 1]['id'] if len(docs) > limit else None
+    return {"items": docs[:limit], "next": next_cursor}
+
+
+# Streams matching entries as newline-delimited JSON for bulk export
+def export_ndjson(collection, query, limit=None):
+    cursor = collection.find(query).sort(SORT_ORDER).batch_size(EXPORT_BATCH_SIZE)
+    if limit:
+        cursor = cursor.limit(limit)
+    try:
+        for doc in cursor:
+            yield json.dumps(to_json(doc), ensure_ascii=False, default=str) + "\n"
+    finally:
+        cursor.close()
@@ -0,0 +1,397 @@
+import argparse
+import hashlib
+import io
+import logging
+import os
+import re
+import struct
+import tarfile
+import threading
+
+import numpy as np
+from PIL import Image
+
+import metrics
+
+KEY_RE = re.compile(r"[0-9a-f]{32}")
+
+
+# Content key of a raw frame: identical frames share one stored image
+def frame_key(frame):
+    return hashlib.blake2b(np.ascontiguousarray(frame), digest_size=16).hexdigest()
+
+
+def encode_jpeg(frame):
+    buf = io.BytesIO()
+    with metrics.JPEG_ENCODE.time():
+        Image.fromarray(frame, mode='L').save(buf, format='JPEG')
+    return buf.getvalue()
+
+
+def _read_only(root):
+    return PermissionError(f"Image store {root} is open read-only")
+
+
+# One JPEG per key, sharded two levels deep (root/ab/cd/abcd....jpg) so no
+# directory grows past a few thousand entries
+class LooseStore:
+    def __init__(self, root, read_only=False):
+        self.root = root
+        self.read_only = read_only
+        if not read_only:
+            os.makedirs(root, exist_ok=True)
+
+    def path_for(self, key):
+        return os.path.join(self.root, key[:2], key[2:4], f"{key}.jpg")
+
+    def contains(self, key):
+        return os.path.exists(self.path_for(key))
+
+    def write(self, key, data):
+        if self.read_only:
+            raise _read_only(self.root)
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return True
+
+    def get(self, key):
+        try:
+            with open(self.path_for(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    # Returns the bytes freed (0 if the key was not stored)
+    def delete(self, key):
+        if self.read_only:
+            raise _read_only(self.root)
+        path = self.path_for(key)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            return size
+        except FileNotFoundError:
+            return 0
+
+    def items(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in sorted(filenames):
+                key = name[:-4]
+                if name.endswith('.jpg') and KEY_RE.fullmatch(key):
+                    with open(os.path.join(dirpath, name), 'rb') as f:
+                        yield key, f.read()
+
+    def keys(self):
+        for _, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith('.jpg') and KEY_RE.fullmatch(name[:-4]):
+                    yield name[:-4]
+
+
+# Append-only segment files (seg-000001.pack, ...) holding records of
+# magic "FIMG", 16-byte key, u32 length and the JPEG bytes, plus an
+# append-only index (key, segment, offset, length) loaded into memory at
+# startup. Millions of frames take a few hundred files instead of millions
+# of inodes, and bulk export is a sequential read.
+#
+# Only one process may open a store for writing. Readers (export, rescore)
+# open it with read_only=True: they load a snapshot of the index and never
+# truncate or append, so they are safe next to the running server.
+class PackedStore:
+    RECORD = struct.Struct("<4s16sI")
+    INDEX = struct.Struct("<16sIQI")
+    MAGIC = b"FIMG"
+
+    def __init__(self, root, segment_bytes=256 * 1024 * 1024, read_only=False):
+        self.root = root
+        self.segment_bytes = segment_bytes
+        self.read_only = read_only
+        if not read_only:
+            os.makedirs(root, exist_ok=True)
+        self._index = {}
+        self._fds = {}
+        self._lock = threading.Lock()
+        self._index_path = os.path.join(root, "index.bin")
+        ends = self._load_index()
+        segments = self._segments()
+        self._segment = segments[-1] if segments else 1
+        self._out = self._index_out = None
+        if read_only:
+            return
+        if ends is not None:
+            self._truncate_tail(self._segment, ends.get(self._segment, 0))
+        self._out = open(self._segment_path(self._segment), 'ab')
+        self._index_out = open(self._index_path, 'ab')
+
+    def _segment_path(self, segment):
+        return os.path.join(self.root, f"seg-{segment:06d}.pack")
+
+    def _segments(self):
+        return sorted(int(name[4:10]) for name in os.listdir(self.root)
+                      if name.startswith("seg-") and name.endswith(".pack"))
+
+    # Later records win; segment 0 marks a deleted key. Entries past the end
+    # of their segment (a write cut short) are dropped. Returns the end of
+    # the last indexed record of each segment (None without an index yet).
+    def _load_index(self):
+        if not os.path.exists(self._index_path):
+            return None
+        ends = {}
+        sizes = {s: os.path.getsize(self._segment_path(s)) for s in self._segments()}
+        with open(self._index_path, 'rb') as f:
+            data = f.read()
+        usable = len(data) - len(data) % self.INDEX.size
+        for key, segment, offset, length in self.INDEX.iter_unpack(data[:usable]):
+            if segment == 0:
+                self._index.pop(key, None)
+            elif offset + length <= sizes.get(segment, 0):
+                self._index[key] = (segment, offset, length)
+                ends[segment] = max(ends.get(segment, 0), offset + length)
+        logging.info(f"Image index loaded {len(self._index)} image(s).")
+        return ends
+
+    # A crash mid-append leaves a torn record after the last indexed one;
+    # cut it off so new records do not land behind it
+    def _truncate_tail(self, segment, end):
+        path = self._segment_path(segment)
+        if not os.path.exists(path) or os.path.getsize(path) <= end:
+            return
+        logging.warning(f"Truncating {os.path.getsize(path) - end} unindexed byte(s) from segment {segment}")
+        os.truncate(path, end)
+
+    def contains(self, key):
+        return bytes.fromhex(key) in self._index
+
+    def write(self, key, data):
+        if self.read_only:
+            raise _read_only(self.root)
+        raw_key = bytes.fromhex(key)
+        with self._lock:
+            if raw_key in self._index:
+                return False
+            self._append(raw_key, data)
+        return True
+
+    # Caller holds the lock
+    def _append(self, raw_key, data):
+        if self._out.tell() + self.RECORD.size + len(data) > self.segment_bytes and self._out.tell() > 0:
+            self._out.close()
+            self._segment += 1
+            self._out = open(self._segment_path(self._segment), 'ab')
+        offset = self._out.tell() + self.RECORD.size
+        self._out.write(self.RECORD.pack(self.MAGIC, raw_key, len(data)))
+        self._out.write(data)
+        self._out.flush()
+        self._index_out.write(self.INDEX.pack(raw_key, self._segment, offset, len(data)))
+        self._index_out.flush()
+        self._index[raw_key] = (self._segment, offset, len(data))
+
+    def _fd(self, segment):
+        fd = self._fds.get(segment)
+        if fd is None:
+            with self._lock:
+                fd = self._fds.get(segment)
+                if fd is None:
+                    fd = self._fds[segment] = os.open(self._segment_path(segment), os.O_RDONLY)
+        return fd
+
+    def get(self, key):
+        location = self._index.get(bytes.fromhex(key))
+        if location is None:
+            return None
+        segment, offset, length = location
+        try:
+            return os.pread(self._fd(segment), length, offset)
+        except OSError:
+            # The segment was compacted away meanwhile; the index has the new location
+            location = self._index.get(bytes.fromhex(key))
+            return os.pread(self._fd(location[0]), location[2], location[1]) if location else None
+
+    # Drops the key from the index and returns the record size; the bytes
+    # stay in the segment until compact() rewrites it
+    def delete(self, key):
+        if self.read_only:
+            raise _read_only(self.root)
+        raw_key = bytes.fromhex(key)
+        with self._lock:
+            location = self._index.pop(raw_key, None)
+            if location is None:
+                return 0
+            self._index_out.write(self.INDEX.pack(raw_key, 0, 0, 0))
+            self._index_out.flush()
+            return location[2]
+
+    # Rewrites sealed segments whose live records take less than
+    # `min_live_ratio` of the file into the current segment, then removes
+    # them. Returns (segments removed, bytes reclaimed).
+    def compact(self, min_live_ratio=0.5):
+        if self.read_only:
+            raise _read_only(self.root)
+        live = {}
+        with self._lock:
+            current = self._segment
+            for segment, _, length in self._index.values():
+                live[segment] = live.get(segment, 0) + self.RECORD.size + length
+        removed, reclaimed = 0, 0
+        for segment in self._segments():
+            if segment >= current:
+                continue
+            path = self._segment_path(segment)
+            size = os.path.getsize(path)
+            if size and live.get(segment, 0) >= min_live_ratio * size:
+                continue
+            # One record per lock hold so image writes are never stalled for long
+            with self._lock:
+                moving = [(raw_key, loc) for raw_key, loc in self._index.items() if loc[0] == segment]
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                for raw_key, location in moving:
+                    data = os.pread(fd, location[2], location[1])
+                    with self._lock:
+                        if self._index.get(raw_key) == location:
+                            self._append(raw_key, data)
+            finally:
+                os.close(fd)
+            with self._lock:
+                cached = self._fds.pop(segment, None)
+                if cached is not None:
+                    os.close(cached)
+                os.remove(path)
+            removed += 1
+            reclaimed += size - live.get(segment, 0)
+        return removed, reclaimed
+
+    # Live records in segment order, read through the index so a bad
+    # record in a segment cannot hide the ones after it
+    def items(self):
+        with self._lock:
+            live = sorted(self._index.items(), key=lambda item: item[1])
+        for raw_key, (segment, offset, length) in live:
+            try:
+                data = os.pread(self._fd(segment), length, offset)
+            except OSError:
+                # Compacted away meanwhile; the record was rewritten under the same key
+                location = self._index.get(raw_key)
+                if location is None:
+                    continue
+                data = os.pread(self._fd(location[0]), location[2], location[1])
+            yield raw_key.hex(), data
+
+    def keys(self):
+        return [raw_key.hex() for raw_key in list(self._index)]
+
+    def close(self):
+        with self._lock:
+            if self._out is not None:
+                self._out.close()
+                self._index_out.close()
+            for fd in self._fds.values():
+                os.close(fd)
+            self._fds.clear()
+
+
+# Content-addressed image store used by the write-behind pipeline: put()
+# skips the JPEG encode and the write when the frame is already stored.
+# Tools that only read images use read_only=True.
+class ImageStore:
+    def __init__(self, root, packed=False, segment_bytes=256 * 1024 * 1024, url_prefix="/images", read_only=False):
+        if packed:
+            self.backend = PackedStore(root, segment_bytes, read_only=read_only)
+        else:
+            self.backend = LooseStore(root, read_only=read_only)
+        self.url_prefix = url_prefix
+        self._lock = threading.Lock()
+        self._counters = {"written": 0, "duplicates": 0, "bytes_written": 0}
+        # Keys put since the last take_touched(); an orphan sweep must not
+        # delete an image a queued history entry is about to reference
+        self._touched = set()
+
+    key_for = staticmethod(frame_key)
+
+    def url_for(self, key):
+        return f"{self.url_prefix}/{key}.jpg"
+
+    def put(self, key, frame):
+        with self._lock:
+            self._touched.add(key)
+        if self.backend.contains(key):
+            self._count("duplicates")
+            return False
+        data = encode_jpeg(frame)
+        if not self.backend.write(key, data):
+            self._count("duplicates")
+            return False
+        self._count("written")
+        self._count("bytes_written", len(data))
+        return True
+
+    def get(self, key):
+        return self.backend.get(key) if KEY_RE.fullmatch(key) else None
+
+    # Returns the bytes freed; with `unless_touched`, keys put since the
+    # last take_touched() are kept
+    def delete(self, key, unless_touched=False):
+        with self._lock:
+            if unless_touched and key in self._touched:
+                return 0
+            return self.backend.delete(key)
+
+    def take_touched(self):
+        with self._lock:
+            touched, self._touched = self._touched, set()
+        return touched
+
+    def compact(self, min_live_ratio=0.5):
+        if isinstance(self.backend, PackedStore):
+            return self.backend.compact(min_live_ratio)
+        return 0, 0
+
+    def keys(self):
+        return self.backend.keys()
+
+    def items(self):
+        return self.backend.items()
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self._counters[key] += n
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def close(self):
+        if hasattr(self.backend, 'close'):
+            self.backend.close()
+
+
+def export_tar(store, out_path):
+    count = 0
+    with tarfile.open(out_path, 'w') as tar:
+        for key, data in store.items():
+            info = tarfile.TarInfo(f"{key}.jpg")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+            count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the content-addressed image store to a tar file")
+    parser.add_argument('--root', default=os.path.join('static', 'uploads', 'images'))
+    parser.add_argument('--packed', action='store_true', help="The store uses packed segments")
+    parser.add_argument('--out', required=True)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    store = ImageStore(args.root, packed=args.packed, read_only=True)
+    count = export_tar(store, args.out)
+    store.close()
+    logging.info(f"Exported {count} image(s) to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
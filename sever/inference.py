@@ -0,0 +1,262 @@
+import logging
+import time
+
+import numpy as np
+
+import metrics
+
+# Workers must be real OS threads even when the server runs under eventlet's
+# monkey patching, so the interpreters never block the event loop.
+try:
+    from eventlet.patcher import original
+    queue = original('queue')
+    threading = original('threading')
+except ImportError:
+    import queue
+    import threading
+
+
+class InferenceTimeout(Exception):
+    pass
+
+
+class InferenceBusy(Exception):
+    pass
+
+
+# Maps raw 0-255 pixels straight to the model's input encoding using the
+# input quantization (q = p / 255 / scale + zero_point). For the shipped
+# int8 model (scale 1/255, zero point -128) this is the old `p ^ 0x80`.
+def input_lut(input_detail):
+    pixels = np.arange(256, dtype=np.float64) / 255.0
+    scale, zero_point = input_detail['quantization']
+    if not scale:
+        return pixels.astype(input_detail['dtype'])
+    info = np.iinfo(input_detail['dtype'])
+    return np.clip(np.round(pixels / scale + zero_point), info.min, info.max).astype(input_detail['dtype'])
+
+
+# Fall score per row of a model output: the single value of a sigmoid head
+# or the class 1 probability of a two-way softmax, dequantized if needed
+def decode_scores(output_data, output_detail):
+    scale, zero_point = output_detail['quantization']
+    if scale:
+        output_data = (output_data.astype(np.float32) - zero_point) * scale
+    return [row.item() if row.size == 1 else row[1].item() for row in output_data]
+
+
+# Result slot for one queued frame
+class PendingResult:
+    def __init__(self):
+        self._done = threading.Event()
+        self._value = None
+        self._error = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def set_result(self, value):
+        self._value = value
+        self._finish()
+
+    def set_exception(self, error):
+        self._error = error
+        self._finish()
+
+    # `fn(value, error)` runs on the worker thread once the result is in,
+    # or immediately if it already is
+    def add_done_callback(self, fn):
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self._value, self._error)
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn(self._value, self._error)
+            except Exception as e:
+                logging.error(f"Result callback failed: {e}")
+
+    def result(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise InferenceTimeout(f"No result within {timeout}s")
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+
+# Micro-batching inference engine: concurrent requests are gathered into
+# batches and run on a small pool of interpreters, one worker thread each.
+# With threaded=False no workers start and the caller scores batches itself
+# through run_batch() (used by the inference worker processes).
+class InferenceEngine:
+    def __init__(self, model_path, interpreter_cls, pool_size=2, max_batch_size=8,
+                 max_wait_ms=5.0, num_threads=1, max_queue=256, threaded=True):
+        self.model_path = model_path
+        self.max_wait = max_wait_ms / 1000.0
+        self._requests = queue.Queue(maxsize=max_queue)
+        self._interpreters = []
+        for _ in range(max(1, pool_size)):
+            interpreter = interpreter_cls(model_path=model_path, num_threads=num_threads)
+            interpreter.allocate_tensors()
+            self._interpreters.append(interpreter)
+
+        self.input_details = self._interpreters[0].get_input_details()
+        self.output_details = self._interpreters[0].get_output_details()
+        self.frame_shape = tuple(self.input_details[0]['shape'][1:])
+        self.frame_size = int(np.prod(self.frame_shape))
+        self.input_dtype = self.input_details[0]['dtype']
+        self._lut = input_lut(self.input_details[0])
+        self.max_batch_size = self._probe_batch_size(max(1, max_batch_size))
+
+        # Current batch dimension of each interpreter, so we only reallocate on change
+        self._batch_dims = [1] * len(self._interpreters)
+        self._closed = False
+        self._submit_lock = threading.Lock()
+        self._threads = []
+        for i in range(len(self._interpreters) if threaded else 0):
+            t = threading.Thread(target=self._worker, args=(i,), name=f"inference-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        logging.info(f"Inference engine ready: {len(self._interpreters)} interpreter(s), "
+                     f"max batch {self.max_batch_size}, max wait {max_wait_ms}ms")
+
+    # Some converted models have the batch size baked into a reshape; fall back to 1
+    def _probe_batch_size(self, max_batch_size):
+        if max_batch_size == 1:
+            return 1
+        interpreter = self._interpreters[0]
+        try:
+            self._resize(interpreter, max_batch_size)
+            interpreter.set_tensor(self.input_details[0]['index'],
+                                   np.zeros((max_batch_size,) + self.frame_shape, dtype=self.input_dtype))
+            interpreter.invoke()
+            out = interpreter.get_tensor(self.output_details[0]['index'])
+            if out.shape[0] != max_batch_size:
+                raise ValueError(f"output batch {out.shape[0]} != {max_batch_size}")
+            return max_batch_size
+        except Exception as e:
+            logging.warning(f"Model does not support batch size {max_batch_size}, using 1: {e}")
+            return 1
+        finally:
+            self._resize(interpreter, 1)
+
+    def _resize(self, interpreter, batch_size):
+        interpreter.resize_tensor_input(self.input_details[0]['index'], (batch_size,) + self.frame_shape)
+        interpreter.allocate_tensors()
+
+    # `frame` is the raw uint8 frame (any shape with frame_size pixels); it is
+    # only read when the batch runs, so no copy is made on the request path.
+    def submit(self, frame):
+        pending = PendingResult()
+        with self._submit_lock:
+            if self._closed:
+                raise InferenceBusy("Inference engine closed")
+            try:
+                self._requests.put_nowait((frame, pending))
+            except queue.Full:
+                raise InferenceBusy("Inference queue full")
+        return pending
+
+    def predict(self, frame, timeout=None):
+        return self.submit(frame).result(timeout=timeout)
+
+    # Scores for several frames at once; failed frames get their exception
+    # in place of a score. All frames are queued together so they share batches.
+    def predict_many(self, frames, timeout=None):
+        pending = []
+        for frame in frames:
+            try:
+                pending.append(self.submit(frame))
+            except InferenceBusy as e:
+                pending.append(e)
+        return self.collect(pending, timeout)
+
+    # Waits for a list of PendingResult (or exceptions) under one shared deadline
+    @staticmethod
+    def collect(pending, timeout=None):
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        results = []
+        for item in pending:
+            if isinstance(item, Exception):
+                results.append(item)
+                continue
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                results.append(item.result(timeout=remaining))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def queue_depth(self):
+        return self._requests.qsize()
+
+    # Frames already queued are still scored: the stop markers go in behind
+    # them, and nothing can be queued after the markers.
+    def close(self):
+        with self._submit_lock:
+            if self._closed:
+                return
+            self._closed = True
+        for _ in self._threads:
+            self._requests.put((None, None))
+
+    def _collect_batch(self):
+        item = self._requests.get()
+        if item[1] is None:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item[1] is None:
+                self._requests.put(item)
+                break
+            batch.append(item)
+        return batch
+
+    def _worker(self, slot):
+        interpreter = self._interpreters[slot]
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                return
+            try:
+                scores = self._run_batch(slot, interpreter, [frame for frame, _ in batch])
+                for (_, pending), score in zip(batch, scores):
+                    pending.set_result(score)
+            except Exception as e:
+                logging.error(f"Inference batch of {len(batch)} failed: {e}")
+                for _, pending in batch:
+                    pending.set_exception(e)
+
+    # Scores `frames` synchronously on the first interpreter; only for
+    # engines created with threaded=False
+    def run_batch(self, frames):
+        return self._run_batch(0, self._interpreters[0], frames)
+
+    def _run_batch(self, slot, interpreter, frames):
+        n = len(frames)
+        if self._batch_dims[slot] != n:
+            self._resize(interpreter, n)
+            self._batch_dims[slot] = n
+        # Quantize each frame in place into the interpreter's own input buffer;
+        # the view must be released before invoke()
+        inputs = interpreter.tensor(self.input_details[0]['index'])().reshape(n, self.frame_size)
+        for i, frame in enumerate(frames):
+            np.take(self._lut, frame.reshape(-1), out=inputs[i])
+        del inputs
+        metrics.BATCH_SIZE.observe(n)
+        with metrics.INVOKE.time():
+            interpreter.invoke()
+        return decode_scores(interpreter.get_tensor(self.output_details[0]['index']), self.output_details[0])
@@ -0,0 +1,57 @@
+import struct
+
+# Batch frame protocol (little-endian), one device per batch:
+#   header: magic "FDB1", version u8, device id length u8, location length u8,
+#           pad u8, frame count u16, then device id and location (UTF-8)
+#   frame:  sequence u32, capture time u64 (ms since epoch, 0 = unknown),
+#           payload length u32, then the raw 96x96 grayscale payload
+MAGIC = b"FDB1"
+VERSION = 1
+HEADER = struct.Struct("<4sBBBxH")
+FRAME_HEADER = struct.Struct("<IQI")
+MAX_FRAMES = 256
+# Capture times past 2100-01-01 are garbage (and beyond what datetime can
+# represent on some platforms)
+MAX_CAPTURED_MS = 4102444800000
+
+
+def parse_batch(data):
+    view = memoryview(data)
+    if len(view) < HEADER.size:
+        raise ValueError("Batch too short")
+    magic, version, id_len, loc_len, count = HEADER.unpack_from(view, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Unknown batch format")
+    if count > MAX_FRAMES:
+        raise ValueError(f"Too many frames in batch: {count}")
+    offset = HEADER.size
+    if len(view) < offset + id_len + loc_len:
+        raise ValueError("Truncated batch header")
+    device_id = bytes(view[offset:offset + id_len]).decode('utf-8')
+    offset += id_len
+    location = bytes(view[offset:offset + loc_len]).decode('utf-8') or None
+    offset += loc_len
+
+    frames = []
+    for _ in range(count):
+        if len(view) < offset + FRAME_HEADER.size:
+            raise ValueError("Truncated frame header")
+        seq, captured_ms, length = FRAME_HEADER.unpack_from(view, offset)
+        offset += FRAME_HEADER.size
+        if captured_ms > MAX_CAPTURED_MS:
+            raise ValueError(f"Capture time out of range for frame {seq}: {captured_ms}")
+        if len(view) < offset + length:
+            raise ValueError(f"Truncated payload for frame {seq}")
+        frames.append((seq, captured_ms, view[offset:offset + length]))
+        offset += length
+    return device_id, location, frames
+
+
+def encode_batch(device_id, frames, location=""):
+    device = device_id.encode('utf-8')
+    loc = location.encode('utf-8')
+    parts = [HEADER.pack(MAGIC, VERSION, len(device), len(loc), len(frames)), device, loc]
+    for seq, captured_ms, payload in frames:
+        parts.append(FRAME_HEADER.pack(seq, captured_ms, len(payload)))
+        parts.append(bytes(payload))
+    return b"".join(parts)
@@ -0,0 +1,113 @@
+import threading
+from collections import deque
+
+# Socket.IO rooms: every browser is in ALL_ROOM unless it subscribed to
+# specific devices or locations
+ALL_ROOM = "all"
+
+
+def device_room(device_id):
+    return f"device:{device_id}"
+
+
+def location_room(location):
+    return f"location:{location}"
+
+
+def rooms_for(device_id, location=None):
+    rooms = [ALL_ROOM, device_room(device_id)]
+    if location:
+        rooms.append(location_room(location))
+    return rooms
+
+
+class _Summary:
+    def __init__(self, device_id, location, max_items):
+        self.device_id = device_id
+        self.location = location
+        self.count = 0
+        self.falls = 0
+        self.items = deque(maxlen=max_items)
+
+
+# Live detection feed. Alerts are pushed at once as 'new_detection'; all
+# other detections are coalesced per device and pushed every `interval`
+# seconds as one 'detection_summary' with the count and the last
+# `max_items` entries. `emit(event, data, rooms)` does the sending.
+class LiveFeed:
+    def __init__(self, emit, interval=2.0, max_items=20, fall_status=None):
+        self._emit = emit
+        self.interval = interval
+        self.max_items = max_items
+        self.fall_status = fall_status
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._counters = {"alerts": 0, "coalesced": 0, "summaries": 0}
+
+    # `entry` is a JSON-ready history entry
+    def publish(self, entry):
+        device_id = entry.get('device_id')
+        if entry.get('alert'):
+            with self._lock:
+                self._counters["alerts"] += 1
+            self._emit('new_detection', entry, rooms_for(device_id, entry.get('location')))
+            return
+        with self._lock:
+            summary = self._pending.get(device_id)
+            if summary is None:
+                summary = self._pending[device_id] = _Summary(device_id, entry.get('location'), self.max_items)
+            summary.location = entry.get('location') or summary.location
+            summary.count += 1
+            if entry.get('status') == self.fall_status:
+                summary.falls += 1
+            summary.items.append(entry)
+            self._counters["coalesced"] += 1
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._counters["summaries"] += len(pending)
+        for summary in pending.values():
+            self._emit('detection_summary', {
+                "device_id": summary.device_id,
+                "location": summary.location,
+                "count": summary.count,
+                "falls": summary.falls,
+                "items": list(summary.items),
+            }, rooms_for(summary.device_id, summary.location))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["pending_devices"] = len(self._pending)
+        return stats
+
+
+# Pushes device online/offline changes from the device registry, so pages
+# no longer poll the server (and through it, the ESP32) for status.
+class DeviceStatusFeed:
+    def __init__(self, registry, emit):
+        self.registry = registry
+        self._emit = emit
+        self._last = {}
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        return [self._public(device) for device in self.registry.all()]
+
+    @staticmethod
+    def _public(device):
+        last_seen = device.get('last_seen')
+        return {"mac": device['mac'], "ip": device.get('ip'), "online": device['online'],
+                "last_seen": last_seen.isoformat() if last_seen else None}
+
+    # Emits the devices whose online state changed since the last check
+    def check(self):
+        devices = self.snapshot()
+        with self._lock:
+            changed = [d for d in devices if self._last.get(d['mac']) != d['online']]
+            for d in changed:
+                self._last[d['mac']] = d['online']
+        for device in changed:
+            self._emit('device_status', device, rooms_for(device['mac']))
+        return changed
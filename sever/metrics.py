@@ -0,0 +1,178 @@
+import bisect
+import time
+from contextlib import contextmanager
+
+# Locks are taken from inference worker threads too, which stay real OS
+# threads under eventlet; critical sections are a few instructions long.
+try:
+    from eventlet.patcher import original
+    threading = original('threading')
+except ImportError:
+    import threading
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Hot-path instrumentation is a no-op until configure(True)
+enabled = False
+
+
+def configure(enable):
+    global enabled
+    enabled = enable
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    parts = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+    return "{" + parts + "}" if parts else ""
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        if not enabled:
+            return
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self):
+        if not enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def render(self):
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        cumulative += counts[-1]
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {cumulative}')
+        lines.append(f"{self.name}_sum {total}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        if not enabled:
+            return
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(zip(self.label_names, label_values))} {value}")
+        return lines
+
+
+# Value read at scrape time; fn returns a number or a {labels_tuple: value} dict
+class Gauge:
+    def __init__(self, name, help_text, fn, label_names=(), metric_type="gauge"):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.label_names = label_names
+        self.metric_type = metric_type
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.metric_type}"]
+        value = self.fn()
+        if isinstance(value, dict):
+            for label_values, v in sorted(value.items()):
+                lines.append(f"{self.name}{_format_labels(zip(self.label_names, label_values))} {v}")
+        else:
+            lines.append(f"{self.name} {value}")
+        return lines
+
+
+# Per-key event rate as an exponentially weighted moving average of the
+# inter-arrival time; O(1) per event and per key.
+class RateMeter:
+    def __init__(self, alpha=0.2):
+        self.alpha = alpha
+        self._last = {}
+        self._interval = {}
+        self._lock = threading.Lock()
+
+    def mark(self, key):
+        if not enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            last = self._last.get(key)
+            self._last[key] = now
+            if last is None:
+                return
+            dt = now - last
+            prev = self._interval.get(key)
+            self._interval[key] = dt if prev is None else prev + self.alpha * (dt - prev)
+
+    def rates(self, stale_after=60):
+        now = time.monotonic()
+        with self._lock:
+            return {(key,): round(1.0 / interval, 3) if interval > 0 and now - self._last[key] < stale_after else 0.0
+                    for key, interval in self._interval.items()}
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                continue
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# Stage histograms shared by the app, the inference engine and the writer
+DECODE = registry.register(Histogram("fall_detect_decode_seconds", "Payload decode and preprocessing time"))
+INVOKE = registry.register(Histogram("inference_invoke_seconds", "Interpreter invoke time per batch"))
+BATCH_SIZE = registry.register(Histogram("inference_batch_size", "Frames per inference batch",
+                                         buckets=(1, 2, 4, 8, 16, 32, 64)))
+JPEG_ENCODE = registry.register(Histogram("jpeg_encode_seconds", "JPEG encode and save time per frame"))
+DB_INSERT = registry.register(Histogram("mongo_insert_seconds", "History insert_many time per batch"))
+EMIT = registry.register(Histogram("socketio_emit_seconds", "Socket.IO emit time per event"))
+REQUEST = registry.register(Histogram("fall_detect_seconds", "Total /fall_detect handler time"))
+FRAMES = registry.register(Counter("fall_detect_frames_total", "Frames received per device", ("device",)))
+DEVICE_RATE = RateMeter()
@@ -0,0 +1,106 @@
+import argparse
+import logging
+from datetime import datetime
+
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import CollectionInvalid
+
+import history
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+LEGACY_DEVICE_ID = "unknown"
+
+# Typed fields for a legacy entry ("%Y-%m-%d %H:%M:%S" timestamp, "87%" probability)
+def convert(doc):
+    fields = {}
+    timestamp = doc.get('timestamp')
+    if isinstance(timestamp, str):
+        fields['timestamp'] = datetime.strptime(timestamp, history.TIMESTAMP_FORMAT)
+    probability = doc.get('probability')
+    if isinstance(probability, str) and 'score' not in doc:
+        fields['score'] = float(probability.rstrip('%')) / 100.0
+    if 'device_id' not in doc:
+        fields['device_id'] = LEGACY_DEVICE_ID
+    return fields
+
+
+# Rewrites legacy documents in place with bulk updates of `batch_size`
+def migrate_in_place(collection, batch_size):
+    legacy = {"$or": [{"timestamp": {"$type": "string"}}, {"probability": {"$exists": True}}]}
+    ops, migrated, failed = [], 0, 0
+    for doc in collection.find(legacy, {"timestamp": 1, "probability": 1, "score": 1, "device_id": 1}).batch_size(batch_size):
+        try:
+            fields = convert(doc)
+        except ValueError as e:
+            failed += 1
+            logging.warning(f"Skipping {doc['_id']}: {e}")
+            continue
+        update = {"$unset": {"probability": ""}}
+        if fields:
+            update["$set"] = fields
+        ops.append(UpdateOne({"_id": doc['_id']}, update))
+        if len(ops) >= batch_size:
+            migrated += collection.bulk_write(ops, ordered=False).modified_count
+            ops = []
+            logging.info(f"Migrated {migrated} entries...")
+    if ops:
+        migrated += collection.bulk_write(ops, ordered=False).modified_count
+    return migrated, failed
+
+
+# Copies the (already migrated) history into a time-series collection.
+# Manual check against a real server (MongoDB 5.0+):
+#   python migrate_history.py --timeseries history_ts
+#   mongosh fall_detection --eval 'db.history_ts.getIndexes()'
+# lists device_id_1_timestamp_1, timestamp_-1, status_1_timestamp_-1,
+# location_1_timestamp_-1 and image_path_1, and no *_timestamp_id index.
+def copy_to_timeseries(db, source, target_name, batch_size):
+    try:
+        db.create_collection(target_name, timeseries={
+            "timeField": "timestamp",
+            "metaField": "device_id",
+            "granularity": "seconds"
+        })
+        logging.info(f"Created time-series collection {target_name}")
+    except CollectionInvalid:
+        logging.info(f"Collection {target_name} already exists, appending")
+    target = db[target_name]
+    batch, copied = [], 0
+    for doc in source.find({"timestamp": {"$type": "date"}}).batch_size(batch_size):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            target.insert_many(batch, ordered=False)
+            copied += len(batch)
+            batch = []
+    if batch:
+        target.insert_many(batch, ordered=False)
+        copied += len(batch)
+    history.ensure_timeseries_indexes(target)
+    return copied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert history entries to typed timestamp/score/device_id fields.")
+    parser.add_argument('--mongo-uri', default='mongodb://localhost:27017')
+    parser.add_argument('--db', default='fall_detection')
+    parser.add_argument('--collection', default='history')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--timeseries', metavar='NAME',
+                        help="also copy entries into a new time-series collection NAME")
+    args = parser.parse_args()
+
+    client = MongoClient(args.mongo_uri, serverSelectionTimeoutMS=5000)
+    db = client[args.db]
+    collection = db[args.collection]
+    migrated, failed = migrate_in_place(collection, args.batch_size)
+    logging.info(f"Migration done: {migrated} migrated, {failed} skipped")
+    history.ensure_indexes(collection)
+    if args.timeseries:
+        copied = copy_to_timeseries(db, collection, args.timeseries, args.batch_size)
+        logging.info(f"Copied {copied} entries to {args.timeseries}; set HISTORY_COLLECTION={args.timeseries} "
+                     "and HISTORY_TIMESERIES=1 to use it")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+import logging
+import os
+
+import backends
+from inference import InferenceEngine, InferenceBusy
+
+try:
+    from eventlet.patcher import original
+    threading = original('threading')
+except ImportError:
+    import threading
+
+MODEL_EXTENSIONS = ('.tflite', '.onnx')
+# Pixels in one raw camera frame (96x96 grayscale)
+FRAME_SIZE = 96 * 96
+
+
+class UnknownModel(Exception):
+    pass
+
+
+# Score agreement between the active model and the shadow model
+class ShadowStats:
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counters = {"compared": 0, "disagreements": 0, "errors": 0, "skipped": 0}
+            self._abs_diff_sum = 0.0
+            self._abs_diff_max = 0.0
+
+    def record(self, primary, shadow, error):
+        with self._lock:
+            if error is not None:
+                self._counters["errors"] += 1
+                return
+            diff = abs(primary - shadow)
+            self._counters["compared"] += 1
+            self._abs_diff_sum += diff
+            self._abs_diff_max = max(self._abs_diff_max, diff)
+            if (primary > self.threshold) != (shadow > self.threshold):
+                self._counters["disagreements"] += 1
+
+    def skip(self):
+        with self._lock:
+            self._counters["skipped"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self._counters)
+            compared = stats["compared"]
+            stats["mean_abs_diff"] = round(self._abs_diff_sum / compared, 6) if compared else None
+            stats["max_abs_diff"] = round(self._abs_diff_max, 6)
+        return stats
+
+
+# Versioned models on disk (every .tflite / .onnx file in `model_dir`, named
+# by file stem, plus the default model). One version is active and serves
+# all predictions; an optional shadow version scores a sample of the same
+# frames after the active model has answered, for offline A/B comparison.
+# Swapping versions loads the new engine first, then points new requests at
+# it and closes the old engine, which still finishes everything it queued.
+# `engine_cls` is InferenceEngine or worker_pool.ProcessInferenceEngine.
+class ModelRegistry:
+    def __init__(self, model_dir, default_path, backend='auto', shadow_every=1, threshold=0.5,
+                 engine_cls=InferenceEngine, frame_size=FRAME_SIZE, **engine_options):
+        self.model_dir = model_dir
+        self.default_path = default_path
+        self.backend = backend
+        self.shadow_every = max(1, shadow_every)
+        self.engine_cls = engine_cls
+        self.frame_size = frame_size
+        self.engine_options = engine_options
+        self.shadow_stats = ShadowStats(threshold)
+        self._engine = None
+        self._shadow = None
+        self._active = None
+        self._shadow_version = None
+        self._shadow_counter = 0
+        self._lock = threading.Lock()
+        # Serialises loads so two swaps cannot interleave
+        self._swap_lock = threading.Lock()
+
+    def versions(self):
+        found = {}
+        if self.default_path:
+            found[self._version_of(self.default_path)] = self.default_path
+        if self.model_dir and os.path.isdir(self.model_dir):
+            for name in sorted(os.listdir(self.model_dir)):
+                if name.endswith(MODEL_EXTENSIONS):
+                    path = os.path.join(self.model_dir, name)
+                    found[self._version_of(path)] = path
+        return found
+
+    @staticmethod
+    def _version_of(path):
+        return os.path.splitext(os.path.basename(path))[0]
+
+    def _load(self, version, backend=None, num_threads=None):
+        path = self.versions().get(version)
+        if path is None:
+            raise UnknownModel(f"Unknown model version: {version}")
+        options = dict(self.engine_options)
+        if num_threads is not None:
+            options['num_threads'] = num_threads
+        backend_name, interpreter_cls = backends.load_backend(backend or self.backend, path)
+        engine = self.engine_cls(path, interpreter_cls, **options)
+        # A model for another frame size would fail on every frame once active
+        if self.frame_size and engine.frame_size != self.frame_size:
+            engine.close()
+            raise ValueError(f"Model {version} takes {engine.frame_size} pixels per frame "
+                             f"({'x'.join(str(int(d)) for d in engine.frame_shape)}), expected {self.frame_size}")
+        engine.version = version
+        engine.backend = backend_name
+        return engine
+
+    # Loads `version` (re-reading the file if it is already active) and makes
+    # it the active model. On failure the current model keeps serving.
+    def activate(self, version, backend=None, num_threads=None):
+        with self._swap_lock:
+            engine = self._load(version, backend, num_threads)
+            with self._lock:
+                old, self._engine = self._engine, engine
+                self._active = version
+            if old is not None:
+                old.close()
+        logging.info(f"Activated model {version} ({engine.backend})")
+        return engine
+
+    def set_shadow(self, version, backend=None, num_threads=None):
+        with self._swap_lock:
+            engine = self._load(version, backend, num_threads) if version else None
+            with self._lock:
+                old, self._shadow = self._shadow, engine
+                self._shadow_version = version or None
+            self.shadow_stats.reset()
+            if old is not None:
+                old.close()
+        logging.info(f"Shadow model set to {version or 'none'}")
+
+    @property
+    def ready(self):
+        return self._engine is not None
+
+    # The engine serving predictions right now
+    @property
+    def engine(self):
+        return self._engine
+
+    # The engine may be swapped between reading it and queueing the frame;
+    # a closed engine rejects the frame and it is sent to the new one instead.
+    def _submit(self, frame):
+        while True:
+            engine = self._engine
+            if engine is None:
+                raise InferenceBusy("No model loaded")
+            try:
+                return engine.submit(frame)
+            except InferenceBusy:
+                if engine is self._engine:
+                    raise
+
+    def predict(self, frame, timeout=None):
+        score = self._submit(frame).result(timeout=timeout)
+        self._shadow_score(frame, score)
+        return score
+
+    def predict_many(self, frames, timeout=None):
+        pending = []
+        for frame in frames:
+            try:
+                pending.append(self._submit(frame))
+            except InferenceBusy as e:
+                pending.append(e)
+        results = InferenceEngine.collect(pending, timeout)
+        for frame, score in zip(frames, results):
+            if not isinstance(score, Exception):
+                self._shadow_score(frame, score)
+        return results
+
+    def _shadow_score(self, frame, score):
+        shadow = self._shadow
+        if shadow is None:
+            return
+        with self._lock:
+            self._shadow_counter += 1
+            if self._shadow_counter % self.shadow_every:
+                return
+        try:
+            pending = shadow.submit(frame)
+        except InferenceBusy:
+            self.shadow_stats.skip()
+            return
+        pending.add_done_callback(lambda value, error: self.shadow_stats.record(score, value, error))
+
+    def queue_depth(self):
+        engine = self._engine
+        return engine.queue_depth() if engine is not None else 0
+
+    def stats(self):
+        engine, shadow = self._engine, self._shadow
+        stats = {
+            "active": self._active,
+            "backend": engine.backend if engine else None,
+            "max_batch_size": engine.max_batch_size if engine else None,
+            "versions": sorted(self.versions()),
+            "shadow": None,
+        }
+        if engine is not None and hasattr(engine, 'worker_stats'):
+            stats["workers"] = engine.worker_stats()
+            stats["worker_restarts"] = engine.restarts
+        if shadow is not None:
+            stats["shadow"] = dict(self.shadow_stats.snapshot(), version=self._shadow_version,
+                                   backend=shadow.backend, every=self.shadow_every)
+        return stats
+
+    def close(self):
+        with self._lock:
+            engines = [self._engine, self._shadow]
+            self._engine = self._shadow = None
+        for engine in engines:
+            if engine is not None:
+                engine.close()
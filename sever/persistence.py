@@ -0,0 +1,144 @@
+import logging
+import queue
+import threading
+import time
+
+from pymongo.errors import BulkWriteError
+
+import metrics
+
+# Write-behind pipeline: image writes (to an ImageStore) and history inserts run on worker
+# threads in batches so /fall_detect can respond as soon as the score is known.
+# If `ready` (an Event) is given, jobs stay queued until it is set.
+class WriteBehindPipeline:
+    def __init__(self, collection, store, on_saved=None, workers=2, max_queue=1024,
+                 batch_size=32, flush_interval=0.2, ready=None):
+        self.collection = collection
+        self.store = store
+        self.on_saved = on_saved
+        self.ready = ready
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._counters = {"enqueued": 0, "written": 0, "dropped": 0, "failed": 0, "batches": 0}
+        self._stop = threading.Event()
+        self._threads = []
+        for i in range(max(1, workers)):
+            t = threading.Thread(target=self._worker, name=f"writer-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self._counters[key] += n
+
+    # Returns False when the queue is full and the job was dropped
+    def submit(self, frame, key, entry):
+        try:
+            self._queue.put_nowait((frame, key, entry))
+        except queue.Full:
+            self._count("dropped")
+            return False
+        self._count("enqueued")
+        return True
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats["queue_depth"] = self._queue.qsize()
+        stats["queue_capacity"] = self._queue.maxsize
+        stats["backpressure"] = self._queue.full()
+        return stats
+
+    # Writes what is queued within `timeout` seconds. If the pipeline never
+    # became ready (e.g. MongoDB was never reached) the backlog is dropped
+    # instead, so shutdown cannot hang on a queue nobody consumes.
+    def close(self, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        self._stop.set()
+        if self.ready is not None and not self.ready.is_set():
+            dropped = 0
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                dropped += 1
+            if dropped:
+                self._count("dropped", dropped)
+                logging.warning(f"Writer never became ready, dropped {dropped} queued job(s)")
+        for _ in self._threads:
+            try:
+                self._queue.put(None, timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                logging.warning(f"Writer did not drain within {timeout}s, {self._queue.qsize()} job(s) left")
+                break
+        for t in self._threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+
+    def _collect_batch(self):
+        job = self._queue.get()
+        if job is None:
+            return None
+        batch = [job]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                job = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if job is None:
+                self._queue.put(None)
+                break
+            batch.append(job)
+        return batch
+
+    def _worker(self):
+        if self.ready is not None:
+            while not self.ready.wait(0.1):
+                if self._stop.is_set():
+                    return
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                return
+            self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        entries = []
+        for frame, key, entry in batch:
+            try:
+                if frame is not None:
+                    self.store.put(key, frame)
+                entries.append(entry)
+            except Exception as e:
+                self._count("failed")
+                logging.error(f"Failed to save image {key}: {e}")
+        if not entries:
+            return
+        try:
+            with metrics.DB_INSERT.time():
+                self.collection.insert_many(entries, ordered=False)
+        except BulkWriteError as e:
+            # Unordered: every entry without a write error was inserted
+            failed = {error['index'] for error in e.details.get('writeErrors', [])}
+            self._count("failed", len(failed))
+            logging.error(f"Failed to insert {len(failed)} of {len(entries)} history entries: "
+                          f"{e.details.get('writeErrors', [{}])[0].get('errmsg')}")
+            entries = [entry for i, entry in enumerate(entries) if i not in failed]
+        except Exception as e:
+            self._count("failed", len(entries))
+            logging.error(f"Failed to insert {len(entries)} history entries: {e}")
+            return
+        self._count("written", len(entries))
+        self._count("batches")
+        if self.on_saved:
+            for entry in entries:
+                try:
+                    self.on_saved(entry)
+                except Exception as e:
+                    logging.error(f"Saved-entry callback failed: {e}")
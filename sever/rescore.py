@@ -0,0 +1,368 @@
+# Offline re-scoring of stored frames with a (new) model. Frames come from
+# an image folder, a CSV like image_labels.csv or the history collection,
+# are scored in chunks across a process pool through the server's own
+# InferenceEngine (same quantization and batching as /fall_detect), and
+# go to CSV, Parquet or back into the history entries. A checkpoint after
+# every written chunk lets an interrupted run carry on where it stopped.
+#
+#   python rescore.py --model models/v2.tflite dir ../img_train --out v2.csv
+#   python rescore.py --model models/v2.tflite csv ../creat\ model/image_labels.csv --images ../img_train --out v2.csv
+#   python rescore.py --model models/v2.tflite history --update
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+from bson import ObjectId
+from PIL import Image
+from pymongo import MongoClient, UpdateOne
+
+from backends import load_backend
+from fall_state import FALL_STATUS, NORMAL_STATUS
+from image_store import KEY_RE, ImageStore
+from inference import InferenceEngine
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+FALL_THRESHOLD = 0.7
+
+
+# Item sources yield dicts with an "id", either a "path" or the image
+# "data", and any extra columns for the output. `resume` is the checkpoint
+# position; an item's "position" is what the checkpoint stores after it.
+class DirectorySource:
+    def __init__(self, root):
+        self.root = root
+
+    def items(self, resume=None):
+        skip = resume or 0
+        n = 0
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if not name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                n += 1
+                if n <= skip:
+                    continue
+                path = os.path.join(dirpath, name)
+                yield {"id": os.path.relpath(path, self.root), "path": path, "position": n}
+
+
+class CsvSource:
+    def __init__(self, csv_path, image_dir):
+        self.csv_path = csv_path
+        self.image_dir = image_dir
+
+    def items(self, resume=None):
+        skip = resume or 0
+        with open(self.csv_path, newline='', encoding='utf-8') as f:
+            for n, row in enumerate(csv.DictReader(f), 1):
+                if n <= skip:
+                    continue
+                yield {"id": row['filename'], "path": os.path.join(self.image_dir, row['filename']),
+                       "label": row.get('label'), "position": n}
+
+
+# History entries in _id order; images come from the content-addressed
+# store (/images/<key>.jpg) or, for older entries, the upload folder
+class HistorySource:
+    def __init__(self, collection, store, query=None, batch_size=1000):
+        self.collection = collection
+        self.store = store
+        self.query = query or {}
+        self.batch_size = batch_size
+
+    def items(self, resume=None):
+        query = dict(self.query)
+        if resume:
+            query["_id"] = {"$gt": ObjectId(resume)}
+        cursor = self.collection.find(query, {"image_path": 1, "score": 1, "status": 1}) \
+            .sort("_id", 1).batch_size(self.batch_size)
+        for doc in cursor:
+            item = {"id": str(doc['_id']), "image_path": doc.get('image_path'),
+                    "old_score": doc.get('score'), "old_status": doc.get('status'), "position": str(doc['_id'])}
+            url = doc.get('image_path') or ''
+            key = url.rsplit('/', 1)[-1][:-4] if url.endswith('.jpg') else ''
+            if url.startswith(self.store.url_prefix + '/') and KEY_RE.fullmatch(key):
+                item["data"] = self.store.get(key)
+            else:
+                item["path"] = url.lstrip('/')
+            yield item
+
+
+_engine = None
+
+
+def _init_worker(model_path, backend, batch_size, chunk_size):
+    global _engine
+    _, interpreter_cls = load_backend(backend, model_path)
+    _engine = InferenceEngine(model_path, interpreter_cls, pool_size=1, max_batch_size=batch_size,
+                              max_wait_ms=1, max_queue=chunk_size)
+
+
+# Decodes an image to the engine's raw uint8 frame, the same bytes an
+# ESP32 would have sent for it
+def _load_frame(item, height, width):
+    source = item.get("path")
+    if item.get("data") is not None:
+        source = io.BytesIO(item["data"])
+    if source is None:
+        raise FileNotFoundError("image missing from the store")
+    with Image.open(source) as img:
+        img = img.convert('L')
+        if img.size != (width, height):
+            img = img.resize((width, height), Image.BILINEAR)
+        return np.asarray(img, dtype=np.uint8)
+
+
+# Runs in a worker: (scores, errors) for one chunk, None where not applicable
+def _score_chunk(items):
+    height, width = _engine.frame_shape[:2]
+    frames, slots, errors = [], [], [None] * len(items)
+    for i, item in enumerate(items):
+        try:
+            frames.append(_load_frame(item, height, width))
+            slots.append(i)
+        except Exception as e:
+            errors[i] = str(e)
+    scores = [None] * len(items)
+    for i, result in zip(slots, _engine.predict_many(frames)):
+        if isinstance(result, Exception):
+            errors[i] = str(result)
+        else:
+            scores[i] = result
+    return scores, errors
+
+
+class CsvSink:
+    def __init__(self, path, columns, offset=None):
+        self.path = path
+        self.columns = columns
+        exists = offset is not None and os.path.exists(path)
+        self._file = open(path, 'r+' if exists else 'w', newline='', encoding='utf-8')
+        if exists:
+            # Drop rows written after the last checkpoint
+            self._file.seek(offset)
+            self._file.truncate()
+        self._writer = csv.DictWriter(self._file, columns, extrasaction='ignore')
+        if not exists:
+            self._writer.writeheader()
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+        self._file.flush()
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+
+
+# One part file per chunk in a directory, readable as one Parquet dataset
+class ParquetSink:
+    def __init__(self, path, columns, offset=None):
+        import pyarrow  # noqa: F401 (fail before any scoring if missing)
+        self.path = path
+        self.columns = columns
+        self._part = offset or 0
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, rows):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.table({c: [row.get(c) for row in rows] for c in self.columns})
+        self._part += 1
+        pq.write_table(table, os.path.join(self.path, f"part-{self._part:06d}.parquet"))
+        return self._part
+
+    def close(self):
+        pass
+
+
+# Writes the new score under `field` of each history entry; the live
+# score and status are left alone
+class MongoSink:
+    def __init__(self, collection, field):
+        self.collection = collection
+        self.field = field
+
+    def write(self, rows):
+        now = datetime.now()
+        ops = [UpdateOne({"_id": ObjectId(row['id'])},
+                         {"$set": {self.field: {"score": row['score'], "status": row['status'], "at": now}}})
+               for row in rows if row['score'] is not None]
+        if ops:
+            self.collection.bulk_write(ops, ordered=False)
+        return None
+
+    def close(self):
+        pass
+
+
+def load_checkpoint(path, signature):
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("signature") != signature:
+        raise ValueError(f"Checkpoint {path} belongs to a different run; remove it or pass another --checkpoint")
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, path)
+
+
+# Scores every item of `source`, `chunk_size` items per task, keeping at
+# most two tasks per worker in flight. Chunks are written and checkpointed
+# in source order, so a checkpoint never covers an unwritten item.
+def rescore(source, sink, model_path, backend='auto', workers=None, chunk_size=512, batch_size=32,
+            threshold=FALL_THRESHOLD, version=None, checkpoint_path=None, checkpoint=None):
+    workers = workers or os.cpu_count() or 1
+    version = version or os.path.splitext(os.path.basename(model_path))[0]
+    checkpoint = checkpoint or {}
+    totals = dict(checkpoint.get("totals") or {"scored": 0, "failed": 0, "falls": 0, "changed": 0})
+    started = time.monotonic()
+    done_before = totals["scored"] + totals["failed"]
+
+    def chunks():
+        chunk = []
+        for item in source.items(checkpoint.get("position")):
+            chunk.append(item)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def finish(chunk, scores, errors):
+        rows = []
+        for item, score, error in zip(chunk, scores, errors):
+            status = None if score is None else (FALL_STATUS if score > threshold else NORMAL_STATUS)
+            row = {k: v for k, v in item.items() if k not in ("data", "position")}
+            row.update(score=score, status=status, error=error, model=version)
+            rows.append(row)
+            if score is None:
+                totals["failed"] += 1
+                continue
+            totals["scored"] += 1
+            totals["falls"] += status == FALL_STATUS
+            if item.get("old_score") is not None and (item["old_score"] > threshold) != (score > threshold):
+                totals["changed"] += 1
+        checkpoint["sink"] = sink.write(rows)
+        checkpoint["position"] = chunk[-1]["position"]
+        checkpoint["totals"] = totals
+        if checkpoint_path:
+            save_checkpoint(checkpoint_path, checkpoint)
+        done = totals["scored"] + totals["failed"]
+        rate = (done - done_before) / max(time.monotonic() - started, 1e-9)
+        logging.info(f"{done} frame(s) done ({totals['failed']} failed), {rate:.0f} frames/s")
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(model_path, backend, batch_size, chunk_size)) as pool:
+        pending = deque()
+        for chunk in chunks():
+            pending.append((chunk, pool.submit(_score_chunk, chunk)))
+            if len(pending) >= 2 * workers:
+                chunk, future = pending.popleft()
+                finish(chunk, *future.result())
+        while pending:
+            chunk, future = pending.popleft()
+            finish(chunk, *future.result())
+    sink.close()
+    totals["seconds"] = round(time.monotonic() - started, 3)
+    return totals
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Re-score stored frames with a fall detection model.")
+    parser.add_argument('--model', required=True, help="Model file (*.tflite, *.onnx)")
+    parser.add_argument('--backend', default='auto')
+    parser.add_argument('--version', help="Model version name recorded with the scores (default: file name)")
+    parser.add_argument('--workers', type=int, default=None, help="Scoring processes (default: CPU count)")
+    parser.add_argument('--chunk-size', type=int, default=512, help="Frames per task and per checkpoint")
+    parser.add_argument('--batch-size', type=int, default=32, help="Frames per interpreter invoke")
+    parser.add_argument('--threshold', type=float, default=FALL_THRESHOLD)
+    # Output options follow the source: `dir ../img_train --out v2.csv`
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument('--out', help="Output .csv file, or a directory of .parquet parts")
+    output.add_argument('--format', choices=('csv', 'parquet'), help="Output format (default: from --out)")
+    output.add_argument('--checkpoint', help="Checkpoint file (default: <out>.checkpoint.json)")
+    sub = parser.add_subparsers(dest='source', required=True)
+
+    directory = sub.add_parser('dir', parents=[output], help="Every image under a folder")
+    directory.add_argument('root')
+    labels = sub.add_parser('csv', parents=[output], help="Images listed in a filename,label CSV")
+    labels.add_argument('csv_path')
+    labels.add_argument('--images', required=True, help="Folder the filenames are relative to")
+    hist = sub.add_parser('history', parents=[output], help="Images of the history collection")
+    hist.add_argument('--mongo-uri', default=os.environ.get('MONGO_URI', 'mongodb://localhost:27017'))
+    hist.add_argument('--db', default='fall_detection')
+    hist.add_argument('--collection', default=os.environ.get('HISTORY_COLLECTION', 'history'))
+    hist.add_argument('--image-root', default=os.environ.get('IMAGE_STORE_ROOT', os.path.join('static', 'uploads', 'images')))
+    hist.add_argument('--packed', action='store_true', default=os.environ.get('IMAGE_STORE_PACKED', '0') == '1')
+    hist.add_argument('--status', help="Only entries with this status")
+    hist.add_argument('--update', action='store_true',
+                      help="Write the scores into the entries (under rescores.<version>) instead of a file")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    version = args.version or os.path.splitext(os.path.basename(args.model))[0]
+    columns = ["id", "path", "label", "image_path", "old_score", "old_status", "score", "status", "error", "model"]
+    store = None
+    if args.source == 'dir':
+        source = DirectorySource(args.root)
+        target = os.path.abspath(args.root)
+    elif args.source == 'csv':
+        source = CsvSource(args.csv_path, args.images)
+        target = os.path.abspath(args.csv_path)
+    else:
+        collection = MongoClient(args.mongo_uri, serverSelectionTimeoutMS=5000)[args.db][args.collection]
+        store = ImageStore(args.image_root, packed=args.packed, read_only=True)
+        source = HistorySource(collection, store, {"status": args.status} if args.status else None)
+        target = f"{args.db}.{args.collection}:{args.status or '*'}"
+
+    update = args.source == 'history' and args.update
+    if not update and not args.out:
+        parser.error("--out is required unless writing back to history with --update")
+    checkpoint_path = args.checkpoint or f"{args.out or args.collection + '-' + version}.checkpoint.json"
+    signature = {"source": args.source, "target": target, "model": os.path.abspath(args.model),
+                 "version": version, "out": "mongo" if update else os.path.abspath(args.out)}
+    checkpoint = load_checkpoint(checkpoint_path, signature)
+    if checkpoint:
+        logging.info(f"Resuming from {checkpoint_path} after {checkpoint['totals']['scored']} scored frame(s)")
+    else:
+        checkpoint = {"signature": signature}
+
+    if update:
+        sink = MongoSink(collection, f"rescores.{version}")
+    elif (args.format or ('csv' if args.out.endswith('.csv') else 'parquet')) == 'csv':
+        sink = CsvSink(args.out, columns, checkpoint.get("sink"))
+    else:
+        sink = ParquetSink(args.out, columns, checkpoint.get("sink"))
+
+    totals = rescore(source, sink, args.model, args.backend, args.workers, args.chunk_size, args.batch_size,
+                     args.threshold, version, checkpoint_path, checkpoint)
+    if store is not None:
+        store.close()
+    logging.info(f"Re-scoring done: {totals}")
+    return totals
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING
+
+import metrics
+
+RECLAIMED = metrics.registry.register(metrics.Counter(
+    "retention_reclaimed_total", "History entries and images removed by the retention job", ("kind",)))
+
+
+def _ttl_index_name(status):
+    return f"ttl_{status.encode('utf-8').hex()}"
+
+
+# Per-status TTL indexes on the native `timestamp` date; Mongo's own TTL
+# monitor does the deletes. Statuses without a TTL (None) are kept forever.
+def ensure_ttl_indexes(collection, ttl_days):
+    existing = collection.index_information()
+    wanted = {_ttl_index_name(status): (status, days) for status, days in ttl_days.items() if days}
+    for name, info in existing.items():
+        if name.startswith("ttl_") and name not in wanted:
+            collection.drop_index(name)
+    for name, (status, days) in wanted.items():
+        seconds = int(days * 86400)
+        if name in existing and existing[name].get('expireAfterSeconds') != seconds:
+            collection.drop_index(name)
+        collection.create_index([("timestamp", ASCENDING)], name=name, expireAfterSeconds=seconds,
+                                partialFilterExpression={"status": status})
+    return {status: days for status, days in wanted.values()}
+
+
+# Rolls normal entries older than `after` up into one document per device,
+# location and hour in `aggregates`, then deletes them. Works one hour at a
+# time, oldest first, at most `max_hours` hours per call. Pre-event context
+# frames are left alone.
+def downsample(collection, aggregates, status, after, max_hours=24):
+    cutoff = datetime.now() - after
+    base = {"status": status, "pre_event": {"$ne": True}}
+    report = {"entries": 0, "hours": 0}
+    for _ in range(max_hours):
+        oldest = collection.find_one(dict(base, timestamp={"$lt": cutoff}),
+                                     sort=[("timestamp", ASCENDING)], projection={"timestamp": 1})
+        if oldest is None:
+            break
+        hour = oldest['timestamp'].replace(minute=0, second=0, microsecond=0)
+        end = min(hour + timedelta(hours=1), cutoff)
+        match = dict(base, timestamp={"$gte": hour, "$lt": end})
+        groups = list(collection.aggregate([
+            {"$match": match},
+            {"$group": {
+                "_id": {"device_id": "$device_id", "location": "$location"},
+                "count": {"$sum": 1},
+                "score_sum": {"$sum": "$score"},
+                "score_max": {"$max": "$score"},
+                "max_id": {"$max": "$_id"},
+            }},
+        ]))
+        # One group per device and location, so a handful of upserts per hour
+        for g in groups:
+            aggregates.update_one(
+                {"device_id": g['_id'].get('device_id'), "location": g['_id'].get('location'),
+                 "hour": hour, "status": status},
+                {"$inc": {"count": g['count'], "score_sum": g['score_sum']},
+                 "$max": {"score_max": g['score_max']}},
+                upsert=True
+            )
+            # Entries written after the aggregation ran are left for the next pass
+            result = collection.delete_many(dict(match, device_id=g['_id'].get('device_id'),
+                                                 location=g['_id'].get('location'),
+                                                 _id={"$lte": g['max_id']}))
+            report["entries"] += result.deleted_count
+        report["hours"] += 1
+    return report
+
+
+# URL prefix the old uploads in `upload_dir` were referenced by: they were
+# saved as Flask static files and history stored their static URL
+# (/static/uploads/<name>), however the folder is spelled in the config.
+# None when the folder is outside the static folder, as nothing there was
+# ever referenced.
+def legacy_url_prefix(upload_dir, static_dir, static_url_path="/static"):
+    upload_dir, static_dir = os.path.abspath(upload_dir), os.path.abspath(static_dir)
+    if os.path.commonpath([upload_dir, static_dir]) != static_dir:
+        return None
+    rel = os.path.relpath(upload_dir, static_dir)
+    return static_url_path if rel == os.curdir else f"{static_url_path}/{rel.replace(os.sep, '/')}"
+
+
+# Deletes images that no history entry points at. An image must be
+# unreferenced in two consecutive sweeps and not written (or deduplicated
+# against) in between, so one whose entry is still in the write-behind
+# queue is never removed. References are checked with one indexed `$in`
+# query per `batch_size` images.
+class OrphanSweeper:
+    def __init__(self, collection, store, legacy_dir=None, legacy_url=None, batch_size=500):
+        self.collection = collection
+        self.store = store
+        self.legacy_dir = legacy_dir
+        self.legacy_url = legacy_url
+        self.batch_size = batch_size
+        self._candidates = set()
+
+    def _images(self):
+        for key in self.store.keys():
+            yield self.store.url_for(key), (lambda key=key: self.store.delete(key, unless_touched=True))
+        # Pre content-addressing uploads, referenced as <legacy_url>/<name>
+        if self.legacy_dir and self.legacy_url and os.path.isdir(self.legacy_dir):
+            for name in os.listdir(self.legacy_dir):
+                path = os.path.join(self.legacy_dir, name)
+                if name.endswith('.jpg') and os.path.isfile(path):
+                    yield f"{self.legacy_url}/{name}", (lambda path=path: self._remove_file(path))
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            return size
+        except FileNotFoundError:
+            return 0
+
+    def sweep(self, pause=0.0):
+        report = {"checked": 0, "deleted": 0, "bytes": 0}
+        self._candidates -= {self.store.url_for(key) for key in self.store.take_touched()}
+        candidates = set()
+        batch = []
+        for image in self._images():
+            batch.append(image)
+            if len(batch) >= self.batch_size:
+                self._check(batch, candidates, report)
+                batch = []
+                time.sleep(pause)
+        if batch:
+            self._check(batch, candidates, report)
+        self._candidates = candidates
+        return report
+
+    def _check(self, batch, candidates, report):
+        urls = [url for url, _ in batch]
+        referenced = set(self.collection.distinct("image_path", {"image_path": {"$in": urls}}))
+        report["checked"] += len(batch)
+        for url, delete in batch:
+            if url in referenced:
+                continue
+            if url in self._candidates:
+                freed = delete()
+                if freed:
+                    report["deleted"] += 1
+                    report["bytes"] += freed
+            else:
+                candidates.add(url)
+
+
+# Periodic retention pass on its own thread: TTL indexes, hourly
+# downsampling of old normals, orphaned image sweep and packed segment
+# compaction. Every step works in small batches against Mongo and the
+# image store, never against the ingest path's queues or locks.
+# Downsampling removes normal entries before a longer normal TTL would, so
+# with both on the TTL only reaches the pre-event frames downsampling skips.
+class RetentionJob:
+    def __init__(self, collection, aggregates, store, ttl_days, normal_status, downsample_after_hours=24,
+                 interval=3600, legacy_dir=None, legacy_url=None, max_hours_per_run=24, sweep_batch=500,
+                 ready=None):
+        self.collection = collection
+        self.aggregates = aggregates
+        self.store = store
+        self.ttl_days = ttl_days
+        self.normal_status = normal_status
+        self.downsample_after = timedelta(hours=downsample_after_hours) if downsample_after_hours else None
+        self.interval = interval
+        self.max_hours_per_run = max_hours_per_run
+        self.ready = ready
+        self.sweeper = OrphanSweeper(collection, store, legacy_dir, legacy_url, sweep_batch)
+        self._run_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._last_report = None
+        self._totals = {"downsampled": 0, "images_deleted": 0, "image_bytes": 0, "segment_bytes": 0, "runs": 0}
+
+    def start(self):
+        threading.Thread(target=self._loop, name="retention", daemon=True).start()
+
+    def trigger(self):
+        self._wake.set()
+
+    def _loop(self):
+        if self.ready is not None:
+            self.ready.wait()
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                logging.error(f"Retention run failed: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def run_once(self):
+        with self._run_lock:
+            started = time.monotonic()
+            report = {"started_at": datetime.now().isoformat(timespec='seconds')}
+            try:
+                report["ttl_days"] = ensure_ttl_indexes(self.collection, self.ttl_days)
+            except Exception as e:
+                # e.g. time-series collections, which take a collection-wide expireAfterSeconds instead
+                logging.warning(f"TTL indexes not applied: {e}")
+                report["ttl_error"] = str(e)
+            if self.downsample_after is not None:
+                report["downsampled"] = downsample(self.collection, self.aggregates, self.normal_status,
+                                                   self.downsample_after, self.max_hours_per_run)
+            report["orphans"] = self.sweeper.sweep(pause=0.01)
+            removed, reclaimed = self.store.compact()
+            report["compacted"] = {"segments": removed, "bytes": reclaimed}
+            report["seconds"] = round(time.monotonic() - started, 3)
+
+            self._last_report = report
+            self._totals["runs"] += 1
+            self._totals["downsampled"] += report.get("downsampled", {}).get("entries", 0)
+            self._totals["images_deleted"] += report["orphans"]["deleted"]
+            self._totals["image_bytes"] += report["orphans"]["bytes"]
+            self._totals["segment_bytes"] += reclaimed
+            RECLAIMED.inc("history_entries", amount=report.get("downsampled", {}).get("entries", 0))
+            RECLAIMED.inc("images", amount=report["orphans"]["deleted"])
+            logging.info(f"Retention run: {report}")
+            return report
+
+    def stats(self):
+        return {"last_run": self._last_report, "totals": dict(self._totals)}
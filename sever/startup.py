@@ -0,0 +1,64 @@
+import logging
+import threading
+import time
+
+
+class _Task:
+    def __init__(self, name, fn, retry_interval):
+        self.name = name
+        self.fn = fn
+        self.retry_interval = retry_interval
+        self.ready = False
+        self.attempts = 0
+        self.error = None
+        self.seconds = None
+
+
+# Slow initialisation (model load, database connection) runs on background
+# threads so the server can bind its port straight away. Tasks with a
+# retry interval are retried until they succeed; readiness is reported per task.
+class StartupTasks:
+    def __init__(self):
+        self._tasks = {}
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, name, fn, retry_interval=None):
+        self._tasks[name] = _Task(name, fn, retry_interval)
+
+    def start(self):
+        for task in self._tasks.values():
+            threading.Thread(target=self._run, args=(task,), name=f"startup-{task.name}", daemon=True).start()
+
+    def _run(self, task):
+        while True:
+            with self._lock:
+                task.attempts += 1
+            try:
+                task.fn()
+            except Exception as e:
+                with self._lock:
+                    task.error = str(e)
+                logging.error(f"Startup task {task.name} failed (attempt {task.attempts}): {e}")
+                if task.retry_interval is None:
+                    return
+                time.sleep(task.retry_interval)
+                continue
+            with self._lock:
+                task.ready = True
+                task.error = None
+                task.seconds = round(time.monotonic() - self._started, 3)
+            logging.info(f"Startup task {task.name} ready after {task.seconds}s")
+            return
+
+    def is_ready(self, name=None):
+        with self._lock:
+            if name is not None:
+                return self._tasks[name].ready
+            return all(task.ready for task in self._tasks.values())
+
+    def status(self):
+        with self._lock:
+            return {task.name: {"ready": task.ready, "attempts": task.attempts,
+                                "error": task.error, "seconds": task.seconds}
+                    for task in self._tasks.values()}
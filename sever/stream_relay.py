@@ -0,0 +1,225 @@
+import logging
+import threading
+import time
+
+import requests
+
+BOUNDARY = b"--frame"
+MAX_BUFFER = 512 * 1024
+
+# Splits an MJPEG multipart byte stream into JPEG frames at the boundary
+class MJPEGParser:
+    def __init__(self, boundary=BOUNDARY):
+        self.boundary = boundary
+        self._buffer = b""
+
+    def feed(self, chunk):
+        self._buffer += chunk
+        frames = []
+        while True:
+            start = self._buffer.find(self.boundary)
+            if start < 0:
+                break
+            header_end = self._buffer.find(b"\r\n\r\n", start)
+            if header_end < 0:
+                break
+            headers = self._buffer[start:header_end]
+            body_start = header_end + 4
+            length = self._content_length(headers)
+            if length is not None:
+                body_end = body_start + length
+                if len(self._buffer) < body_end:
+                    break
+            else:
+                body_end = self._buffer.find(self.boundary, body_start)
+                if body_end < 0:
+                    break
+            frame = self._buffer[body_start:body_end]
+            if frame.endswith(b"\r\n"):
+                frame = frame[:-2]
+            if frame:
+                frames.append(frame)
+            self._buffer = self._buffer[body_end:]
+        if len(self._buffer) > MAX_BUFFER:
+            # Garbage or a lost boundary; resync on the next one
+            self._buffer = b""
+        return frames
+
+    @staticmethod
+    def _content_length(headers):
+        for line in headers.split(b"\r\n"):
+            name, _, value = line.partition(b":")
+            if name.strip().lower() == b"content-length":
+                try:
+                    return int(value.strip())
+                except ValueError:
+                    return None
+        return None
+
+
+def encode_part(frame):
+    return (BOUNDARY + b"\r\nContent-Type: image/jpeg\r\nContent-Length: "
+            + str(len(frame)).encode() + b"\r\n\r\n" + frame + b"\r\n")
+
+
+# One upstream connection per camera; the latest frame is kept in a shared
+# slot and every viewer gets the newest frame when it is ready for one, so
+# slow viewers skip frames instead of queueing them. `on_idle(relay)` is
+# called once the upstream has stopped and no viewer is left.
+class StreamRelay:
+    def __init__(self, mac, url_for, is_online, idle_timeout=10, reconnect_delay=3, on_idle=None):
+        self.mac = mac
+        self.url_for = url_for
+        self.is_online = is_online
+        self.on_idle = on_idle
+        self.idle_timeout = idle_timeout
+        self.reconnect_delay = reconnect_delay
+        self.viewers = 0
+        self.frames = 0
+        self._frame = None
+        self._seq = 0
+        self._running = False
+        self._cond = threading.Condition()
+
+    @property
+    def running(self):
+        return self._running
+
+    def _ensure_running(self):
+        if not self._running:
+            self._running = True
+            threading.Thread(target=self._upstream, name=f"relay-{self.mac}", daemon=True).start()
+
+    def _should_stop(self, idle_since):
+        with self._cond:
+            if self.viewers > 0:
+                return False, None
+            idle_since = idle_since or time.monotonic()
+            return time.monotonic() - idle_since >= self.idle_timeout, idle_since
+
+    def _upstream(self):
+        idle_since = None
+        try:
+            while self.is_online(self.mac):
+                stop, idle_since = self._should_stop(idle_since)
+                if stop:
+                    break
+                url = self.url_for(self.mac)
+                try:
+                    with requests.get(url, stream=True, timeout=10) as response:
+                        logging.info(f"Relay connected to {url}")
+                        parser = MJPEGParser()
+                        for chunk in response.iter_content(chunk_size=4096):
+                            for frame in parser.feed(chunk):
+                                self._publish(frame)
+                            stop, idle_since = self._should_stop(idle_since)
+                            if stop:
+                                return
+                except requests.exceptions.RequestException as e:
+                    logging.warning(f"Relay upstream {url} failed: {e}")
+                time.sleep(self.reconnect_delay)
+        finally:
+            with self._cond:
+                self._running = False
+                self._cond.notify_all()
+                idle = self.viewers == 0
+            logging.info(f"Relay for {self.mac} stopped")
+            if idle and self.on_idle:
+                self.on_idle(self)
+
+    def _publish(self, frame):
+        with self._cond:
+            self._frame = frame
+            self._seq += 1
+            self.frames += 1
+            self._cond.notify_all()
+
+    # Counts the viewer straight away and returns its chunk iterator; the
+    # viewer is released when the iterator ends or is closed, even unstarted
+    def subscribe(self, wait_timeout=15):
+        with self._cond:
+            self.viewers += 1
+            self._ensure_running()
+        return _Viewer(self, self._stream(wait_timeout))
+
+    def _stream(self, wait_timeout):
+        seen = 0
+        while True:
+            with self._cond:
+                if not self._cond.wait_for(lambda: self._seq > seen or not self._running, wait_timeout):
+                    return
+                if self._seq <= seen:
+                    return
+                frame, seen = self._frame, self._seq
+            yield encode_part(frame)
+
+    def _release(self):
+        with self._cond:
+            self.viewers -= 1
+            idle = self.viewers == 0 and not self._running
+        if idle and self.on_idle:
+            self.on_idle(self)
+
+
+# Multipart chunks for one viewer of a relay
+class _Viewer:
+    def __init__(self, relay, chunks):
+        self._relay = relay
+        self._chunks = chunks
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._chunks)
+        except BaseException:
+            self.close()
+            raise
+
+    # Called by the WSGI server when the client goes away
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._chunks.close()
+        self._relay._release()
+
+
+# Relays keyed by device MAC, created on first viewer
+class RelayHub:
+    def __init__(self, url_for, is_online, max_viewers=50):
+        self.url_for = url_for
+        self.is_online = is_online
+        self.max_viewers = max_viewers
+        self._relays = {}
+        self._lock = threading.Lock()
+
+    def viewer_count(self):
+        with self._lock:
+            return sum(relay.viewers for relay in self._relays.values())
+
+    # Returns a viewer iterator, or None when the server is at capacity. The
+    # check and the viewer count happen under one lock, so concurrent
+    # requests cannot all slip in under the limit.
+    def subscribe(self, mac):
+        with self._lock:
+            if sum(relay.viewers for relay in self._relays.values()) >= self.max_viewers:
+                return None
+            relay = self._relays.get(mac)
+            if relay is None:
+                relay = self._relays[mac] = StreamRelay(mac, self.url_for, self.is_online, on_idle=self._prune)
+            return relay.subscribe()
+
+    # Drops a relay whose upstream stopped with nobody watching; a viewer
+    # that arrived in the meantime restarted it, so it is kept
+    def _prune(self, relay):
+        with self._lock:
+            if self._relays.get(relay.mac) is relay and relay.viewers == 0 and not relay.running:
+                del self._relays[relay.mac]
+
+    def stats(self):
+        with self._lock:
+            return {mac: {"viewers": r.viewers, "frames": r.frames, "running": r.running}
+                    for mac, r in self._relays.items()}
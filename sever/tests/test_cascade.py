@@ -0,0 +1,44 @@
+import numpy as np
+
+from cascade import MOTION, PERSON, Cascade, MotionGate
+
+
+def _frame(value):
+    return np.full((96, 96), value, dtype=np.uint8)
+
+
+def test_motion_gate():
+    gate = MotionGate(pixel_delta=12, min_changed=0.01)
+    still = gate.sample(_frame(100))
+    assert gate.changed(None, still)
+    assert not gate.changed(still, gate.sample(_frame(110)))
+    assert gate.changed(still, gate.sample(_frame(120)))
+
+
+def test_still_frames_reuse_the_last_score_until_max_skip():
+    cascade = Cascade(MotionGate(), max_skip=2)
+    assert cascade.check_motion("cam", [_frame(0)]) == [None]
+    cascade.record("cam", "passed", 0.3)
+    decisions = cascade.check_motion("cam", [_frame(0)] * 3)
+    assert decisions == [(MOTION, 0.3), (MOTION, 0.3), None]
+    for decision in decisions[:2]:
+        cascade.record("cam", decision[0])
+    # A confirmed fall bypasses the gate
+    assert cascade.check_motion("cam", [_frame(0)], force=True) == [None]
+
+
+def test_person_gate():
+    cascade = Cascade(person_models=object(), person_threshold=0.5, max_skip=5)
+    decisions = cascade.check_person("cam", [_frame(0)] * 3, lambda frames: [0.9, 0.1, RuntimeError("x")])
+    # Nobody seen: skipped with score 0; a failed check passes the frame on
+    assert decisions == [None, (PERSON, 0.0), None]
+    assert cascade.check_person("cam", [_frame(0)], lambda frames: [0.0], force=True) == [None]
+
+
+def test_stats():
+    cascade = Cascade(MotionGate())
+    cascade.record("cam", "passed", 0.1)
+    cascade.record("cam", MOTION)
+    stats = cascade.stats()
+    assert (stats["frames"], stats["passed"], stats["skip_rate"][MOTION], stats["gates"]) == (2, 1, 0.5, [MOTION])
+    assert not Cascade().enabled
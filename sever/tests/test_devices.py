@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+
+import mongomock
+
+from devices import DeviceRegistry
+
+
+class FailingCollection:
+    def update_one(self, *args, **kwargs):
+        raise RuntimeError("mongo down")
+
+
+def test_report_and_lookups():
+    collection = mongomock.MongoClient().db.devices
+    registry = DeviceRegistry(collection, ttl=60, default_ip="10.0.0.1")
+    assert registry.ip_for("aa") == "10.0.0.1"
+    assert not registry.is_online("aa")
+
+    assert registry.report("aa", "10.0.0.2")
+    assert registry.ip_for("aa") == "10.0.0.2"
+    assert registry.mac_for_ip("10.0.0.2") == "aa"
+    assert registry.is_online("aa")
+    assert collection.find_one({"mac": "aa"})["ip"] == "10.0.0.2"
+
+    # A new address replaces the old reverse mapping
+    registry.report("aa", "10.0.0.3")
+    assert registry.mac_for_ip("10.0.0.2") is None
+    assert registry.mac_for_ip("10.0.0.3") == "aa"
+
+
+def test_report_updates_cache_when_mongo_fails():
+    registry = DeviceRegistry(FailingCollection())
+    assert registry.report("aa", "10.0.0.2") is False
+    assert registry.is_online("aa")
+    assert registry.ip_for("aa") == "10.0.0.2"
+
+
+def test_load_keeps_newer_reports():
+    collection = mongomock.MongoClient().db.devices
+    old = datetime.now() - timedelta(minutes=5)
+    collection.insert_many([{"mac": "aa", "ip": "10.0.0.9", "last_seen": old},
+                            {"mac": "bb", "ip": "10.0.0.8", "last_seen": old}])
+    registry = DeviceRegistry(collection, ttl=60)
+    registry._store("aa", "10.0.0.2", datetime.now())
+    registry.load()
+    assert registry.ip_for("aa") == "10.0.0.2"
+    assert registry.ip_for("bb") == "10.0.0.8"
+    assert not registry.is_online("bb")
+    assert {d["mac"]: d["online"] for d in registry.all()} == {"aa": True, "bb": False}
@@ -0,0 +1,82 @@
+import http.server
+import threading
+import time
+
+import pytest
+
+from esp32_client import CircuitBreaker, ESP32Client
+
+
+def test_breaker_opens_after_threshold_and_half_opens():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.state == "half-open"
+    # One trial call only, until it reports back
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+# Answers POST /<status> with that status code and counts the hits
+@pytest.fixture
+def device():
+    hits = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_POST(self):
+            hits.append(self.path)
+            self.send_response(int(self.path.strip('/')))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}", hits
+    server.shutdown()
+    server.server_close()
+
+
+def test_success(device):
+    url, hits = device
+    client = ESP32Client()
+    assert client.post(url + "/200", {"mode": "ping"}).status_code == 200
+    assert len(hits) == 1
+
+
+def test_4xx_is_returned_without_retry(device):
+    url, hits = device
+    client = ESP32Client(deadline=2.0, failure_threshold=1)
+    response = client.post(url + "/400", {})
+    assert response.status_code == 400 and not response
+    assert len(hits) == 1
+    assert client.breakers.states()[url[7:]] == "closed"
+
+
+def test_5xx_is_retried_within_the_deadline_then_opens_the_breaker(device):
+    url, hits = device
+    client = ESP32Client(deadline=0.5, backoff=0.05, failure_threshold=1, reset_timeout=60)
+    started = time.monotonic()
+    assert client.post(url + "/503", {}) is None
+    assert time.monotonic() - started < 1.0
+    assert len(hits) > 1
+    assert client.breakers.states()[url[7:]] == "open"
+    # Fails fast while open
+    hits.clear()
+    assert client.post(url + "/200", {}) is None
+    assert hits == []
+
+
+def test_unreachable_device_respects_the_deadline():
+    client = ESP32Client(deadline=0.3, attempt_timeout=0.1, backoff=0.05)
+    started = time.monotonic()
+    assert client.post("http://127.0.0.1:1/set_mode", {}) is None
+    assert time.monotonic() - started < 1.0
@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+
+from fall_state import FALL_STATUS, NORMAL_STATUS, FallConfirmer
+
+T0 = datetime(2024, 5, 1, 10, 0, 0)
+
+
+def _feed(confirmer, scores, device="cam", start=T0, step=0.1):
+    return [confirmer.update(device, s, start + timedelta(seconds=i * step)) for i, s in enumerate(scores)]
+
+
+def test_single_spike_is_not_a_fall():
+    confirmer = FallConfirmer(window=5, votes=3, enter_threshold=0.7, exit_threshold=0.5)
+    results = _feed(confirmer, [0.1, 0.9, 0.1, 0.1, 0.9, 0.1])
+    assert all(r == (NORMAL_STATUS, False) for r in results)
+
+
+def test_k_of_n_confirms_and_alerts_once():
+    confirmer = FallConfirmer(window=5, votes=3, enter_threshold=0.7, exit_threshold=0.5)
+    results = _feed(confirmer, [0.8, 0.2, 0.9, 0.95, 0.9])
+    assert [status for status, _ in results] == [NORMAL_STATUS] * 3 + [FALL_STATUS] * 2
+    assert [alert for _, alert in results] == [False, False, False, True, False]
+    assert confirmer.is_falling("cam") and not confirmer.is_falling("other")
+
+
+# Between the thresholds the fall holds; it clears only when fewer than
+# `votes` of the window stay above exit_threshold
+def test_hysteresis():
+    confirmer = FallConfirmer(window=5, votes=3, enter_threshold=0.7, exit_threshold=0.5)
+    _feed(confirmer, [0.9, 0.9, 0.9])
+    statuses = [s for s, _ in _feed(confirmer, [0.6, 0.6, 0.6, 0.6, 0.6], start=T0 + timedelta(seconds=1))]
+    assert statuses == [FALL_STATUS] * 5
+    statuses = [s for s, _ in _feed(confirmer, [0.1, 0.1, 0.1], start=T0 + timedelta(seconds=2))]
+    assert statuses == [FALL_STATUS, FALL_STATUS, NORMAL_STATUS]
+
+
+def test_cooldown_suppresses_repeat_alerts():
+    confirmer = FallConfirmer(window=3, votes=2, enter_threshold=0.7, exit_threshold=0.5, cooldown=30)
+    fall, normal = [0.9, 0.9], [0.1, 0.1, 0.1]
+    assert _feed(confirmer, fall)[-1] == (FALL_STATUS, True)
+    _feed(confirmer, normal, start=T0 + timedelta(seconds=1))
+    assert _feed(confirmer, fall, start=T0 + timedelta(seconds=10))[-1] == (FALL_STATUS, False)
+    _feed(confirmer, normal, start=T0 + timedelta(seconds=11))
+    assert _feed(confirmer, fall, start=T0 + timedelta(seconds=40))[-1] == (FALL_STATUS, True)
+    stats = confirmer.stats()
+    assert (stats["alerts"], stats["suppressed"], stats["falling"]) == (2, 1, ["cam"])
+
+
+def test_devices_are_independent():
+    confirmer = FallConfirmer(window=3, votes=2)
+    _feed(confirmer, [0.9, 0.9], device="a")
+    assert _feed(confirmer, [0.9], device="b") == [(NORMAL_STATUS, False)]
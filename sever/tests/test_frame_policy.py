@@ -0,0 +1,38 @@
+from fall_state import FALL_STATUS, NORMAL_STATUS
+from frame_policy import FrameRetention, RetentionPolicy
+
+
+def _decide(retention, status, i, device="cam"):
+    return retention.decide(device, f"frame{i}", i / 10, status, i)
+
+
+def test_normals_skipped_and_buffered_then_stored_with_the_fall():
+    retention = FrameRetention(RetentionPolicy(ring_size=3))
+    for i in range(5):
+        assert _decide(retention, NORMAL_STATUS, i) == (False, [])
+    keep, pre_event = _decide(retention, FALL_STATUS, 5)
+    assert keep
+    # The last ring_size unsaved frames, oldest first
+    assert pre_event == [(2, "frame2", 0.2), (3, "frame3", 0.3), (4, "frame4", 0.4)]
+    # Still falling: kept, and the ring was emptied
+    assert _decide(retention, FALL_STATUS, 6) == (True, [])
+    assert retention.stats() == {"kept": 2, "skipped": 5, "pre_event": 3, "devices": 1}
+
+
+def test_transition_back_to_normal_is_kept():
+    retention = FrameRetention(RetentionPolicy(keep_transitions=True))
+    _decide(retention, FALL_STATUS, 0)
+    assert _decide(retention, NORMAL_STATUS, 1)[0]
+    assert not _decide(retention, NORMAL_STATUS, 2)[0]
+
+    retention = FrameRetention(RetentionPolicy(keep_transitions=False))
+    _decide(retention, FALL_STATUS, 0)
+    assert not _decide(retention, NORMAL_STATUS, 1)[0]
+
+
+def test_sampling_and_device_overrides():
+    default = RetentionPolicy(normal_sample_every=3)
+    retention = FrameRetention(default, {"busy": RetentionPolicy.from_dict({"normal_sample_every": 0}, default)})
+    assert [_decide(retention, NORMAL_STATUS, i)[0] for i in range(6)] == [False, False, True, False, False, True]
+    assert not any(_decide(retention, NORMAL_STATUS, i, device="busy")[0] for i in range(6))
+    assert retention.policy_for("busy").ring_size == default.ring_size
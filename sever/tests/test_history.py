@@ -0,0 +1,71 @@
+import json
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+
+import history
+
+
+@pytest.fixture
+def collection():
+    collection = mongomock.MongoClient().db.history
+    start = datetime(2024, 5, 1, 10, 0, 0)
+    # Pairs of entries share a timestamp, so pages must break ties on _id
+    collection.insert_many([
+        history.make_entry(start + timedelta(seconds=i // 2), f"cam-{i % 2}", "Kitchen",
+                           "Fall" if i % 5 == 0 else "Normal", i / 10, f"/images/{i:032x}.jpg")
+        for i in range(10)
+    ])
+    return collection
+
+
+def test_parse_limit():
+    assert history.parse_limit(None) == history.DEFAULT_PAGE_SIZE
+    assert history.parse_limit("10") == 10
+    assert history.parse_limit(str(history.MAX_PAGE_SIZE + 1)) == history.MAX_PAGE_SIZE
+    assert history.parse_limit(None, default=None, maximum=None) is None
+    assert history.parse_limit("100000", default=None, maximum=None) == 100000
+    with pytest.raises(ValueError, match="Invalid limit: abc"):
+        history.parse_limit("abc")
+    for value in ("0", "-5"):
+        with pytest.raises(ValueError, match="limit must be positive"):
+            history.parse_limit(value, default=None, maximum=None)
+
+
+def test_cursor_pages_cover_everything_once(collection):
+    seen, after = [], None
+    while True:
+        page = history.fetch_page(collection, history.build_query(collection, {"after": after}), 3)
+        seen += [item["id"] for item in page["items"]]
+        after = page["next"]
+        if after is None:
+            break
+    expected = [str(doc["_id"]) for doc in collection.find().sort(history.SORT_ORDER)]
+    assert seen == expected
+
+
+def test_filters(collection):
+    query = history.build_query(collection, {"status": "Fall", "device": "cam-0"})
+    items = history.fetch_page(collection, query, 50)["items"]
+    assert [(item["status"], item["device_id"]) for item in items] == [("Fall", "cam-0")]
+    query = history.build_query(collection, {"from": "2024-05-01T10:00:03", "to": "2024-05-01T10:00:04"})
+    assert len(history.fetch_page(collection, query, 50)["items"]) == 4
+
+
+@pytest.mark.parametrize("args, message", [
+    ({"after": "nope"}, "Invalid cursor"),
+    ({"after": "0" * 24}, "Unknown cursor"),
+    ({"from": "yesterday"}, "Invalid time"),
+])
+def test_bad_query_args(collection, args, message):
+    with pytest.raises(ValueError, match=message):
+        history.build_query(collection, args)
+
+
+def test_export_ndjson(collection):
+    lines = list(history.export_ndjson(collection, {}, limit=4))
+    assert len(lines) == 4
+    first = json.loads(lines[0])
+    assert first["timestamp"] == "2024-05-01 10:00:04" and first["probability"] == "90%"
+    assert len(list(history.export_ndjson(collection, {}))) == 10
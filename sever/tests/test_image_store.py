@@ -0,0 +1,72 @@
+import os
+
+import numpy as np
+import pytest
+
+from image_store import ImageStore, PackedStore, export_tar
+
+
+def _key(i):
+    return f"{i:032x}"
+
+
+def _segment(root):
+    return os.path.join(root, "seg-000001.pack")
+
+
+def test_dedup_and_loose_round_trip(tmp_path):
+    store = ImageStore(str(tmp_path))
+    frame = np.full((96, 96), 7, dtype=np.uint8)
+    key = store.key_for(frame)
+    assert store.put(key, frame)
+    assert not store.put(key, frame)
+    assert store.stats() == {"written": 1, "duplicates": 1, "bytes_written": len(store.get(key))}
+    assert [k for k, _ in store.items()] == [key]
+
+
+# A crash mid-append leaves a torn record; the writer cuts it off on open
+# and items() still returns every indexed record
+def test_torn_tail_is_truncated(tmp_path):
+    root = str(tmp_path)
+    store = PackedStore(root)
+    for i in range(3):
+        store.write(_key(i), b"x" * 10)
+    store.close()
+    size = os.path.getsize(_segment(root))
+    with open(_segment(root), 'ab') as f:
+        f.write(b"FIMG" + b"\0" * 7)
+
+    store = PackedStore(root)
+    assert os.path.getsize(_segment(root)) == size
+    for i in range(3, 6):
+        store.write(_key(i), b"y" * 10)
+    assert sorted(k for k, _ in store.items()) == [_key(i) for i in range(6)]
+    store.close()
+
+
+def test_read_only_never_touches_the_segment(tmp_path):
+    root = str(tmp_path)
+    writer = PackedStore(root)
+    writer.write(_key(1), b"a" * 10)
+    # Record written by the server but not indexed yet
+    with open(_segment(root), 'ab') as f:
+        f.write(b"FIMG" + b"\0" * 7)
+    size = os.path.getsize(_segment(root))
+
+    reader = ImageStore(root, packed=True, read_only=True)
+    assert os.path.getsize(_segment(root)) == size
+    assert reader.get(_key(1)) == b"a" * 10
+    assert export_tar(reader, str(tmp_path / "out.tar")) == 1
+    with pytest.raises(PermissionError):
+        reader.backend.write(_key(2), b"b")
+    with pytest.raises(PermissionError):
+        reader.delete(_key(1))
+    reader.close()
+    writer.close()
+
+
+def test_read_only_loose_store_does_not_create_root(tmp_path):
+    root = str(tmp_path / "missing")
+    store = ImageStore(root, read_only=True)
+    assert not os.path.exists(root)
+    assert store.get(_key(1)) is None
@@ -0,0 +1,70 @@
+import os
+
+import numpy as np
+import pytest
+
+from inference import InferenceBusy, InferenceEngine, decode_scores, input_lut
+
+MODEL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fall_model_int8.tflite")
+
+
+def _interpreter_cls():
+    return pytest.importorskip("ai_edge_litert.interpreter").Interpreter
+
+
+def test_lut_matches_int8_quantization():
+    detail = {"quantization": (1 / 255.0, -128), "dtype": np.int8}
+    pixels = np.arange(256, dtype=np.uint8)
+    # The shipped model's encoding: p / 255 / scale + zero_point == p - 128 == p ^ 0x80 as int8
+    assert np.array_equal(input_lut(detail), (pixels ^ 0x80).view(np.int8))
+
+
+def test_lut_for_float_and_other_quantization():
+    assert np.allclose(input_lut({"quantization": (0.0, 0), "dtype": np.float32}), np.arange(256) / 255.0)
+    lut = input_lut({"quantization": (1 / 127.5, 0), "dtype": np.int8})
+    assert lut.dtype == np.int8 and lut[0] == 0 and lut[255] == 127
+
+
+def test_decode_scores():
+    sigmoid = np.array([[0.2], [0.9]], dtype=np.float32)
+    assert decode_scores(sigmoid, {"quantization": (0.0, 0)}) == pytest.approx([0.2, 0.9])
+    softmax = np.array([[-128, 127], [127, -128]], dtype=np.int8)
+    assert decode_scores(softmax, {"quantization": (1 / 255.0, -128)}) == pytest.approx([1.0, 0.0])
+
+
+# Scores through the LUT and the in-place input tensor equal the plain
+# float -> quantize -> invoke path, one frame at a time
+def test_engine_matches_reference_quantization():
+    interpreter_cls = _interpreter_cls()
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 256, (96, 96), dtype=np.uint8) for _ in range(12)]
+
+    reference = interpreter_cls(model_path=MODEL)
+    reference.allocate_tensors()
+    inp, out = reference.get_input_details()[0], reference.get_output_details()[0]
+    expected = []
+    for frame in frames:
+        scale, zero_point = inp['quantization']
+        x = (frame.astype(np.float32) / 255.0).reshape(inp['shape'])
+        reference.set_tensor(inp['index'], np.round(x / scale + zero_point).astype(inp['dtype']))
+        reference.invoke()
+        expected += decode_scores(reference.get_tensor(out['index']), out)
+
+    engine = InferenceEngine(MODEL, interpreter_cls, pool_size=2, max_batch_size=8)
+    try:
+        assert engine.predict_many(frames, timeout=10) == pytest.approx(expected, abs=1e-6)
+        assert engine.predict(frames[0], timeout=10) == pytest.approx(expected[0], abs=1e-6)
+    finally:
+        engine.close()
+
+
+def test_engine_rejects_when_full_or_closed():
+    engine = InferenceEngine(MODEL, _interpreter_cls(), pool_size=1, max_queue=1, threaded=False)
+    frame = np.zeros((96, 96), dtype=np.uint8)
+    engine.submit(frame)
+    with pytest.raises(InferenceBusy):
+        engine.submit(frame)
+    assert isinstance(engine.predict_many([frame], timeout=0.1)[0], InferenceBusy)
+    engine.close()
+    with pytest.raises(InferenceBusy, match="closed"):
+        engine.submit(frame)
@@ -0,0 +1,17 @@
+import pytest
+
+import ingest
+
+
+def test_round_trip():
+    frames = [(1, 1700000000000, b"\x00" * 16), (2, 0, b"\xff" * 16)]
+    device_id, location, parsed = ingest.parse_batch(ingest.encode_batch("cam-1", frames, "Kitchen"))
+    assert (device_id, location) == ("cam-1", "Kitchen")
+    assert [(seq, ms, bytes(payload)) for seq, ms, payload in parsed] == frames
+
+
+@pytest.mark.parametrize("captured_ms", [ingest.MAX_CAPTURED_MS + 1, 2 ** 64 - 1])
+def test_rejects_out_of_range_capture_time(captured_ms):
+    data = ingest.encode_batch("cam-1", [(1, 1700000000000, b"\x00"), (2, captured_ms, b"\x00")])
+    with pytest.raises(ValueError, match="Capture time out of range"):
+        ingest.parse_batch(data)
@@ -0,0 +1,66 @@
+from live import ALL_ROOM, DeviceStatusFeed, LiveFeed, device_room, location_room, rooms_for
+
+
+class Recorder:
+    def __init__(self):
+        self.sent = []
+
+    def __call__(self, event, data, rooms):
+        self.sent.append((event, data, rooms))
+
+
+def test_rooms_for():
+    assert rooms_for("cam-1") == [ALL_ROOM, device_room("cam-1")]
+    assert rooms_for("cam-1", "Kitchen") == [ALL_ROOM, device_room("cam-1"), location_room("Kitchen")]
+
+
+def test_alert_is_pushed_at_once():
+    emit = Recorder()
+    feed = LiveFeed(emit, fall_status="Fall")
+    feed.publish({"device_id": "cam-1", "location": "Kitchen", "status": "Fall", "alert": True})
+    assert emit.sent == [("new_detection", {"device_id": "cam-1", "location": "Kitchen", "status": "Fall",
+                                            "alert": True}, rooms_for("cam-1", "Kitchen"))]
+    assert feed.stats()["alerts"] == 1
+
+
+def test_other_entries_are_coalesced_per_device():
+    emit = Recorder()
+    feed = LiveFeed(emit, max_items=2, fall_status="Fall")
+    for i in range(3):
+        feed.publish({"device_id": "cam-1", "location": "Kitchen", "status": "Normal", "score": i})
+    feed.publish({"device_id": "cam-1", "status": "Fall", "score": 9})
+    feed.publish({"device_id": "cam-2", "location": "Hall", "status": "Normal", "score": 0})
+    assert emit.sent == []
+
+    feed.flush()
+    summaries = {data["device_id"]: (event, data, rooms) for event, data, rooms in emit.sent}
+    event, data, rooms = summaries["cam-1"]
+    assert event == "detection_summary"
+    assert (data["count"], data["falls"], data["location"]) == (4, 1, "Kitchen")
+    assert [item["score"] for item in data["items"]] == [2, 9]
+    assert rooms == rooms_for("cam-1", "Kitchen")
+    assert summaries["cam-2"][1]["count"] == 1
+
+    emit.sent.clear()
+    feed.flush()
+    assert emit.sent == []
+    assert feed.stats() == {"alerts": 0, "coalesced": 5, "summaries": 2, "pending_devices": 0}
+
+
+class FakeRegistry:
+    def __init__(self):
+        self.devices = [{"mac": "aa", "ip": "10.0.0.2", "online": True, "last_seen": None}]
+
+    def all(self):
+        return self.devices
+
+
+def test_device_status_is_pushed_on_change_only():
+    emit = Recorder()
+    registry = FakeRegistry()
+    feed = DeviceStatusFeed(registry, emit)
+    assert [d["mac"] for d in feed.check()] == ["aa"]
+    assert feed.check() == []
+    registry.devices[0]["online"] = False
+    assert feed.check()[0]["online"] is False
+    assert [rooms for _, _, rooms in emit.sent] == [rooms_for("aa"), rooms_for("aa")]
@@ -0,0 +1,62 @@
+import pytest
+
+import metrics
+
+
+@pytest.fixture(autouse=True)
+def enabled():
+    metrics.configure(True)
+    yield
+    metrics.configure(False)
+
+
+def test_histogram_buckets_are_cumulative():
+    hist = metrics.Histogram("stage_seconds", "Stage time", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        hist.observe(value)
+    assert hist.render() == [
+        "# HELP stage_seconds Stage time",
+        "# TYPE stage_seconds histogram",
+        'stage_seconds_bucket{le="0.1"} 2',
+        'stage_seconds_bucket{le="1.0"} 3',
+        'stage_seconds_bucket{le="+Inf"} 4',
+        "stage_seconds_sum 2.65",
+        "stage_seconds_count 4",
+    ]
+
+
+def test_disabled_metrics_record_nothing():
+    metrics.configure(False)
+    hist = metrics.Histogram("h", "h")
+    counter = metrics.Counter("c", "c")
+    with hist.time():
+        pass
+    counter.inc()
+    assert hist.render()[-1] == "h_count 0"
+    assert counter.render() == ["# HELP c c", "# TYPE c counter"]
+
+
+def test_counter_labels_are_escaped():
+    counter = metrics.Counter("frames_total", "Frames", ("device",))
+    counter.inc('cam "1"')
+    counter.inc('cam "1"', amount=2)
+    assert counter.render()[-1] == 'frames_total{device="cam \\"1\\""} 3'
+
+
+def test_registry_skips_failing_gauges():
+    registry = metrics.Registry()
+    registry.register(metrics.Gauge("broken", "Broken", lambda: 1 / 0))
+    registry.register(metrics.Gauge("depth", "Depth", lambda: {("a",): 2}, ("queue",)))
+    assert registry.render() == '# HELP depth Depth\n# TYPE depth gauge\ndepth{queue="a"} 2\n'
+
+
+def test_rate_meter(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(metrics.time, "monotonic", lambda: now[0])
+    meter = metrics.RateMeter(alpha=0.5)
+    for _ in range(3):
+        meter.mark("cam")
+        now[0] += 0.5
+    assert meter.rates() == {("cam",): 2.0}
+    now[0] += 120
+    assert meter.rates() == {("cam",): 0.0}
@@ -0,0 +1,63 @@
+from datetime import datetime
+
+import mongomock
+
+import history
+import migrate_history
+
+
+# Records create_collection/insert_many/create_index; mongomock has no
+# time-series collections
+class FakeDatabase:
+    def __init__(self):
+        self.created = {}
+        self.collections = {}
+
+    def create_collection(self, name, **options):
+        self.created[name] = options
+        return self[name]
+
+    def __getitem__(self, name):
+        return self.collections.setdefault(name, FakeCollection())
+
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = []
+        self.indexes = []
+
+    def insert_many(self, docs, ordered=True):
+        self.docs.extend(docs)
+
+    def create_index(self, keys, **kwargs):
+        self.indexes.append(list(keys))
+
+
+def test_convert_legacy_entry():
+    assert migrate_history.convert({"timestamp": "2024-05-01 10:00:00", "probability": "87%"}) == {
+        "timestamp": datetime(2024, 5, 1, 10, 0, 0), "score": 0.87, "device_id": migrate_history.LEGACY_DEVICE_ID}
+    assert migrate_history.convert({"timestamp": datetime(2024, 5, 1), "score": 0.5, "device_id": "cam"}) == {}
+
+
+def test_copy_to_timeseries_uses_timeseries_indexes():
+    source = mongomock.MongoClient().db.history
+    source.insert_many([{"timestamp": datetime(2024, 5, 1, 10, i), "device_id": "cam", "score": 0.1}
+                        for i in range(5)] + [{"timestamp": "not migrated"}])
+    db = FakeDatabase()
+
+    assert migrate_history.copy_to_timeseries(db, source, "history_ts", batch_size=2) == 5
+    assert db.created["history_ts"]["timeseries"] == {
+        "timeField": "timestamp", "metaField": "device_id", "granularity": "seconds"}
+    indexes = db["history_ts"].indexes
+    assert [("device_id", 1), ("timestamp", 1)] in indexes
+    # No _id tie-break keys on a time-series collection
+    assert not any(key == "_id" for index in indexes for key, _ in index)
+
+
+def test_ensure_indexes_regular_collection():
+    collection = FakeCollection()
+    history.ensure_indexes(collection)
+    assert history.SORT_ORDER in collection.indexes
+    collection = FakeCollection()
+    history.ensure_indexes(collection, timeseries=True)
+    assert history.SORT_ORDER not in collection.indexes
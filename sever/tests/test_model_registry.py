@@ -0,0 +1,94 @@
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from inference import InferenceEngine
+from model_registry import ModelRegistry, UnknownModel
+
+pytest.importorskip("ai_edge_litert.interpreter")
+
+MODEL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fall_model_int8.tflite")
+
+
+@pytest.fixture
+def registry(tmp_path):
+    for version in ("v1", "v2"):
+        shutil.copy(MODEL, tmp_path / f"{version}.tflite")
+    (tmp_path / "notes.txt").write_text("not a model")
+    registry = ModelRegistry(str(tmp_path), MODEL, pool_size=1, max_batch_size=4)
+    yield registry
+    registry.close()
+
+
+def test_versions(registry):
+    assert sorted(registry.versions()) == ["fall_model_int8", "v1", "v2"]
+    with pytest.raises(UnknownModel):
+        registry.activate("v3")
+    assert not registry.ready
+
+
+# Frames keep being answered while the active model is swapped underneath
+def test_hot_swap_under_load(registry):
+    registry.activate("v1")
+    frame = np.zeros((96, 96), dtype=np.uint8)
+    expected = registry.predict(frame, timeout=5)
+    errors, scores, stop = [], [], threading.Event()
+
+    def load():
+        while not stop.is_set():
+            for score in registry.predict_many([frame] * 4, timeout=5):
+                (errors if isinstance(score, Exception) else scores).append(score)
+
+    threads = [threading.Thread(target=load) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for version in ("v2", "v1", "v2"):
+        time.sleep(0.05)
+        old = registry.engine
+        registry.activate(version)
+        assert registry.engine is not old
+    stop.set()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert scores and all(s == pytest.approx(expected) for s in scores)
+    assert registry.stats()["active"] == "v2"
+
+
+def test_shadow_scores_are_compared(registry):
+    registry.activate("v1")
+    registry.set_shadow("v2")
+    frames = [np.full((96, 96), v, dtype=np.uint8) for v in (0, 128, 255)]
+    registry.predict_many(frames, timeout=5)
+    deadline = time.monotonic() + 5
+    while registry.shadow_stats.snapshot()["compared"] < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    shadow = registry.stats()["shadow"]
+    assert (shadow["version"], shadow["compared"], shadow["disagreements"], shadow["max_abs_diff"]) == ("v2", 3, 0, 0)
+    registry.set_shadow(None)
+    assert registry.stats()["shadow"] is None
+
+
+class SmallFrameEngine(InferenceEngine):
+    def __init__(self, *args, **kwargs):
+        self.closed = False
+        self.frame_shape = (48, 48, 1)
+        self.frame_size = 48 * 48
+
+    def close(self):
+        self.closed = True
+
+
+def test_wrong_frame_size_is_rejected_and_active_model_kept(registry):
+    registry.activate("v1")
+    active = registry.engine
+    registry.engine_cls = SmallFrameEngine
+    with pytest.raises(ValueError, match="2304 pixels per frame"):
+        registry.activate("v2")
+    with pytest.raises(ValueError):
+        registry.set_shadow("v2")
+    assert registry.engine is active and registry.stats()["active"] == "v1"
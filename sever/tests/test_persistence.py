@@ -0,0 +1,77 @@
+import threading
+import time
+
+import mongomock
+import numpy as np
+from bson import ObjectId
+
+from image_store import ImageStore
+from persistence import WriteBehindPipeline
+
+
+def _frame(value):
+    return np.full((96, 96), value, dtype=np.uint8)
+
+
+def _job(store, value):
+    frame = _frame(value)
+    key = store.key_for(frame)
+    return frame, key, {"_id": ObjectId(), "image_path": store.url_for(key), "score": value / 255}
+
+
+def test_writes_images_and_entries(tmp_path):
+    collection = mongomock.MongoClient().db.history
+    store = ImageStore(str(tmp_path))
+    saved = []
+    writer = WriteBehindPipeline(collection, store, on_saved=saved.append, workers=2, batch_size=4,
+                                 flush_interval=0.01)
+    jobs = [_job(store, v) for v in range(10)]
+    for job in jobs:
+        assert writer.submit(*job)
+    writer.close()
+    assert collection.count_documents({}) == 10
+    assert all(store.get(key) for _, key, _ in jobs)
+    assert sorted(e["_id"] for e in saved) == sorted(e["_id"] for _, _, e in jobs)
+    assert writer.stats()["written"] == 10
+
+
+def test_partial_insert_reports_the_inserted_rows(tmp_path):
+    collection = mongomock.MongoClient().db.history
+    store = ImageStore(str(tmp_path))
+    jobs = [_job(store, v) for v in range(3)]
+    collection.insert_one(dict(jobs[1][2]))
+    saved = []
+    writer = WriteBehindPipeline(collection, store, on_saved=saved.append, workers=1, batch_size=3,
+                                 flush_interval=0.5)
+    for job in jobs:
+        writer.submit(*job)
+    writer.close()
+    assert [e["_id"] for e in saved] == [jobs[0][2]["_id"], jobs[2][2]["_id"]]
+    stats = writer.stats()
+    assert (stats["written"], stats["failed"]) == (2, 1)
+
+
+def test_waits_for_ready_and_drops_when_full(tmp_path):
+    collection = mongomock.MongoClient().db.history
+    store = ImageStore(str(tmp_path))
+    ready = threading.Event()
+    writer = WriteBehindPipeline(collection, store, workers=1, max_queue=2, flush_interval=0.01, ready=ready)
+    assert writer.submit(*_job(store, 1))
+    assert writer.submit(*_job(store, 2))
+    assert not writer.submit(*_job(store, 3))
+    time.sleep(0.2)
+    assert collection.count_documents({}) == 0
+    ready.set()
+    writer.close()
+    assert collection.count_documents({}) == 2
+    assert writer.stats()["dropped"] == 1
+
+
+def test_close_does_not_hang_when_never_ready(tmp_path):
+    store = ImageStore(str(tmp_path))
+    writer = WriteBehindPipeline(mongomock.MongoClient().db.history, store, workers=2, ready=threading.Event())
+    writer.submit(*_job(store, 1))
+    started = time.monotonic()
+    writer.close(timeout=2.0)
+    assert time.monotonic() - started < 1.0
+    assert writer.stats()["dropped"] == 1
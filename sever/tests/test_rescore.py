@@ -0,0 +1,37 @@
+import csv
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import rescore
+
+MODEL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fall_model_int8.tflite")
+
+
+# The usage lines at the top of rescore.py
+@pytest.mark.parametrize("argv", [
+    ["--model", "models/v2.tflite", "dir", "../img_train", "--out", "v2.csv"],
+    ["--model", "models/v2.tflite", "csv", "image_labels.csv", "--images", "../img_train", "--out", "v2.csv"],
+    ["--model", "models/v2.tflite", "history", "--update"],
+])
+def test_documented_usage_parses(argv):
+    args = rescore.build_parser().parse_args(argv)
+    assert args.out == ("v2.csv" if args.source != "history" else None)
+
+
+def test_resume_with_another_version_is_refused(tmp_path):
+    images = tmp_path / "images"
+    images.mkdir()
+    for i in range(3):
+        Image.fromarray(np.full((96, 96), i * 80, dtype=np.uint8)).save(images / f"{i}.jpg")
+    out = str(tmp_path / "scores.csv")
+    base = ["--model", MODEL, "--workers", "1", "--chunk-size", "2"]
+
+    totals = rescore.main(base + ["--version", "v1", "dir", str(images), "--out", out])
+    assert totals["scored"] == 3
+    with open(out, newline='') as f:
+        assert {row["model"] for row in csv.DictReader(f)} == {"v1"}
+    with pytest.raises(ValueError, match="different run"):
+        rescore.main(base + ["--version", "v2", "dir", str(images), "--out", out])
@@ -0,0 +1,79 @@
+import os
+
+from image_store import ImageStore
+from retention import OrphanSweeper, legacy_url_prefix
+
+
+# Answers the sweeper's `$in` lookups from a fixed set of referenced URLs
+class FakeHistory:
+    def __init__(self, image_paths):
+        self.image_paths = set(image_paths)
+
+    def distinct(self, field, query):
+        return [url for url in query[field]["$in"] if url in self.image_paths]
+
+
+def test_legacy_url_prefix():
+    assert legacy_url_prefix("static/uploads", "static") == "/static/uploads"
+    assert legacy_url_prefix("static", "static") == "/static"
+    assert legacy_url_prefix("/srv/other", "/srv/app/static") is None
+
+
+# The old app saved uploads under static/uploads and stored "/static/uploads/<name>";
+# an absolute UPLOAD_FOLDER for the same directory must map to those URLs
+def test_sweeper_with_absolute_upload_folder(tmp_path):
+    static_dir = tmp_path / "static"
+    upload_dir = static_dir / "uploads"
+    upload_dir.mkdir(parents=True)
+    for name in ("kept.jpg", "orphan.jpg"):
+        (upload_dir / name).write_bytes(b"jpeg")
+
+    store = ImageStore(str(upload_dir / "images"))
+    history = FakeHistory({"/static/uploads/kept.jpg"})
+    url = legacy_url_prefix(str(upload_dir), str(static_dir))
+    assert url == "/static/uploads"
+    sweeper = OrphanSweeper(history, store, legacy_dir=str(upload_dir), legacy_url=url)
+
+    # An orphan has to stay unreferenced over two sweeps
+    assert sweeper.sweep()["deleted"] == 0
+    report = sweeper.sweep()
+    assert report == {"checked": 2, "deleted": 1, "bytes": 4}
+    assert sorted(os.listdir(upload_dir)) == ["images", "kept.jpg"]
+
+
+def test_downsample_rolls_old_normals_into_hourly_aggregates():
+    import mongomock
+    from datetime import datetime, timedelta
+    from retention import downsample
+
+    db = mongomock.MongoClient().db
+    old = datetime.now().replace(minute=0, second=0, microsecond=0) - timedelta(days=2)
+    db.history.insert_many(
+        [{"timestamp": old + timedelta(minutes=i), "status": "Normal", "device_id": "cam", "location": "Hall",
+          "score": 0.1 * (i % 3)} for i in range(90)]
+        + [{"timestamp": old, "status": "Normal", "device_id": "cam", "location": "Hall", "score": 0.2,
+            "pre_event": True},
+           {"timestamp": old, "status": "Fall", "device_id": "cam", "location": "Hall", "score": 0.9},
+           {"timestamp": datetime.now(), "status": "Normal", "device_id": "cam", "location": "Hall", "score": 0.1}])
+
+    report = downsample(db.history, db.hourly, "Normal", timedelta(hours=24))
+    assert report == {"entries": 90, "hours": 2}
+    hours = list(db.hourly.find({}, {"_id": 0}).sort("hour", 1))
+    assert [(h["hour"], h["count"]) for h in hours] == [(old, 60), (old + timedelta(hours=1), 30)]
+    assert hours[0]["score_max"] == 0.2
+    # Pre-event frames, falls and recent normals stay
+    assert db.history.count_documents({}) == 3
+
+
+def test_ttl_indexes_per_status():
+    import mongomock
+    from retention import ensure_ttl_indexes
+
+    collection = mongomock.MongoClient().db.history
+    assert ensure_ttl_indexes(collection, {"Normal": 30, "Fall": None}) == {"Normal": 30}
+    ttl = [info for name, info in collection.index_information().items() if name.startswith("ttl_")]
+    assert [(info["expireAfterSeconds"], info["partialFilterExpression"]) for info in ttl] == [
+        (30 * 86400, {"status": "Normal"})]
+    # Dropped when the TTL is turned off
+    ensure_ttl_indexes(collection, {"Normal": None})
+    assert not any(name.startswith("ttl_") for name in collection.index_information())
@@ -0,0 +1,41 @@
+import time
+
+from startup import StartupTasks
+
+
+def _wait(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_tasks_run_in_background_and_retry():
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ConnectionError("not yet")
+
+    tasks = StartupTasks()
+    tasks.add("mongo", flaky, retry_interval=0.01)
+    tasks.add("model", lambda: None)
+    tasks.start()
+    assert _wait(tasks.is_ready)
+    status = tasks.status()
+    assert status["mongo"]["attempts"] == 3 and status["mongo"]["error"] is None
+    assert status["model"]["ready"] and status["model"]["seconds"] is not None
+
+
+def test_task_without_retry_reports_its_error():
+    def broken():
+        raise RuntimeError("bad model")
+
+    tasks = StartupTasks()
+    tasks.add("model", broken)
+    tasks.start()
+    assert _wait(lambda: tasks.status()["model"]["error"] == "bad model")
+    time.sleep(0.05)
+    assert not tasks.is_ready("model")
+    assert tasks.status()["model"]["attempts"] == 1
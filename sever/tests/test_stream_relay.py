@@ -0,0 +1,88 @@
+import http.server
+import threading
+import time
+
+import pytest
+
+from stream_relay import MJPEGParser, RelayHub, encode_part
+
+
+def test_parser_handles_split_chunks():
+    stream = encode_part(b"one") + encode_part(b"two\r\nwith crlf") + encode_part(b"three")
+    parser = MJPEGParser()
+    frames = []
+    for i in range(0, len(stream), 7):
+        frames += parser.feed(stream[i:i + 7])
+    # The last part stays buffered until the next boundary proves it complete
+    assert frames[:2] == [b"one", b"two\r\nwith crlf"]
+
+
+def test_parser_without_content_length():
+    parser = MJPEGParser()
+    data = b"--frame\r\nContent-Type: image/jpeg\r\n\r\nabc\r\n--frame\r\nContent-Type: image/jpeg\r\n\r\n"
+    assert parser.feed(data) == [b"abc"]
+
+
+@pytest.fixture
+def camera():
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=frame')
+            self.end_headers()
+            try:
+                for i in range(200):
+                    self.wfile.write(encode_part(f"jpeg{i}".encode()))
+                    self.wfile.flush()
+                    time.sleep(0.01)
+            except OSError:
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/stream"
+    server.shutdown()
+    server.server_close()
+
+
+def test_viewers_share_one_upstream(camera):
+    hub = RelayHub(lambda mac: camera, lambda mac: True, max_viewers=2)
+    first, second = hub.subscribe("aa"), hub.subscribe("aa")
+    assert hub.subscribe("aa") is None
+    assert hub.viewer_count() == 2
+    a, b = next(first), next(second)
+    assert a.startswith(b"--frame") and b.startswith(b"--frame")
+    assert hub.stats()["aa"]["viewers"] == 2 and hub.stats()["aa"]["running"]
+    first.close()
+    second.close()
+    assert hub.viewer_count() == 0
+    assert hub.subscribe("aa") is not None
+
+
+# Capacity is reserved when subscribe() returns, not on the first chunk
+def test_concurrent_subscribers_respect_the_limit():
+    hub = RelayHub(lambda mac: "http://127.0.0.1:1/", lambda mac: True, max_viewers=5)
+    viewers = []
+    threads = [threading.Thread(target=lambda: viewers.append(hub.subscribe("aa"))) for _ in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sum(v is not None for v in viewers) == 5
+    for v in viewers:
+        if v is not None:
+            v.close()
+    assert hub.viewer_count() == 0
+
+
+def test_stopped_relay_is_pruned():
+    hub = RelayHub(lambda mac: "http://127.0.0.1:1/", lambda mac: False)
+    viewer = hub.subscribe("aa")
+    assert list(viewer) == []
+    deadline = time.monotonic() + 2
+    while hub.stats() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert hub.stats() == {}
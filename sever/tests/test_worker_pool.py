@@ -0,0 +1,52 @@
+import os
+
+import numpy as np
+import pytest
+
+from inference import InferenceEngine
+from worker_pool import ProcessInferenceEngine
+
+MODEL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fall_model_int8.tflite")
+
+
+@pytest.fixture(scope="module")
+def interpreter_cls():
+    return pytest.importorskip("ai_edge_litert.interpreter").Interpreter
+
+
+def test_workers_match_in_process_engine(interpreter_cls):
+    rng = np.random.default_rng(1)
+    frames = [rng.integers(0, 256, (96, 96), dtype=np.uint8) for _ in range(16)]
+    local = InferenceEngine(MODEL, interpreter_cls, max_batch_size=1)
+    try:
+        expected = [local.predict(frame, timeout=10) for frame in frames]
+    finally:
+        local.close()
+
+    engine = ProcessInferenceEngine(MODEL, interpreter_cls, pool_size=2, max_batch_size=4, pin_cpus=False)
+    try:
+        assert engine.frame_size == 96 * 96
+        assert engine.predict_many(frames, timeout=30) == pytest.approx(expected, abs=1e-6)
+        stats = engine.worker_stats()
+        assert len(stats) == 2 and all(w["ready"] for w in stats)
+        assert sum(w["frames"] for w in stats) == len(frames)
+    finally:
+        engine.close()
+
+
+def test_wrong_size_frame_and_close(interpreter_cls):
+    engine = ProcessInferenceEngine(MODEL, interpreter_cls, pool_size=1, max_queue=4, pin_cpus=False)
+    shm_path = os.path.join("/dev/shm", engine._ring.name.lstrip("/"))
+    processes = [w.process for w in engine._workers.values()]
+    try:
+        with pytest.raises(ValueError):
+            engine.predict(np.zeros(10, dtype=np.uint8), timeout=5)
+        # The bad frame took no slot: all four still fit
+        pending = [engine.submit(np.zeros(96 * 96, dtype=np.uint8)) for _ in range(4)]
+        assert all(0.0 <= p.result(timeout=10) <= 1.0 for p in pending)
+        if os.path.isdir("/dev/shm"):
+            assert os.path.exists(shm_path)
+    finally:
+        engine.close()
+    assert all(p.poll() is not None for p in processes)
+    assert not os.path.exists(shm_path)
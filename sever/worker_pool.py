@@ -0,0 +1,460 @@
+import argparse
+import importlib
+import logging
+import os
+import secrets
+import subprocess
+import sys
+import time
+from multiprocessing import shared_memory
+from multiprocessing.connection import Client, Listener, wait
+
+import numpy as np
+
+import metrics
+from inference import InferenceBusy, InferenceEngine, PendingResult
+
+# Like InferenceEngine, the bookkeeping threads must be real OS threads
+try:
+    from eventlet.patcher import original
+    threading = original('threading')
+except ImportError:
+    import threading
+
+AUTHKEY_ENV = "FALL_WORKER_AUTHKEY"
+
+
+class WorkerLost(Exception):
+    pass
+
+
+# Fixed-size frame slots in one shared memory block. The web process copies
+# each frame into a free slot and sends the workers only slot numbers.
+class FrameRing:
+    def __init__(self, slots, frame_size, name=None):
+        self.slots = slots
+        self.frame_size = frame_size
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=slots * frame_size)
+        else:
+            self.shm = _attach(name)
+        self.frames = np.ndarray((slots, frame_size), dtype=np.uint8, buffer=self.shm.buf)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def close(self, unlink=False):
+        del self.frames
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+# Attaches without registering the block with this process's resource
+# tracker, which would otherwise unlink it when a worker exits
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class _Worker:
+    def __init__(self, worker_id, process, cpu):
+        self.id = worker_id
+        self.process = process
+        self.cpu = cpu
+        self.conn = None
+        self.ready = False
+        self.inflight = set()
+        self.last_progress = time.monotonic()
+        self.send_lock = threading.Lock()
+        self.batches = 0
+        self.frames = 0
+
+
+def _interpreter_path(interpreter_cls):
+    return f"{interpreter_cls.__module__}:{interpreter_cls.__qualname__}"
+
+
+# Inference in separate worker processes, one interpreter each, so scoring
+# is not bound by the web process's GIL. Same interface as InferenceEngine.
+# Frames go through a shared memory ring; each worker gathers its queued
+# slots into batches and posts the scores back. A health check restarts
+# workers that exit or stop making progress, failing the frames they held.
+class ProcessInferenceEngine:
+    def __init__(self, model_path, interpreter_cls, pool_size=2, max_batch_size=8, max_wait_ms=5.0,
+                 num_threads=1, max_queue=256, pin_cpus=True, hang_timeout=10.0, health_interval=0.5,
+                 restart_delay=1.0, startup_timeout=60.0):
+        self.model_path = model_path
+        self.interpreter = _interpreter_path(interpreter_cls)
+        self.max_wait_ms = max_wait_ms
+        self.num_threads = num_threads
+        self.pin_cpus = pin_cpus and hasattr(os, 'sched_setaffinity')
+        self.hang_timeout = hang_timeout
+        self.health_interval = health_interval
+        self.restart_delay = restart_delay
+        self.requested_batch_size = max(1, max_batch_size)
+        self.frame_shape = None
+        self.max_batch_size = None
+        self.restarts = 0
+
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._closed = False
+        self._pending = {}
+        self._free = list(range(max_queue))
+        self._ring = None
+        self._max_queue = max_queue
+        self._authkey = secrets.token_bytes(16)
+        self._listener = Listener(authkey=self._authkey)
+        self._workers = {}
+        self._failure = None
+        self._shut_down = False
+        threading.Thread(target=self._accept_loop, name="inference-accept", daemon=True).start()
+        threading.Thread(target=self._result_loop, name="inference-results", daemon=True).start()
+
+        # The first worker reports the frame shape, which sizes the ring
+        self._spawn(0)
+        self._wait_ready(lambda: self.frame_shape is not None, startup_timeout)
+        self.frame_size = int(np.prod(self.frame_shape))
+        self._ring = FrameRing(max_queue, self.frame_size)
+        first = self._workers[0]
+        with first.send_lock:
+            first.conn.send(("ring", self._ring.name, max_queue, self.frame_size))
+        for worker_id in range(1, max(1, pool_size)):
+            self._spawn(worker_id)
+        self._wait_ready(lambda: len(self._workers) == max(1, pool_size)
+                         and all(w.ready for w in self._workers.values()), startup_timeout)
+        logging.info(f"Inference workers ready: {len(self._workers)} process(es), "
+                     f"max batch {self.max_batch_size}, max wait {max_wait_ms}ms")
+
+    def _spawn(self, worker_id):
+        cpu = None
+        if self.pin_cpus:
+            cpus = sorted(os.sched_getaffinity(0))
+            cpu = cpus[worker_id % len(cpus)]
+        cmd = [sys.executable, os.path.abspath(__file__), '--address', self._listener.address,
+               '--worker-id', str(worker_id), '--model', os.path.abspath(self.model_path),
+               '--interpreter', self.interpreter, '--num-threads', str(self.num_threads), '--max-batch', str(self.requested_batch_size),
+               '--max-wait-ms', str(self.max_wait_ms)]
+        if cpu is not None:
+            cmd += ['--cpu', str(cpu)]
+        env = dict(os.environ, **{AUTHKEY_ENV: self._authkey.hex()})
+        process = subprocess.Popen(cmd, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+        with self._lock:
+            self._workers[worker_id] = _Worker(worker_id, process, cpu)
+
+    def _wait_ready(self, predicate, timeout):
+        deadline = time.monotonic() + timeout
+        error = None
+        with self._changed:
+            while not predicate():
+                if self._failure is not None:
+                    error = f"Inference worker failed to start: {self._failure}"
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    error = "Inference workers did not start in time"
+                    break
+                self._changed.wait(remaining)
+        if error is not None:
+            self._shutdown()
+            raise RuntimeError(error)
+
+    # Workers connect back, say who they are, and once attached to the ring report ready
+    def _accept_loop(self):
+        while True:
+            try:
+                conn = self._listener.accept()
+                hello = conn.recv()
+            except (OSError, EOFError):
+                if self._closed:
+                    return
+                continue
+            kind, worker_id = hello[0], hello[1]
+            with self._changed:
+                worker = self._workers.get(worker_id)
+                if worker is None or self._closed:
+                    conn.close()
+                    continue
+                if kind == "failed":
+                    self._failure = hello[2]
+                    conn.close()
+                else:
+                    worker.conn = conn
+                    self.frame_shape, self.max_batch_size = hello[2], hello[3]
+                    if self._ring is not None:
+                        with worker.send_lock:
+                            conn.send(("ring", self._ring.name, self._max_queue, self.frame_size))
+                self._changed.notify_all()
+
+    def _result_loop(self):
+        while True:
+            with self._lock:
+                if self._closed and not self._pending:
+                    break
+                conns = {w.conn: w for w in self._workers.values() if w.conn is not None}
+            try:
+                ready = wait(list(conns), timeout=self.health_interval) if conns else []
+            except (OSError, ValueError):
+                # close() shut the connections down under us
+                continue
+            for conn in ready:
+                worker = conns[conn]
+                try:
+                    message = conn.recv()
+                except (OSError, EOFError):
+                    self._lose(worker, "connection closed")
+                    continue
+                self._handle(worker, message)
+            if not conns:
+                time.sleep(self.health_interval)
+            self._check_health()
+        self._shutdown()
+
+    def _handle(self, worker, message):
+        kind = message[0]
+        if kind == "ready":
+            with self._changed:
+                worker.ready = True
+                worker.last_progress = time.monotonic()
+                self._changed.notify_all()
+            return
+        _, results, invoke_seconds, error = message
+        metrics.BATCH_SIZE.observe(len(results))
+        metrics.INVOKE.observe(invoke_seconds)
+        done = []
+        with self._changed:
+            worker.last_progress = time.monotonic()
+            worker.batches += 1
+            worker.frames += len(results)
+            for slot, score in results:
+                worker.inflight.discard(slot)
+                pending = self._pending.pop(slot, None)
+                self._free.append(slot)
+                if pending is not None:
+                    done.append((pending, score))
+            self._changed.notify_all()
+        for pending, score in done:
+            if error is not None:
+                pending.set_exception(RuntimeError(error))
+            else:
+                pending.set_result(score)
+
+    def _check_health(self):
+        now = time.monotonic()
+        for worker in list(self._workers.values()):
+            if worker.process.poll() is not None:
+                self._lose(worker, f"exited with code {worker.process.returncode}")
+            elif worker.inflight and now - worker.last_progress > self.hang_timeout:
+                worker.process.kill()
+                self._lose(worker, f"no progress for {self.hang_timeout}s")
+
+    # Fails the worker's frames and starts a replacement
+    def _lose(self, worker, reason):
+        with self._changed:
+            if self._workers.get(worker.id) is not worker:
+                return
+            lost = [self._pending.pop(slot) for slot in worker.inflight if slot in self._pending]
+            self._free.extend(worker.inflight)
+            worker.inflight.clear()
+            worker.ready = False
+            del self._workers[worker.id]
+            closed = self._closed
+            self._changed.notify_all()
+        logging.error(f"Inference worker {worker.id} lost ({reason}), failing {len(lost)} frame(s)")
+        if worker.process.poll() is None:
+            worker.process.kill()
+            worker.process.wait()
+        if worker.conn is not None:
+            worker.conn.close()
+        for pending in lost:
+            pending.set_exception(WorkerLost(f"Inference worker {worker.id} {reason}"))
+        if not closed:
+            threading.Thread(target=self._restart, args=(worker.id,), daemon=True).start()
+
+    def _restart(self, worker_id):
+        time.sleep(self.restart_delay)
+        with self._lock:
+            if self._closed:
+                return
+            self.restarts += 1
+        self._spawn(worker_id)
+
+    # Copies the frame into a free slot and queues it on the least busy worker.
+    # A frame of the wrong size fails on its own without taking a slot.
+    def submit(self, frame):
+        pending = PendingResult()
+        frame = np.asarray(frame, dtype=np.uint8).reshape(-1)
+        if frame.size != self.frame_size:
+            pending.set_exception(ValueError(f"Frame has {frame.size} pixels, model expects {self.frame_size}"))
+            return pending
+        with self._lock:
+            if self._closed:
+                raise InferenceBusy("Inference engine closed")
+            workers = [w for w in self._workers.values() if w.ready]
+            if not workers:
+                raise InferenceBusy("No inference worker available")
+            if not self._free:
+                raise InferenceBusy("Inference queue full")
+            slot = self._free.pop()
+            try:
+                np.copyto(self._ring.frames[slot], frame)
+            except Exception:
+                self._free.append(slot)
+                raise
+            worker = min(workers, key=lambda w: len(w.inflight))
+            if not worker.inflight:
+                worker.last_progress = time.monotonic()
+            worker.inflight.add(slot)
+            self._pending[slot] = pending
+        try:
+            with worker.send_lock:
+                worker.conn.send(slot)
+        except (OSError, ValueError):
+            # The worker died after being picked; the health check fails the frame
+            pass
+        return pending
+
+    def predict(self, frame, timeout=None):
+        return self.submit(frame).result(timeout=timeout)
+
+    def predict_many(self, frames, timeout=None):
+        pending = []
+        for frame in frames:
+            try:
+                pending.append(self.submit(frame))
+            except InferenceBusy as e:
+                pending.append(e)
+        return InferenceEngine.collect(pending, timeout)
+
+    collect = staticmethod(InferenceEngine.collect)
+
+    def queue_depth(self):
+        with self._lock:
+            return len(self._pending)
+
+    def worker_stats(self):
+        with self._lock:
+            return [{"id": w.id, "pid": w.process.pid, "cpu": w.cpu, "ready": w.ready, "inflight": len(w.inflight),
+                     "batches": w.batches, "frames": w.frames} for w in sorted(self._workers.values(), key=lambda w: w.id)]
+
+    # Frames already queued are still scored (up to `timeout` seconds), then
+    # the workers are stopped and the shared memory is unlinked before returning
+    def close(self, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            self._closed = True
+            while self._pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logging.warning(f"Closing inference workers with {len(self._pending)} frame(s) unscored")
+                    break
+                self._changed.wait(remaining)
+        self._shutdown()
+
+    def _shutdown(self, unlink=True):
+        with self._lock:
+            if self._shut_down:
+                return
+            self._closed = self._shut_down = True
+            workers = list(self._workers.values())
+            # Dropped from the pool first so the health check does not report them lost
+            self._workers.clear()
+            lost, self._pending = list(self._pending.values()), {}
+        for pending in lost:
+            pending.set_exception(InferenceBusy("Inference engine closed"))
+        for worker in workers:
+            try:
+                if worker.conn is not None:
+                    with worker.send_lock:
+                        worker.conn.send(None)
+            except (OSError, ValueError):
+                pass
+        for worker in workers:
+            try:
+                worker.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                worker.process.kill()
+            if worker.conn is not None:
+                worker.conn.close()
+        self._listener.close()
+        if self._ring is not None:
+            self._ring.close(unlink=unlink)
+
+
+# --- Worker process ------------------------------------------------------------
+
+def _collect(conn, first, max_batch, max_wait):
+    slots = [first]
+    deadline = time.monotonic() + max_wait
+    while len(slots) < max_batch:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not conn.poll(remaining):
+            break
+        slot = conn.recv()
+        if slot is None:
+            return slots, True
+        slots.append(slot)
+    return slots, False
+
+
+def worker_main():
+    parser = argparse.ArgumentParser(description="Inference worker process (started by ProcessInferenceEngine)")
+    parser.add_argument('--address', required=True)
+    parser.add_argument('--worker-id', type=int, required=True)
+    parser.add_argument('--model', required=True)
+    parser.add_argument('--interpreter', required=True, help="module:Class of the interpreter")
+    parser.add_argument('--num-threads', type=int, default=1)
+    parser.add_argument('--max-batch', type=int, default=8)
+    parser.add_argument('--max-wait-ms', type=float, default=5.0)
+    parser.add_argument('--cpu', type=int)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format=f'%(asctime)s [%(levelname)s] worker {args.worker_id}: %(message)s')
+
+    conn = Client(args.address, authkey=bytes.fromhex(os.environ.pop(AUTHKEY_ENV)))
+    if args.cpu is not None:
+        os.sched_setaffinity(0, {args.cpu})
+    try:
+        module, name = args.interpreter.split(':')
+        interpreter_cls = importlib.import_module(module)
+        for part in name.split('.'):
+            interpreter_cls = getattr(interpreter_cls, part)
+        engine = InferenceEngine(args.model, interpreter_cls, pool_size=1, max_batch_size=args.max_batch,
+                                 num_threads=args.num_threads, threaded=False)
+    except Exception as e:
+        conn.send(("failed", args.worker_id, str(e)))
+        return
+    conn.send(("hello", args.worker_id, tuple(int(d) for d in engine.frame_shape), engine.max_batch_size))
+
+    _, ring_name, slots, frame_size = conn.recv()
+    ring = FrameRing(slots, frame_size, name=ring_name)
+    conn.send(("ready",))
+    max_wait = args.max_wait_ms / 1000.0
+    stopping = False
+    try:
+        while not stopping:
+            first = conn.recv()
+            if first is None:
+                break
+            batch, stopping = _collect(conn, first, engine.max_batch_size, max_wait)
+            started = time.perf_counter()
+            try:
+                scores = engine.run_batch([ring.frames[slot] for slot in batch])
+                error = None
+            except Exception as e:
+                scores, error = [None] * len(batch), str(e)
+            conn.send(("scores", list(zip(batch, scores)), time.perf_counter() - started, error))
+    except (EOFError, OSError):
+        pass
+    finally:
+        ring.close()
+
+
+if __name__ == '__main__':
+    worker_main()